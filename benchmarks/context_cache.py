@@ -0,0 +1,97 @@
+"""
+Compares story requests with and without context caching of the static prefix.
+
+Sends the same requests once with full prompts and once with the few-shot prefix
+served from a cached-content handle, and reports per request the input tokens,
+the cached tokens, the billed-equivalent input tokens, the payload sent and the
+latency. Runs offline against storyteller.fakes.FakeGenAIClient by default;
+--backend real uses GOOGLE_API_KEY and spends quota.
+
+Usage (from the repository root):
+    python -m benchmarks.context_cache --requests 20
+"""
+import argparse
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+from storyteller.context_cache import ContextCacheManager
+from storyteller.core import GenAIAgent, generate_story_with_llm, get_shared_client
+from storyteller.fakes import FakeGenAIClient
+from storyteller.language_packs import DEFAULT_LANGUAGE, available_languages, get_language_pack
+
+# Cached input tokens are billed at a quarter of the regular input price
+CACHED_TOKEN_PRICE_RATIO = 0.25
+
+
+def payload_bytes(contents: list) -> int:
+    return sum(
+        len(item.encode("utf-8")) if isinstance(item, str) else len(item.inline_data.data)
+        for item in contents
+    )
+
+
+class _PayloadRecordingClient:
+    # Wraps a client to record the size of what each request actually sends
+    def __init__(self, client):
+        self._client = client
+        self.caches = client.caches
+        self.aio = SimpleNamespace(models=self)
+        self.sent_bytes = []
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.sent_bytes.append(payload_bytes(contents))
+        return await self._client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+
+def run(client, model_id: str, language: str, images: list, request_count: int, context_cache) -> dict:
+    recording_client = _PayloadRecordingClient(client)
+    agent = GenAIAgent(model_id, language, genai_client=recording_client, context_cache=context_cache)
+    logs = []
+    latencies = []
+    for _ in range(request_count):
+        start_time = time.perf_counter()
+        _, log = generate_story_with_llm(images, model_id, language, include_metrics_log=True, ai_handler=agent)
+        latencies.append(time.perf_counter() - start_time)
+        logs.append(log)
+
+    input_tokens = statistics.mean(log["input_tokens"] or 0 for log in logs)
+    cached_tokens = statistics.mean(log.get("cached_input_tokens", 0) for log in logs)
+    return {
+        "input_tokens": round(input_tokens),
+        "cached_input_tokens": round(cached_tokens),
+        "billed_input_tokens": round(input_tokens - cached_tokens * (1 - CACHED_TOKEN_PRICE_RATIO)),
+        "sent_kb": round(statistics.mean(recording_client.sent_bytes) / 1024, 1),
+        "latency_p50_sec": round(statistics.median(latencies), 3),
+        "model_p50_sec": round(statistics.median(log["elapsed_time_sec"] for log in logs), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare story requests with and without context caching.")
+    parser.add_argument("--backend", default="fake", choices=["fake", "real"])
+    parser.add_argument("--model", default=GenAIAgent.DEFAULT_FLASH_MODEL_ID)
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, choices=available_languages())
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--images", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.backend == "real":
+        client = get_shared_client(os.environ["GOOGLE_API_KEY"])
+    else:
+        client = FakeGenAIClient(latency_sec=0.2, input_tokens_per_request=None)
+    images = []
+    for path in get_language_pack(args.language).image_paths[:args.images]:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    context_cache = ContextCacheManager()
+    for label, manager in (("without context cache", None), ("with context cache", context_cache)):
+        report = run(client, args.model, args.language, images, args.requests, manager)
+        print(f"{label:<22} {report}")
+    print(f"Context cache handles: {context_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Load test of the generation pipeline against the local mock Gemini server.
+
+Starts storyteller.mock_server.MockGenAIServer, which replays the input tokens and
+elapsed_time_sec recorded in final_results_dataset/results_and_logs (plus
+optional 429/5xx errors), and drives the real client code against it at each
+requested concurrency. Runs offline and reports throughput, p50/p95/p99
+latency, memory and error rates per concurrency level.
+
+Modes:
+    pipeline  generate_story_with_llm from a thread pool (preprocessing included)
+    stream    stream_story_with_llm from a thread pool
+    agent     GenAIAgent.agenerate_single_response from one event loop, on a
+              request built once (client and connection pool only)
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --model gemma-3-27b-it --concurrency 1,4,16 \
+        --requests 64 --time-scale 0.1 --error-rate 0.05 --output load_test.json
+
+--max-p95 and --max-error-rate make the run exit with status 1 when exceeded,
+so it can gate regressions.
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from google.genai import errors
+
+from storyteller.core import (
+    GenAIAgent,
+    Story,
+    generate_story_with_llm,
+    get_shared_client,
+    prepare_story_request,
+    resolve_model_id,
+    stream_story_with_llm,
+)
+from storyteller.language_packs import DEFAULT_LANGUAGE, available_languages, get_language_pack
+from storyteller.metrics import get_metrics_registry, percentile
+from storyteller.mock_server import MockGenAIServer
+from storyteller.scheduler import ModelLimits, RequestScheduler
+
+MOCK_API_KEY = "mock-load-test"
+
+
+def current_rss_mb() -> float:
+    # Resident set size from /proc (Linux), in MB
+    with open("/proc/self/statm", "r") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * resource.getpagesize() / 2**20
+
+
+def load_images(language: str) -> list:
+    # The example photos are the only images shipped with the repository
+    images = []
+    for path in get_language_pack(language).image_paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def error_label(error: Exception) -> str:
+    if isinstance(error, errors.APIError):
+        return str(error.code)
+    return type(error).__name__
+
+
+class LoadTest:
+    """
+    Runs one load level and collects its latencies, errors and memory use.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        model_id: str,
+        language: str,
+        client,
+        images: list,
+        images_per_request: int,
+        seed: int,
+        scheduler: RequestScheduler = None,
+    ):
+        self.mode = mode
+        self.model_id = model_id
+        self.language = language
+        self.images = images
+        self.images_per_request = images_per_request
+        self._random = random.Random(seed)
+        # No response cache, every request has to reach the server
+        self.agent = GenAIAgent(model_id, language, genai_client=client, response_cache=None, scheduler=scheduler)
+        self._prepared_content = None
+
+    def _pick_images(self) -> list:
+        return self._random.sample(self.images, min(self.images_per_request, len(self.images)))
+
+    def _run_pipeline_request(self, image_data_list: list) -> None:
+        generate_story_with_llm(image_data_list, self.model_id, self.language, ai_handler=self.agent)
+
+    def _run_stream_request(self, image_data_list: list) -> None:
+        for _ in stream_story_with_llm(image_data_list, self.model_id, self.language, ai_handler=self.agent):
+            pass
+
+    def _timed(self, request, *args) -> tuple:
+        start_time = time.perf_counter()
+        try:
+            request(*args)
+            return time.perf_counter() - start_time, None
+        except Exception as e:
+            return time.perf_counter() - start_time, error_label(e)
+
+    def _run_threaded(self, concurrency: int, request_count: int) -> list:
+        request = self._run_pipeline_request if self.mode == "pipeline" else self._run_stream_request
+        inputs = [self._pick_images() for _ in range(request_count)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda images: self._timed(request, images), inputs))
+
+    async def _run_async(self, concurrency: int, request_count: int) -> list:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one_request():
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    await self.agent.agenerate_single_response(self._prepared_content, Story)
+                    return time.perf_counter() - start_time, None
+                except Exception as e:
+                    return time.perf_counter() - start_time, error_label(e)
+
+        return await asyncio.gather(*(one_request() for _ in range(request_count)))
+
+    def run(self, concurrency: int, request_count: int) -> dict:
+        if self.mode == "agent" and self._prepared_content is None:
+            _, self._prepared_content, _ = prepare_story_request(
+                self._pick_images(), self.model_id, self.language, self.agent
+            )
+
+        rss_before = current_rss_mb()
+        peak_sampler = _PeakRssSampler().start()
+        start_time = time.perf_counter()
+        if self.mode == "agent":
+            outcomes = asyncio.run(self._run_async(concurrency, request_count))
+        else:
+            outcomes = self._run_threaded(concurrency, request_count)
+        wall_sec = time.perf_counter() - start_time
+        peak_sampler.stop()
+
+        latencies = sorted(latency for latency, error in outcomes if error is None)
+        error_counts = Counter(error for _, error in outcomes if error is not None)
+        report = {
+            "mode": self.mode,
+            "model": self.model_id,
+            "concurrency": concurrency,
+            "requests": request_count,
+            "succeeded": len(latencies),
+            "errors": dict(error_counts),
+            "error_rate": round(sum(error_counts.values()) / request_count, 4),
+            "wall_sec": round(wall_sec, 3),
+            "throughput_rps": round(request_count / wall_sec, 3),
+            "rss_before_mb": round(rss_before, 1),
+            "rss_peak_mb": round(peak_sampler.peak_mb, 1),
+            "rss_after_mb": round(current_rss_mb(), 1),
+        }
+        for percent in (50, 95, 99):
+            value = percentile(latencies, percent)
+            report[f"latency_p{percent}_sec"] = round(value, 3) if value is not None else None
+        return report
+
+
+class _PeakRssSampler:
+    # ru_maxrss only grows over the whole process, sample the RSS during each level instead
+    def __init__(self, interval_sec: float = 0.05):
+        self.interval_sec = interval_sec
+        self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_sec):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def start(self) -> "_PeakRssSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def replayed_latency_percentiles(server: MockGenAIServer, model_id: str) -> dict:
+    # What the mock server alone adds, to compare the client overhead against
+    profile = next((p for prefix, p in server.profiles.items() if model_id.startswith(prefix)), None)
+    if profile is None:
+        return {}
+    latencies = sorted(elapsed * server.time_scale for _, elapsed in profile.samples)
+    return {f"p{percent}": round(percentile(latencies, percent), 3) for percent in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the story pipeline against a local mock Gemini server.")
+    parser.add_argument("--mode", default="pipeline", choices=["pipeline", "stream", "agent"])
+    parser.add_argument("--model", default=GenAIAgent.DEFAULT_FLASH_MODEL_ID, help="Model id or app display name")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, choices=available_languages())
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    parser.add_argument("--images", type=int, default=3, help="Images per request (2-5)")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Multiplier of the replayed latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-codes", default="429,500,503", help="Comma separated HTTP codes of the injected errors")
+    parser.add_argument("--logs-dir", default=None, help="Directory of the recorded logs_*.json files")
+    parser.add_argument("--rpm", type=float, default=None, help="Send through a RequestScheduler with this requests/minute limit")
+    parser.add_argument("--tpm", type=float, default=1e9, help="Tokens/minute limit of the scheduler (with --rpm)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the reports to this JSON file")
+    parser.add_argument("--max-p95", type=float, default=None, help="Fail if a level's p95 latency exceeds this (seconds)")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="Fail if a level's error rate exceeds this")
+    args = parser.parse_args()
+
+    model_id = resolve_model_id(args.model)
+    server_options = {}
+    if args.logs_dir:
+        from storyteller.latency_profiles import load_latency_profiles
+        server_options["profiles"] = load_latency_profiles(args.logs_dir)
+    server = MockGenAIServer(
+        time_scale=args.time_scale,
+        error_rate=args.error_rate,
+        error_codes=tuple(int(code) for code in args.error_codes.split(",")),
+        seed=args.seed,
+        **server_options,
+    ).start()
+    print(f"Mock server on {server.base_url}, replayed model latency {replayed_latency_percentiles(server, model_id)}")
+
+    scheduler = None
+    if args.rpm:
+        scheduler = RequestScheduler(
+            limits={model_id: ModelLimits(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)},
+            max_queue_size=max(64, args.requests),
+            # Backoff shrinks with the replayed latencies
+            base_backoff_sec=args.time_scale,
+        )
+    load_test = LoadTest(
+        mode=args.mode,
+        model_id=model_id,
+        language=args.language,
+        client=get_shared_client(MOCK_API_KEY, base_url=server.base_url),
+        images=load_images(args.language),
+        images_per_request=args.images,
+        seed=args.seed,
+        scheduler=scheduler,
+    )
+    reports = []
+    failed_gates = []
+    try:
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            report = load_test.run(concurrency, args.requests)
+            reports.append(report)
+            print(
+                f"concurrency {concurrency:>3}: {report['throughput_rps']:>7.2f} req/s  "
+                f"p50 {report['latency_p50_sec']}s p95 {report['latency_p95_sec']}s p99 {report['latency_p99_sec']}s  "
+                f"errors {report['error_rate']:.1%} {report['errors']}  peak RSS {report['rss_peak_mb']} MB"
+            )
+            if args.max_p95 is not None and (report["latency_p95_sec"] or 0) > args.max_p95:
+                failed_gates.append(f"concurrency {concurrency}: p95 {report['latency_p95_sec']}s > {args.max_p95}s")
+            if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+                failed_gates.append(f"concurrency {concurrency}: error rate {report['error_rate']} > {args.max_error_rate}")
+    finally:
+        server.stop()
+
+    if args.mode != "agent":
+        stages = get_metrics_registry().percentiles().get(model_id, {}).get(args.language, {})
+        for stage, summary in stages.items():
+            print(f"  {stage:<20} p50 {summary['p50']}s p95 {summary['p95']}s p99 {summary['p99']}s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"server_requests": server.request_count, "levels": reports}, f, indent=2)
+    if failed_gates:
+        print("Regression gates failed:\n  " + "\n  ".join(failed_gates))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures the cost of the one-shot example assets.
+
+Compares the old behaviour, where every Streamlit rerun opened the ten example
+images and formatted them into the prompts, against the lazy loader, which
+encodes the images of a language once per process.
+
+Usage (from the repository root):
+    python -m benchmarks.one_shot_assets
+"""
+import statistics
+import time
+
+from PIL import Image
+
+from storyteller import one_shot
+from storyteller.core import GenAIAgent
+from storyteller.language_packs import available_languages, get_language_pack
+
+REPEATS = 20
+
+
+# The two languages story_app.py loaded at the top of every rerun
+LEGACY_IMAGE_PATHS = {language: get_language_pack(language).image_paths for language in ("English", "Spanish")}
+
+
+def legacy_rerun():
+    # What story_app.py did at the top of every rerun before the lazy loader
+    images = {
+        language: [Image.open(path) for path in paths]
+        for language, paths in LEGACY_IMAGE_PATHS.items()
+    }
+    prompts = [f"{images['English']}", f"{images['Spanish']}"]
+    for language_images in images.values():
+        for image in language_images:
+            image.close()
+    return prompts
+
+
+def timed_ms(function, *args) -> float:
+    start_time = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start_time) * 1000
+
+
+def main():
+    legacy_ms = [timed_ms(legacy_rerun) for _ in range(REPEATS)]
+    print(f"Legacy per-rerun cost (10 x Image.open + prompt formatting): {statistics.median(legacy_ms):.2f} ms")
+
+    for language in available_languages():
+        agent = GenAIAgent(select_system_prompt=language, genai_client=object())
+        first_ms = timed_ms(agent.build_few_shot_content)
+        cached_ms = [timed_ms(agent.build_few_shot_content) for _ in range(REPEATS)]
+        parts = one_shot.load_one_shot_image_parts(language)
+        payload_kb = sum(len(part.inline_data.data) for part in parts) / 1024
+        print(
+            f"{language}: first use {first_ms:.1f} ms, later requests {statistics.median(cached_ms):.3f} ms, "
+            f"{len(parts)} example images / {payload_kb:.0f} KB sent per request"
+        )
+    print("Per-rerun cost of the lazy loader: 0 ms (nothing runs until a story is generated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmarks the story answer parser against the previous json5 path.
+
+Model answers are rebuilt from every predicted_texts entry in
+final_results_dataset/results_and_logs in the shapes seen in practice: strict
+JSON (Gemini structured output), fenced JSON with surrounding prose (Gemma 3)
+and answers cut off before the end.
+
+Usage (from the repository root):
+    python -m benchmarks.parse_responses
+"""
+import glob
+import json
+import time
+from collections import Counter
+
+import json5
+
+from storyteller.response_parsing import StoryParseError, parse_story_response_detailed
+
+RESULTS_GLOB = "final_results_dataset/results_and_logs/results_*.json"
+
+
+def build_answers() -> dict:
+    answers = {"strict": [], "fenced_with_prose": [], "truncated": []}
+    for path in sorted(glob.glob(RESULTS_GLOB)):
+        with open(path, "r", encoding="utf-8") as f:
+            albums = json.load(f)
+        for album in albums:
+            story = {"story": [
+                {"image": i + 1, "story_part": text} for i, text in enumerate(album["predicted_texts"])
+            ]}
+            strict = json.dumps(story, ensure_ascii=False, indent=2)
+            answers["strict"].append(strict)
+            answers["fenced_with_prose"].append(f"Here is the story:\n```json\n{strict}\n```\nI hope you enjoy it!")
+            answers["truncated"].append(strict[:int(len(strict) * 0.8)])
+    return answers
+
+
+def legacy_parse(text: str):
+    # The parsing generate_story_with_llm did before the response_parsing module
+    text = text.replace("```json", "")
+    text = text.replace("```", "")
+    return json5.loads(text)
+
+
+def run(parse, texts: list):
+    failures = 0
+    start_time = time.perf_counter()
+    for text in texts:
+        try:
+            parse(text)
+        except (ValueError, StoryParseError):
+            failures += 1
+    return time.perf_counter() - start_time, failures
+
+
+def main():
+    answers = build_answers()
+    for shape, texts in answers.items():
+        legacy_sec, legacy_failures = run(legacy_parse, texts)
+        new_sec, new_failures = run(parse_story_response_detailed, texts)
+        methods = Counter()
+        for text in texts:
+            try:
+                methods[parse_story_response_detailed(text)[1]] += 1
+            except StoryParseError:
+                methods["error"] += 1
+        print(
+            f"{shape:18} {len(texts)} answers | json5 path: {legacy_sec * 1000:8.1f} ms, {legacy_failures} failed"
+            f" | new parser: {new_sec * 1000:7.1f} ms, {new_failures} failed"
+            f" ({legacy_sec / new_sec:.0f}x faster) | {dict(methods)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Visual storytelling with Google's GenAI models (Gemini/Gemma).
+"""
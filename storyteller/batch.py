@@ -0,0 +1,344 @@
+"""
+Headless batch generation over whole album datasets.
+
+Reads an album manifest (a JSON list or JSONL file of {"album_id", "images", "texts"}
+entries), generates a story for every album with a bounded number of requests in
+flight, and writes the results and logs in the same format as the files in
+final_results_dataset/results_and_logs. Every finished album is appended to a
+checkpoint file, so a crashed or rate-limited run resumes where it stopped.
+
+Usage:
+    python -m storyteller.batch manifest.json --model gemma-3-27b-it --language English \
+        --results results_gemma3_eng.json --logs logs_gemma3_eng.json --concurrency 4
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ijson
+from tqdm import tqdm
+
+from storyteller.core import GenAIAgent, generate_story_with_llm, resolve_model_id
+from storyteller.context_cache import get_default_context_cache
+from storyteller.hedging import HedgePolicy, generate_story_hedged
+from storyteller.language_packs import DEFAULT_LANGUAGE, available_languages
+from storyteller.metrics import get_metrics_registry
+from storyteller.response_cache import get_default_response_cache
+from storyteller.scheduler import get_default_scheduler, request_context
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_REQUIRED_KEYS = ("album_id", "images", "texts")
+
+
+def _check_album(album: dict) -> dict:
+    missing = [key for key in MANIFEST_REQUIRED_KEYS if key not in album]
+    if missing:
+        raise ValueError(f"Album {album.get('album_id')!r} is missing the keys {missing}")
+    return album
+
+
+def iter_manifest(manifest_path: str):
+    """
+    Reads an album manifest (JSON list or JSONL file) one album at a time, so a
+    manifest of any size is read in constant memory.
+
+    Args:
+        manifest_path (str): Path to the manifest.
+
+    Yields:
+        dict: The album entries, in file order.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        first_char = ""
+        while not first_char.strip():
+            first_char = f.read(1)
+            if not first_char:
+                return # Empty manifest
+        f.seek(0)
+        if first_char == "[":
+            for album in ijson.items(f, "item", use_float=True):
+                yield _check_album(album)
+        else:
+            for line in f:
+                if line.strip():
+                    yield _check_album(json.loads(line))
+
+
+def load_manifest(manifest_path: str) -> list:
+    """
+    Loads an album manifest from a JSON list or a JSONL file.
+
+    Args:
+        manifest_path (str): Path to the manifest.
+
+    Returns:
+        list[dict]: The album entries, in file order.
+    """
+    return list(iter_manifest(manifest_path))
+
+
+def load_album_images(image_paths: list, image_root: str = None) -> list:
+    """
+    Reads the encoded bytes of the images of an album, resolving relative paths
+    against image_root. Decoding is left to the preprocessing stage.
+    """
+    images = []
+    for path in image_paths:
+        if image_root and not os.path.isabs(path):
+            path = os.path.join(image_root, path)
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def write_json_atomic(path: str, data) -> None:
+    """
+    Writes data as pretty-printed JSON through a temporary file, so readers never
+    see a half written file.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """
+    Generates stories for many albums concurrently with checkpoint/resume.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        language: str,
+        results_path: str,
+        logs_path: str,
+        checkpoint_path: str = None,
+        concurrency: int = 4,
+        image_root: str = None,
+        flush_every: int = 10,
+        genai_client=None,
+        use_cache: bool = False,
+        use_context_cache: bool = False,
+        use_scheduler: bool = True,
+        hedge_policy: HedgePolicy = None,
+    ):
+        """
+        Args:
+            model_id (str): Model id or app display name of the model to use.
+            language (str): Story language, one with a language pack (e.g. "English").
+            results_path (str): Output file for the album results.
+            logs_path (str): Output file for the per album performance logs.
+            checkpoint_path (str, optional): JSONL file recording finished albums.
+                                             Defaults to "<results_path>.checkpoint.jsonl".
+            concurrency (int, optional): Maximum number of requests in flight.
+            image_root (str, optional): Directory that relative image paths are resolved against.
+            flush_every (int, optional): Rewrite the output files every this many albums.
+            genai_client (optional): Client passed to the GenAIAgent, e.g. a fake backend.
+            use_cache (bool, optional): Answer albums already generated with identical
+                                        requests from the response cache.
+            use_context_cache (bool, optional): Cache the static prompt prefix on the
+                                                backend and only send each album's images.
+            use_scheduler (bool, optional): Send the requests through the process wide
+                                            rate limiter, which retries 429/5xx answers.
+            hedge_policy (HedgePolicy, optional): Also ask the other model for albums
+                                                  the first one is slow on or fails.
+        """
+        self.model_id = resolve_model_id(model_id)
+        self.language = language
+        self.results_path = results_path
+        self.logs_path = logs_path
+        self.checkpoint_path = checkpoint_path or f"{results_path}.checkpoint.jsonl"
+        self.concurrency = max(1, concurrency)
+        self.image_root = image_root
+        self.flush_every = max(1, flush_every)
+        self.agent = GenAIAgent(
+            specified_model_id=self.model_id,
+            select_system_prompt=language,
+            genai_client=genai_client,
+            response_cache=get_default_response_cache() if use_cache else None,
+            context_cache=get_default_context_cache() if use_context_cache else None,
+            scheduler=get_default_scheduler() if use_scheduler else None,
+        )
+        self.hedge_policy = hedge_policy
+        self._lock = threading.Lock()
+        self._completed = {} # album_id -> checkpoint record of finished albums
+
+    def load_checkpoint(self) -> dict:
+        """
+        Reads the albums already finished by a previous run of this batch.
+        Albums that failed are not considered finished and will be retried.
+        """
+        completed = {}
+        if not os.path.exists(self.checkpoint_path):
+            return completed
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line truncated, that album is simply redone
+                    continue
+                if record.get("status") == "ok":
+                    completed[record["album_id"]] = record
+        return completed
+
+    def _append_checkpoint(self, record: dict) -> None:
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_outputs(self, albums: list) -> None:
+        results = []
+        logs = []
+        for album in albums:
+            record = self._completed.get(album["album_id"])
+            if record is None:
+                continue
+            results.append({
+                "album_id": album["album_id"],
+                "texts": album["texts"],
+                "images": album["images"],
+                "predicted_texts": record["predicted_texts"],
+            })
+            logs.append({"album_id": album["album_id"], "log": record["log"]})
+        write_json_atomic(self.results_path, results)
+        write_json_atomic(self.logs_path, logs)
+
+    def _generate_album(self, album: dict) -> dict:
+        images = load_album_images(album["images"], self.image_root)
+        # The whole batch is one session of the queue, so app users are still served in turn
+        options = {"policy": self.hedge_policy} if self.hedge_policy else {}
+        generate = generate_story_hedged if self.hedge_policy else generate_story_with_llm
+        with request_context(f"batch:{self.results_path}"):
+            predicted_texts, log = generate(
+                image_data_list=images,
+                llm_model_name=self.model_id,
+                language=self.language,
+                include_metrics_log=True,
+                ai_handler=self.agent,
+                **options,
+            )
+        return {
+            "album_id": album["album_id"],
+            "status": "ok",
+            "predicted_texts": predicted_texts,
+            "log": log,
+        }
+
+    def run(self, albums: list, show_progress: bool = True) -> dict:
+        """
+        Generates the stories of every album not finished yet.
+
+        Args:
+            albums (list[dict]): Album entries as returned by load_manifest.
+            show_progress (bool, optional): Display a progress bar.
+
+        Returns:
+            dict: Counts of the "completed", "skipped" and "failed" albums. With a hedge
+                  policy, also the "hedged" albums and the albums "served_by" each model.
+        """
+        self._completed = self.load_checkpoint()
+        pending = [album for album in albums if album["album_id"] not in self._completed]
+        summary = {"completed": 0, "skipped": len(albums) - len(pending), "failed": 0}
+        if self.hedge_policy:
+            summary.update(hedged=0, served_by={})
+
+        progress = tqdm(total=len(pending), desc="Albums", disable=not show_progress)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self._generate_album, album): album for album in pending}
+            for future in as_completed(futures):
+                album = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {"album_id": album["album_id"], "status": "error", "error": repr(e)}
+                    logger.warning("Album %s failed: %s", album["album_id"], e)
+
+                with self._lock:
+                    self._append_checkpoint(record)
+                    if record["status"] == "ok":
+                        self._completed[album["album_id"]] = record
+                        summary["completed"] += 1
+                        if self.hedge_policy:
+                            served_by = record["log"]["served_by"]
+                            summary["served_by"][served_by] = summary["served_by"].get(served_by, 0) + 1
+                            summary["hedged"] += record["log"]["hedge_fired"]
+                        if summary["completed"] % self.flush_every == 0:
+                            self._write_outputs(albums)
+                    else:
+                        summary["failed"] += 1
+                progress.update(1)
+        progress.close()
+
+        self._write_outputs(albums)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate stories for every album of a manifest.")
+    parser.add_argument("manifest", help="JSON list or JSONL file of {album_id, images, texts} entries")
+    parser.add_argument("--model", default=GenAIAgent.DEFAULT_FLASH_MODEL_ID, help="Model id or app display name")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, choices=available_languages())
+    parser.add_argument("--results", required=True, help="Output results JSON file")
+    parser.add_argument("--logs", required=True, help="Output logs JSON file")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint JSONL file (default: <results>.checkpoint.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of requests in flight")
+    parser.add_argument("--image-root", default=None, help="Directory relative image paths are resolved against")
+    parser.add_argument("--cache", action="store_true", help="Reuse cached responses of identical requests")
+    parser.add_argument("--context-cache", action="store_true", help="Cache the static prompt prefix on the backend")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Send requests without the rate limiter")
+    parser.add_argument("--hedge", action="store_true", help="Also ask the other model when the first is slow or fails")
+    parser.add_argument("--hedge-percentile", type=float, default=95, help="Latency percentile the hedge waits for")
+    parser.add_argument("--fake-backend", action="store_true", help="Use the offline fake model backend")
+    parser.add_argument("--metrics-jsonl", default=None, help="Write the per-request stage timings to this JSONL file")
+    parser.add_argument("--metrics-prom", default=None, help="Write the latency metrics in the Prometheus text format")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="[%(levelname)s] %(message)s")
+
+    genai_client = None
+    if args.fake_backend:
+        from storyteller.fakes import FakeGenAIClient
+        genai_client = FakeGenAIClient()
+
+    runner = BatchRunner(
+        model_id=args.model,
+        language=args.language,
+        results_path=args.results,
+        logs_path=args.logs,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency,
+        image_root=args.image_root,
+        genai_client=genai_client,
+        use_cache=args.cache,
+        use_context_cache=args.context_cache,
+        # The API rate limits do not apply to the offline fake
+        use_scheduler=not (args.no_rate_limit or args.fake_backend),
+        hedge_policy=HedgePolicy(percentile=args.hedge_percentile) if args.hedge else None,
+    )
+    summary = runner.run(load_manifest(args.manifest))
+    print(f"Completed {summary['completed']}, skipped {summary['skipped']} already done, failed {summary['failed']}")
+    if args.hedge:
+        print(f"Hedges fired for {summary['hedged']} albums, served by {summary['served_by']}")
+
+    metrics = get_metrics_registry()
+    if args.metrics_jsonl:
+        metrics.export_jsonl(args.metrics_jsonl)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+    for model, languages in metrics.percentiles().items():
+        for language, stages in languages.items():
+            for stage, summary in stages.items():
+                print(f"{model} {language} {stage}: p50 {summary['p50']}s p95 {summary['p95']}s p99 {summary['p99']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Extraction of per-language album manifests from the Bloom-VIST data.json.
+
+Replaces the one-language-per-run Extract_spanish_dataset notebook of
+final_results_dataset/code_dataset_and_model_processing. data.json is streamed
+(with ijson) in three passes, stories, annotations and images, and each pass
+only keeps what the next needs:
+- the set of quarantined story ids,
+- the annotations of the requested languages, grouped by album in a dict,
+- the URLs of the images those albums use.
+Every requested language comes out of the same passes. Albums whose text
+langdetect does not attribute to their language with enough confidence are
+dropped, with the detection spread over a process pool. Each language gets a
+JSONL manifest that storyteller.batch reads directly.
+
+Usage:
+    python -m storyteller.bloom_extract data.json --languages spa,eng --output-dir manifests
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+try:
+    import ijson
+except ImportError: # Falls back to loading data.json at once
+    ijson = None
+
+try:
+    from langdetect import DetectorFactory, detect_langs
+    DetectorFactory.seed = 0 # Same answer for the same text in every worker and run
+except ImportError:
+    detect_langs = None
+
+DEFAULT_MIN_CONFIDENCE = 0.9999
+
+# Texts scored per worker task
+ALBUMS_PER_CHUNK = 64
+
+# Languages of Bloom-VIST (ISO 639-3)
+BLOOM_VIST_LANGUAGES = (
+    'afr', 'aaa', 'abc', 'ada', 'adq', 'aeu', 'agq', 'ags', 'ahk', 'aia', 'ajz', 'aka', 'ame', 'amh', 'amp',
+    'amu', 'ann', 'aph', 'awa', 'awb', 'azn', 'azo', 'bag', 'bam', 'baw', 'bax', 'bbk', 'bcc', 'bce', 'bec',
+    'bef', 'ben', 'bfd', 'bfm', 'bfn', 'bgf', 'bho', 'bhs', 'bis', 'bjn', 'bjr', 'bkc', 'bkh', 'bkm', 'bkx',
+    'bob', 'bod', 'boz', 'bqm', 'bra', 'brb', 'bri', 'brv', 'bss', 'bud', 'buo', 'bwt', 'bwx', 'bxa', 'bya',
+    'bze', 'bzi', 'cak', 'cbr', 'ceb', 'cgc', 'chd', 'chp', 'cim', 'clo', 'cmn', 'cmo', 'csw', 'cuh', 'cuv',
+    'dag', 'ddg', 'ded', 'deu', 'dig', 'dje', 'dmg', 'dnw', 'dtp', 'dtr', 'dty', 'dug', 'eee', 'ekm', 'enb',
+    'enc', 'eng', 'ewo', 'fas', 'fil', 'fli', 'fon', 'fra', 'fub', 'fuh', 'gal', 'gbj', 'gou', 'gsw', 'guc',
+    'guj', 'guz', 'gwc', 'hao', 'hat', 'hau', 'hbb', 'hig', 'hil', 'hin', 'hla', 'hna', 'hre', 'hro', 'idt',
+    'ilo', 'ind', 'ino', 'isu', 'ita', 'jgo', 'jmx', 'jpn', 'jra', 'kak', 'kam', 'kan', 'kau', 'kbq', 'kbx',
+    'kby', 'kek', 'ken', 'khb', 'khm', 'kik', 'kin', 'kir', 'kjb', 'kmg', 'kmr', 'kms', 'kmu', 'kor', 'kqr',
+    'krr', 'ksw', 'kur', 'kvt', 'kwd', 'kwu', 'kwx', 'kxp', 'kyq', 'laj', 'lan', 'lao', 'lbr', 'lfa', 'lgg',
+    'lgr', 'lhm', 'lhu', 'lkb', 'llg', 'lmp', 'lns', 'loh', 'lsi', 'lts', 'lug', 'luy', 'lwl', 'mai', 'mal',
+    'mam', 'mar', 'mdr', 'mfh', 'mfj', 'mgg', 'mgm', 'mgo', 'mgq', 'mhx', 'miy', 'mkz', 'mle', 'mlk', 'mlw',
+    'mmu', 'mne', 'mnf', 'mnw', 'mot', 'mqj', 'mrn', 'mry', 'msb', 'muv', 'mve', 'mxu', 'mya', 'myk', 'myx',
+    'mzm', 'nas', 'nco', 'nep', 'new', 'nge', 'ngn', 'nhx', 'njy', 'nla', 'nld', 'nlv', 'nod', 'nsk', 'nsn',
+    'nso', 'nst', 'nuj', 'nwe', 'nwi', 'nxa', 'nxl', 'nya', 'nyo', 'nyu', 'nza', 'odk', 'oji', 'oki', 'omw',
+    'ori', 'ozm', 'pae', 'pag', 'pan', 'pbt', 'pce', 'pcg', 'pdu', 'pea', 'pex', 'pis', 'pkb', 'pmf', 'pnz',
+    'por', 'psp', 'pwg', 'qaa', 'qub', 'quc', 'quf', 'quz', 'qve', 'qvh', 'qvm', 'qvo', 'qxh', 'rel', 'rnl',
+    'ron', 'roo', 'rue', 'rug', 'rus', 'san', 'saq', 'sat', 'sdk', 'sea', 'sgd', 'shn', 'sml', 'snk', 'snl',
+    'som', 'sot', 'sox', 'spa', 'sps', 'ssn', 'stk', 'swa', 'swh', 'sxb', 'syw', 'taj', 'tam', 'tbj', 'tdb',
+    'tdg', 'tdt', 'teo', 'tet', 'tgk', 'tha', 'the', 'thk', 'thl', 'thy', 'tio', 'tkd', 'tnl', 'tnn', 'tnp',
+    'tnt', 'tod', 'tom', 'tpi', 'tpl', 'tpu', 'tsb', 'tsn', 'tso', 'tuv', 'tuz', 'tvs', 'udg', 'unr', 'urd',
+    'uzb', 'ven', 'vie', 'vif', 'war', 'wbm', 'wbr', 'wms', 'wni', 'wnk', 'wtk', 'xho', 'xkg', 'xmd', 'xmg',
+    'xmm', 'xog', 'xty', 'yas', 'yav', 'ybb', 'ybh', 'ybi', 'ydd', 'yea', 'yet', 'yid', 'yin', 'ymp', 'zaw',
+    'zho', 'zlm', 'zuh', 'zul',
+)
+
+# Language tags of the annotations to their ISO 639-3 code
+BLOOM_LANGUAGE_TAGS = {
+    'kwd': 'kwd', 'lo': 'lao', 'sps': 'sps', 'cry': 'cry', 'wms': 'wms', 'prs': 'fas', 'gwc': 'gwc', 'bfn':
+    'bfn', 'kms': 'kms', 'oki': 'oki', 'quf': 'quf', 'wni': 'wni', 'ceb-x-boholano': 'ceb', 'laj': 'laj', 'kyq':
+    'kyq', 'or': 'ori', 'rue': 'rue', 'mve': 'mve', 'gsw': 'gsw', 'ru-KG': 'rus', 'ken': 'ken', 'ekm': 'ekm',
+    'tn': 'tsn', 'sw': 'swa', 'swh': 'swh', 'tdt': 'tdt', 'my': 'mya', 'kmr': 'kmr', 'syw': 'syw', 'xog': 'xog',
+    'ksw': 'ksw', 'pcg': 'pcg', 'guz': 'guz', 'khb': 'khb', 'clo': 'clo', 'bob': 'bob', 'pbt': 'pbt', 'teo':
+    'teo', 'kxp': 'kxp', 'tet': 'tet', 'ts': 'tso', 'ha': 'hau', 've': 'ven', 'mxu': 'mxu', 'es-PE': 'spa',
+    'de': 'deu', 'cmo': 'cmo', 'am': 'amh', 'bef': 'bef', 'bn': 'ben', 'ro': 'ron', 'bzi': 'bzi', 'ml': 'mal',
+    'af': 'afr', 'mzm': 'mzm', 'yas': 'yas', 'bec': 'bec', 'awa': 'awa', 'bkm': 'bkm', 'so': 'som', 'tnn':
+    'tnn', 'the': 'the', 'ann': 'ann', 'myx': 'myx', 'ddg': 'ddg', 'yet': 'yet', 'hbb': 'hbb', 'adq': 'adq',
+    'sok': 'sok', 'bfm': 'bfm', 'bra': 'bra', 'csw-Cans-CA': 'csw', 'ilo': 'ilo', 'lhm': 'lhm', 'rug': 'rug',
+    'lmp': 'lmp', 'mnf': 'mnf', 'tdb': 'tdb', 'ada': 'ada', 'tvs': 'tvs', 'th': 'tha', 'wbr': 'wbr', 'dtp':
+    'dtp', 'pnz': 'pnz', 'sea': 'sea', 'brv': 'brv', 'xmg': 'xmg', 'saq-x-Ilchamus': 'saq', 'sa': 'san', 'mne':
+    'mne', 'lwl': 'lwl', 'dty': 'dty', 'chd': 'chd', 'lg': 'lug', 'vif': 'vif', 'lkb': 'lkb', 'fuv-Arab': 'fuv',
+    'ded': 'ded', 'nsk': 'nsk', 'fub': 'fub', 'mhx': 'mhx', 'pa': 'pan', 'isu': 'isu', 'bjn': 'bjn', 'tl':
+    'fil', 'ht': 'hat', 'boz': 'boz', 'zgh': 'zgh', 'enb-x-Sengwer': 'enb', 'bxa': 'bxa', 'qub': 'qub', 'hla':
+    'hla', 'jgo': 'jgo', 'taj': 'taj', 'ajz': 'ajz', 'kmu': 'kmu', 'psp': 'psp', 'xmm': 'xmm', 'shn': 'shn',
+    'zuh': 'zuh', 'cim': 'cim', 'lan': 'lan', 'st': 'sot', 'lfa': 'lfa', 'es': 'spa', 'tio': 'tio', 'mdr':
+    'mdr', 'ydd': 'ydd', 'fil': 'fil', 'nod': 'nod', 'id': 'ind', 'csw-Latn': 'csw', 'bhs': 'bhs', 'udg': 'udg',
+    'gou': 'gou', 'hre': 'hre', 'ahk': 'ahk', 'bi': 'bis', 'qvh': 'qvh', 'mfj': 'mfj', 'miy': 'miy', 'mgm':
+    'mgm', 'ybh': 'ybh', 'ymp': 'ymp', 'es-GT': 'spa', 'fal': 'fal', 'pex': 'pex', 'bfd': 'bfd', 'zh': 'zho',
+    'pwg': 'pwg', 'bgf': 'bgf', 'omw': 'omw', 'dtr': 'dtr', 'ku': 'kur', 'cak': 'cak', 'ky': 'kir', 'sgd':
+    'sgd', 'quc': 'quc', 'cuh': 'cuh', 'eee': 'eee', 'bze': 'bze', 'bo': 'bod', 'jmx-x-smp': 'jmx', 'new':
+    'new', 'dig': 'dig', 'gu': 'guj', 'dug': 'dug', 'pag': 'pag', 'aaa': 'aaa', 'bag': 'bag', 'oj': 'oji',
+    'ngn': 'ngn', 'ny': 'nya', 'zlm': 'zlm', 'kbq': 'kbq', 'baw': 'baw', 'ak': 'aka', 'mot': 'mot', 'jmx':
+    'jmx', 'amu': 'amu', 'ta': 'tam', 'tg': 'tgk', 'nlv': 'nlv', 'aph': 'aph', 'mlk': 'mlk',
+    'en-Brai-IN-x-Chetana-Trust': 'eng', 'dje': 'dje', 'nyu': 'nyu', 'tnl': 'tnl', 'xkg': 'xkg', 'gbj': 'gbj',
+    'snk-Arab': 'snk', 'ino': 'ino', 'sox': 'sox', 'tpu': 'tpu', 'bya': 'bya', 'pmf': 'pmf', 'krr': 'krr',
+    'nuj': 'nuj', 'kn': 'kan', 'ne': 'nep', 'mgg': 'mgg', 'pkb': 'pkb', 'snl': 'snl', 'mgo': 'mgo', 'km': 'khm',
+    'kmg': 'kmg', 'mkz': 'mkz', 'bkc': 'bkc', 'pea': 'pea', 'mnw': 'mnw', 'msb': 'msb', 'lhu': 'lhu', 'tpl':
+    'tpl', 'ybi': 'ybi', 'bqm': 'bqm', 'uz': 'uzb', 'zu': 'zul', 'hi': 'hin', 'kwx': 'kwx', 'ike': 'ike', 'njy':
+    'njy', 'yav': 'yav', 'nge': 'nge', 'nxa': 'nxa', 'nxl': 'nxl', 'ybb': 'ybb', 'en-Dupl': 'eng', 'tdc': 'tdc',
+    'bcc': 'bcc', 'jmx-x-EnAm': 'jmx', 'kbx': 'kbx', 'chp': 'chp', 'rme': 'rme', 'pis': 'pis', 'snk': 'snk',
+    'sdk': 'sdk', 'abc': 'abc', 'zaw': 'zaw', 'mle': 'mle', 'kby': 'kby', 'nsk-Latn': 'nsk', 'ceb': 'ceb',
+    'bbk': 'bbk', 'hro': 'hro', 'kvt': 'kvt', 'tnp': 'tnp', 'kak': 'kak', 'nwi': 'nwi', 'th-TH': 'tha', 'xh':
+    'xho', 'lbr': 'lbr', 'fon': 'fon', 'dag': 'dag', 'bim': 'bim', 'qve': 'qve', 'vi': 'vie', 'wnk': 'wnk',
+    'mqj': 'mqj', 'ags': 'ags', 'nsp': 'nsp', 'ur': 'urd', 'lgr': 'lgr', 'war': 'war', 'pt': 'por', 'lgg':
+    'lgg', 'loh': 'loh', 'tnt': 'tnt', 'cgc': 'cgc', 'thy': 'thy', 'luy': 'luy', 'aeu': 'aeu', 'kek': 'kek',
+    'tdg': 'tdg', 'sml': 'sml', 'tkd': 'tkd', 'sat': 'sat', 'nso': 'nso', 'bce': 'bce', 'dmg': 'dmg', 'bjr':
+    'bjr', 'hil': 'hil', 'gal': 'gal', 'fr': 'fra', 'ssn': 'ssn', 'saq': 'saq', 'mr': 'mar', 'gwc-Arab': 'gwc',
+    'ame': 'ame', 'ki': 'kik', 'hig': 'hig', 'myk': 'myk', 'qvm': 'qvm', 'pdu': 'pdu', 'sor': 'sor', 'enc':
+    'enc', 'nsn': 'nsn', 'mlw': 'mlw', 'ja': 'jpn', 'en-IN': 'eng', 'mry': 'mry', 'nco': 'nco', 'bss': 'bss',
+    'fli': 'fli', 'nza': 'nza', 'stk': 'stk', 'bwt': 'bwt', 'yi': 'yid', 'roo': 'roo', 'csw': 'csw', 'kr':
+    'kau', 'rel': 'rel', 'en': 'eng', 'mrn': 'mrn', 'amp': 'amp', 'nwe': 'nwe', 'kqr': 'kqr', 'kjb': 'kjb',
+    'hna': 'hna', 'xmd': 'xmd', 'mai': 'mai', 'lts': 'lts', 'bho': 'bho', 'jra': 'jra', 'jmx-x-coi': 'jmx',
+    'zh-CN': 'zho', 'qvo': 'qvo', 'cuv': 'cuv', 'bkh': 'bkh', 'mmu': 'mmu', 'rw': 'kin', 'agq': 'agq', 'wbm':
+    'wbm', 'kam': 'kam', 'buo': 'buo', 'bud': 'bud', 'azn': 'azn', 'yea': 'yea', 'mgq': 'mgq', 'cmn': 'cmn',
+    'pae': 'pae', 'bri': 'bri', 'bkx': 'bkx', 'idt': 'idt', 'mfh': 'mfh', 'lsi': 'lsi', 'xty': 'xty', 'cbr':
+    'cbr', 'tsb': 'tsb', 'brb': 'brb', 'guc': 'guc', 'qxh': 'qxh', 'fuh': 'fuh', 'pce': 'pce', 'tuv': 'tuv',
+    'awb': 'awb', 'mam': 'mam', 'nst': 'nst', 'bm': 'bam', 'hao': 'hao', 'nla': 'nla', 'wtk': 'wtk', 'odk':
+    'odk', 'tom': 'tom', 'thl': 'thl', 'tuz': 'tuz', 'ewo': 'ewo', 'azo': 'azo', 'aia': 'aia', 'dnw': 'dnw',
+    'tpi': 'tpi', 'nyo': 'nyo', 'nas': 'nas', 'llg': 'llg', 'mxl': 'mxl', 'tbj': 'tbj', 'muv': 'muv', 'lns':
+    'lns', 'qaa': 'qaa', 'bwx': 'bwx', 'ko': 'kor', 'yin': 'yin', 'nhx': 'nhx', 'sxb': 'sxb', 'kwu': 'kwu',
+    'ru': 'rus', 'it': 'ita', 'rnl': 'rnl', 'tod': 'tod', 'thk': 'thk', 'unr': 'unr', 'nl': 'nld', 'ozm': 'ozm',
+    'bax': 'bax', 'quz': 'quz',
+}
+
+# langdetect codes of the Bloom languages it has a profile for
+LANGDETECT_CODES = {
+    'afr': ('af',), 'ben': ('bn',), 'cmn': ('zh-cn', 'zh-tw'), 'deu': ('de',), 'eng': ('en',), 'fas': ('fa',),
+    'fil': ('tl',), 'fra': ('fr',), 'guj': ('gu',), 'hin': ('hi',), 'ind': ('id',), 'ita': ('it',), 'jpn': ('ja',),
+    'kan': ('kn',), 'kor': ('ko',), 'mal': ('ml',), 'mar': ('mr',), 'nep': ('ne',), 'nld': ('nl',), 'pan': ('pa',),
+    'por': ('pt',), 'ron': ('ro',), 'rus': ('ru',), 'som': ('so',), 'spa': ('es',), 'swa': ('sw',), 'swh': ('sw',),
+    'tam': ('ta',), 'tha': ('th',), 'urd': ('ur',), 'vie': ('vi',), 'zho': ('zh-cn', 'zh-tw'),
+}
+
+
+class BloomIndex:
+    """
+    Albums of the requested languages, built from data.json in three streaming passes.
+    """
+
+    def __init__(self, languages):
+        self.languages = set(languages)
+        self.quarantined = set() # Story ids
+        self.albums = {} # language -> {album_id: [annotation, ...]} in file order
+        self.image_urls = {} # image id -> url_o, only for the images of the albums
+        self.skipped_quarantined = 0
+
+    @classmethod
+    def from_file(cls, data_path: str, languages) -> "BloomIndex":
+        """
+        Reads data.json and indexes the albums of languages (ISO 639-3 codes).
+        """
+        index = cls(languages)
+        with open(data_path, "rb") as f:
+            if ijson is None:
+                data = json.load(f)
+                stories = data["stories"].items()
+                annotations = (entry for annotation in data["annotations"] for entry in annotation)
+                images = data["images"]
+                index._index(stories, annotations, images)
+                return index
+            index._index_stories(ijson.kvitems(f, "stories"))
+            f.seek(0)
+            index._index_annotations(ijson.items(f, "annotations.item.item"))
+            f.seek(0)
+            index._index_images(ijson.items(f, "images.item"))
+        return index
+
+    def _index(self, stories, annotations, images) -> None:
+        self._index_stories(stories)
+        self._index_annotations(annotations)
+        self._index_images(images)
+
+    def _index_stories(self, stories) -> None:
+        for story_id, story in stories:
+            if story.get("quarantine"):
+                self.quarantined.add(story_id)
+
+    def _index_annotations(self, annotations) -> None:
+        for entry in annotations:
+            language = BLOOM_LANGUAGE_TAGS.get(entry["lang"])
+            if language not in self.languages:
+                continue
+            if entry["story_id"] in self.quarantined:
+                self.skipped_quarantined += 1
+                continue
+            self.albums.setdefault(language, {}).setdefault(entry["album_id"], []).append({
+                "image_id": entry["photo_flickr_id"],
+                "story_index": int(entry["worker_arranged_photo_order"]),
+                "story_id": entry["story_id"],
+                "text": entry["text"],
+            })
+
+    def _index_images(self, images) -> None:
+        needed = {
+            entry["image_id"]
+            for albums in self.albums.values()
+            for entries in albums.values()
+            for entry in entries
+        }
+        for image in images:
+            if image["id"] in needed:
+                self.image_urls[image["id"]] = image["url_o"]
+
+
+def index_album_folders(image_dir: str) -> dict:
+    """
+    Maps album ids to the "<index>_<album_id>" image folders already downloaded under image_dir.
+    """
+    folders = {}
+    if not image_dir or not os.path.isdir(image_dir):
+        return folders
+    for name in os.listdir(image_dir):
+        prefix, separator, album_id = name.partition("_")
+        if separator and prefix.isdigit() and os.path.isdir(os.path.join(image_dir, name)):
+            folders[album_id] = name
+    return folders
+
+
+def _detect_chunk(texts: list) -> list:
+    # Runs in the worker processes
+    detections = []
+    for text in texts:
+        try:
+            top = detect_langs(text)[0]
+            detections.append((top.lang, top.prob))
+        except Exception:
+            detections.append((None, 0.0)) # Text without features (e.g. too short)
+    return detections
+
+
+def detect_album_languages(texts: list, executor: ProcessPoolExecutor = None) -> list:
+    """
+    Returns the (langdetect code, probability) of the most likely language of every text.
+    """
+    if detect_langs is None:
+        raise ImportError("Language purity filtering needs the langdetect package (pip install langdetect)")
+    chunks = [texts[i:i + ALBUMS_PER_CHUNK] for i in range(0, len(texts), ALBUMS_PER_CHUNK)]
+    results = executor.map(_detect_chunk, chunks) if executor is not None else map(_detect_chunk, chunks)
+    return [detection for chunk in results for detection in chunk]
+
+
+def build_manifest_entries(language: str, albums: dict, image_urls: dict, image_folders: dict = None) -> list:
+    """
+    Turns the indexed albums of a language into manifest entries, images in story order.
+
+    Image paths are relative to the image root, "<language>/<index>_<album_id>/<NN><ext>",
+    or inside the folder already downloaded for the album.
+    """
+    image_folders = image_folders or {}
+    entries = []
+    for album_index, (album_id, annotations) in enumerate(albums.items()):
+        annotations = sorted(annotations, key=lambda annotation: annotation["story_index"])
+        folder = image_folders.get(album_id) or os.path.join(language, f"{album_index:04d}_{album_id}")
+        urls = [image_urls.get(annotation["image_id"]) for annotation in annotations]
+        entries.append({
+            "album_id": album_id,
+            "language": language,
+            "story_ids": sorted({annotation["story_id"] for annotation in annotations}),
+            "images": [
+                os.path.join(folder, f"{annotation['story_index']:02d}{os.path.splitext(urlparse(url or '').path)[1] or '.jpg'}")
+                for annotation, url in zip(annotations, urls)
+            ],
+            "image_urls": urls,
+            "texts": [annotation["text"] for annotation in annotations],
+        })
+    return entries
+
+
+def filter_pure_albums(
+    language: str,
+    entries: list,
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    executor: ProcessPoolExecutor = None,
+) -> tuple:
+    """
+    Keeps the albums langdetect attributes to language with at least min_confidence.
+
+    Returns:
+        tuple: (kept entries, dropped entries). Languages langdetect has no profile
+               for are kept whole.
+    """
+    codes = LANGDETECT_CODES.get(language)
+    if codes is None or min_confidence <= 0:
+        return entries, []
+    detections = detect_album_languages([" ".join(entry["texts"]) for entry in entries], executor)
+    kept, dropped = [], []
+    for entry, (detected, probability) in zip(entries, detections):
+        (kept if detected in codes and probability >= min_confidence else dropped).append(entry)
+    return kept, dropped
+
+
+def write_manifest(entries: list, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def extract_languages(
+    data_path: str,
+    languages: list,
+    output_dir: str,
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+    image_dir: str = None,
+    executor: ProcessPoolExecutor = None,
+) -> dict:
+    """
+    Writes <output_dir>/bloom_<language>.jsonl for every requested language.
+
+    Args:
+        data_path (str): The Bloom-VIST data.json.
+        languages (list[str]): ISO 639-3 codes, e.g. ["spa", "eng"].
+        output_dir (str): Directory of the manifests.
+        min_confidence (float, optional): langdetect probability an album needs to be
+                                          kept, 0 keeps every album.
+        image_dir (str, optional): Image root with album folders already downloaded.
+        executor (ProcessPoolExecutor, optional): Pool of the language detection.
+
+    Returns:
+        dict: {language: {"albums", "kept", "manifest"}}
+    """
+    unknown = sorted(set(languages) - set(BLOOM_VIST_LANGUAGES))
+    if unknown:
+        raise ValueError(f"Not Bloom-VIST languages: {unknown}")
+    index = BloomIndex.from_file(data_path, languages)
+    image_folders = index_album_folders(image_dir)
+    report = {}
+    for language in languages:
+        entries = build_manifest_entries(language, index.albums.get(language, {}), index.image_urls, image_folders)
+        kept, _ = filter_pure_albums(language, entries, min_confidence, executor)
+        manifest_path = os.path.join(output_dir, f"bloom_{language}.jsonl")
+        write_manifest(kept, manifest_path)
+        report[language] = {"albums": len(entries), "kept": len(kept), "manifest": manifest_path}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract per-language album manifests from the Bloom-VIST data.json.")
+    parser.add_argument("data", help="Bloom-VIST data.json")
+    parser.add_argument("--languages", required=True, help="Comma separated ISO 639-3 codes, e.g. spa,eng")
+    parser.add_argument("--output-dir", default="manifests", help="Directory of the bloom_<language>.jsonl manifests")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help="langdetect probability an album needs to be kept (0 disables the filter)")
+    parser.add_argument("--image-dir", default=None, help="Image root whose downloaded album folders are reused")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Language detection processes")
+    args = parser.parse_args()
+
+    languages = [language.strip() for language in args.languages.split(",") if language.strip()]
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        report = extract_languages(
+            args.data, languages, args.output_dir, args.min_confidence, args.image_dir, executor
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for language, counts in report.items():
+        print(f"{language}: kept {counts['kept']} of {counts['albums']} albums -> {counts['manifest']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""
+Bulk story generation through the Gemini Batch API.
+
+For evaluation runs, which can wait but should cost little, the albums of a
+manifest are not sent as interactive requests. BulkJob writes them into one
+request file in the batch format (a JSONL line {"key": album_id, "request":
+GenerateContentRequest} per album), uploads it, starts a batch job and polls it
+with a growing interval. Once the job is done its output file is downloaded and
+mapped back into the results and logs files written by storyteller.batch
+(album_id/texts/images/predicted_texts and album_id/log).
+
+Every step streams: the manifest is read one album at a time, the request and
+output files are written and read line by line, and the parsed answers are
+indexed in a shelve on disk, so the memory use does not grow with the manifest.
+The job is recorded in <results>.bulk_state.json, so running the same command
+again after an interruption keeps polling the same job instead of submitting a
+new one. Albums without a usable answer are listed in <results>.bulk_failed.jsonl
+in the manifest format, to generate them with storyteller.batch.
+
+Usage:
+    python -m storyteller.bulk_jobs manifest.json --model gemini-2.0-flash --language English \
+        --results results_gemini20_eng.json --logs logs_gemini20_eng.json
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import shelve
+import time
+
+from google.genai import types
+from tqdm import tqdm
+
+from storyteller.batch import iter_manifest, load_album_images
+from storyteller.core import GenAIAgent, Story, prepare_story_request, resolve_model_id
+from storyteller.language_packs import DEFAULT_LANGUAGE, available_languages
+from storyteller.metrics import estimate_text_tokens
+from storyteller.response_parsing import StoryParseError, parse_story_response
+
+logger = logging.getLogger(__name__)
+
+# The Story schema in the REST form, the request file cannot carry the TypedDict
+STORY_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "story": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"image": {"type": "INTEGER"}, "story_part": {"type": "STRING"}},
+                "required": ["image", "story_part"],
+            },
+        },
+    },
+    "required": ["story"],
+}
+
+DONE_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+}
+FAILED_STATES = {
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+
+class BulkJobError(RuntimeError):
+    """
+    Raised when a batch job ends without an output file.
+    """
+
+
+def _part_json(item) -> dict:
+    if isinstance(item, str):
+        return {"text": item}
+    return item.model_dump(mode="json", exclude_none=True)
+
+
+def build_request(agent: GenAIAgent, content: list) -> dict:
+    """
+    Converts the contents and the generation config of a story request into a
+    GenerateContentRequest of the batch request file.
+    """
+    config = agent.build_generation_config(Story)
+    generation_config = {
+        "temperature": config.temperature,
+        "max_output_tokens": config.max_output_tokens,
+        "response_modalities": config.response_modalities,
+    }
+    if config.response_mime_type:
+        generation_config["response_mime_type"] = config.response_mime_type
+    if config.response_schema is not None:
+        generation_config["response_schema"] = STORY_RESPONSE_SCHEMA
+    request = {
+        "contents": [{"role": "user", "parts": [_part_json(item) for item in content]}],
+        "generation_config": generation_config,
+        "safety_settings": [setting.model_dump(mode="json", exclude_none=True) for setting in config.safety_settings],
+    }
+    if config.system_instruction:
+        request["system_instruction"] = {"parts": [{"text": config.system_instruction}]}
+    return request
+
+
+class _JsonListWriter:
+    # Writes a JSON list item by item, in the layout of json.dump(indent=2)
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.count = 0
+
+    def __enter__(self):
+        self.file = open(self.tmp_path, "w", encoding="utf-8")
+        self.file.write("[")
+        return self
+
+    def write(self, item) -> None:
+        text = json.dumps(item, indent=2).replace("\n", "\n  ")
+        self.file.write(("," if self.count else "") + "\n  " + text)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.file.write("\n]" if self.count else "]")
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+class BulkJob:
+    """
+    Story generation of a whole manifest as one batch job.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        language: str,
+        results_path: str,
+        logs_path: str,
+        genai_client=None,
+        image_root: str = None,
+        poll_sec: float = 30.0,
+        max_poll_sec: float = 600.0,
+    ):
+        """
+        Args:
+            model_id (str): Model id or app display name of the model to use.
+            language (str): Story language, one with a language pack (e.g. "English").
+            results_path (str): Output file for the album results.
+            logs_path (str): Output file for the per album logs.
+            genai_client (optional): Client with the files and batches APIs, e.g.
+                                     storyteller.fakes.FakeGenAIClient. Defaults to
+                                     the shared client of GOOGLE_API_KEY.
+            image_root (str, optional): Directory that relative image paths are resolved against.
+            poll_sec (float, optional): First interval between two polls of the job.
+            max_poll_sec (float, optional): Cap of the interval, which grows by half each poll.
+        """
+        self.model_id = resolve_model_id(model_id)
+        self.language = language
+        self.results_path = results_path
+        self.logs_path = logs_path
+        self.agent = GenAIAgent(specified_model_id=self.model_id, select_system_prompt=language, genai_client=genai_client)
+        self.genai_client = self.agent.genai_client
+        self.image_root = image_root
+        self.poll_sec = poll_sec
+        self.max_poll_sec = max_poll_sec
+        self.state_path = f"{results_path}.bulk_state.json"
+        self.requests_path = f"{results_path}.bulk_requests.jsonl"
+        self.output_path = f"{results_path}.bulk_output.jsonl"
+        self.index_path = f"{results_path}.bulk_index"
+        self.failed_path = f"{results_path}.bulk_failed.jsonl"
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict) -> None:
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def write_requests(self, manifest_path: str, show_progress: bool = True) -> dict:
+        """
+        Writes the request file of a manifest, one line per album.
+
+        Returns:
+            dict: {"requests": albums written, "unreadable": albums whose images could not be read}
+        """
+        summary = {"requests": 0, "unreadable": 0}
+        with open(self.requests_path, "w", encoding="utf-8") as f:
+            for album in tqdm(iter_manifest(manifest_path), desc="Requests", disable=not show_progress):
+                try:
+                    images = load_album_images(album["images"], self.image_root)
+                    _, content, _ = prepare_story_request(images, self.model_id, self.language, self.agent)
+                except Exception as e:
+                    # Left out of the job, collect() lists it with the failed albums
+                    logger.warning("Album %s left out of the job: %s", album["album_id"], e)
+                    summary["unreadable"] += 1
+                    continue
+                f.write(json.dumps({"key": album["album_id"], "request": build_request(self.agent, content)}) + "\n")
+                summary["requests"] += 1
+        return summary
+
+    def submit(self, manifest_path: str, show_progress: bool = True) -> dict:
+        """
+        Writes and uploads the request file of a manifest and starts the batch job.
+
+        Returns:
+            dict: The job state saved in the state file.
+        """
+        summary = self.write_requests(manifest_path, show_progress)
+        display_name = os.path.basename(self.results_path)
+        uploaded = self.genai_client.files.upload(
+            file=self.requests_path,
+            config=types.UploadFileConfig(display_name=f"{display_name}.requests", mime_type="jsonl"),
+        )
+        job = self.genai_client.batches.create(
+            model=self.model_id,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=display_name),
+        )
+        state = {
+            "job_name": job.name,
+            "input_file": uploaded.name,
+            "model": self.model_id,
+            "language": self.language,
+            "manifest": manifest_path,
+            "requests": summary["requests"],
+            "submitted_at": round(time.time(), 3),
+        }
+        self._save_state(state)
+        # The uploaded copy is the one the job reads, the local file holds every image once more
+        os.remove(self.requests_path)
+        logger.info("Submitted %s with %d albums (%d unreadable)", job.name, summary["requests"], summary["unreadable"])
+        return state
+
+    def wait(self, job_name: str) -> types.BatchJob:
+        """
+        Polls a job until it ends, waiting longer between polls as it runs.
+
+        Raises:
+            BulkJobError: If the job fails, expires or is cancelled.
+        """
+        interval = self.poll_sec
+        last_state = None
+        while True:
+            job = self.genai_client.batches.get(name=job_name)
+            if job.state != last_state:
+                logger.info("%s: %s", job_name, job.state.name)
+                last_state = job.state
+            if job.state in DONE_STATES:
+                return job
+            if job.state in FAILED_STATES:
+                raise BulkJobError(f"Batch job {job_name} ended in {job.state.name}: {job.error}")
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            interval = min(self.max_poll_sec, interval * 1.5)
+
+    def _album_record(self, result: dict, job_name: str) -> dict:
+        if "response" not in result:
+            error = result.get("error") or result.get("status") or "No response"
+            return {"status": "error", "error": json.dumps(error)}
+        response = types.GenerateContentResponse.model_validate(result["response"])
+        text = response.text or ""
+        try:
+            story = parse_story_response(text)
+        except StoryParseError as e:
+            return {"status": "error", "error": repr(e)}
+        usage = response.usage_metadata
+        log = {
+            "model_used": self.model_id,
+            "output_tokens": usage.candidates_token_count if usage else None,
+            "input_tokens": usage.prompt_token_count if usage else None,
+            # A batch job has no per album latency
+            "elapsed_time_sec": None,
+            "batch_job": job_name,
+        }
+        # Gemma 3 answers come without an output token count
+        if log["output_tokens"] is None:
+            log["output_tokens"] = estimate_text_tokens(text)
+            log["output_tokens_estimated"] = True
+        return {"status": "ok", "predicted_texts": [part["story_part"] for part in story["story"]], "log": log}
+
+    def collect(self, job: types.BatchJob, manifest_path: str) -> dict:
+        """
+        Downloads the output of a finished job and writes the results and logs files.
+
+        Returns:
+            dict: Counts of the "completed" and "failed" albums.
+        """
+        if job.dest is None or not job.dest.file_name:
+            raise BulkJobError(f"Batch job {job.name} has no output file")
+        self.genai_client.files.download(file=job.dest.file_name, destination=self.output_path)
+
+        # Answers indexed on disk by album, as the output is not in manifest order
+        with shelve.open(self.index_path, flag="n") as index:
+            with open(self.output_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        index[str(result["key"])] = self._album_record(result, job.name)
+
+            summary = {"completed": 0, "failed": 0}
+            with _JsonListWriter(self.results_path) as results, _JsonListWriter(self.logs_path) as logs, \
+                    open(self.failed_path, "w", encoding="utf-8") as failed:
+                for album in iter_manifest(manifest_path):
+                    record = index.get(str(album["album_id"]))
+                    if record is None or record["status"] != "ok":
+                        failed.write(json.dumps(dict(album, error=record["error"] if record else "Not in the job")) + "\n")
+                        summary["failed"] += 1
+                        continue
+                    results.write({
+                        "album_id": album["album_id"],
+                        "texts": album["texts"],
+                        "images": album["images"],
+                        "predicted_texts": record["predicted_texts"],
+                    })
+                    logs.write({"album_id": album["album_id"], "log": record["log"]})
+                    summary["completed"] += 1
+        return summary
+
+    def run(self, manifest_path: str, wait: bool = True, show_progress: bool = True) -> dict:
+        """
+        Submits the manifest (unless its job was submitted already), waits for the
+        job and writes the outputs.
+
+        Returns:
+            dict: Counts of the "completed" and "failed" albums, None without wait.
+        """
+        state = self.load_state()
+        submitted = state is not None and (state["manifest"], state["model"], state["language"]) == (
+            manifest_path, self.model_id, self.language
+        )
+        if not submitted:
+            state = self.submit(manifest_path, show_progress)
+        else:
+            logger.info("Resuming %s submitted at %s", state["job_name"], time.ctime(state["submitted_at"]))
+        if not wait:
+            return None
+        try:
+            job = self.wait(state["job_name"])
+        except BulkJobError:
+            os.remove(self.state_path) # The next run submits the manifest again
+            raise
+        summary = self.collect(job, manifest_path)
+        os.remove(self.state_path) # Done, the next run submits a new job
+        for path in glob.glob(f"{glob.escape(self.index_path)}*"):
+            os.remove(path)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the stories of a manifest as one Gemini batch job.")
+    parser.add_argument("manifest", help="JSON list or JSONL file of {album_id, images, texts} entries")
+    parser.add_argument("--model", default=GenAIAgent.DEFAULT_FLASH_MODEL_ID, help="Model id or app display name")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE, choices=available_languages())
+    parser.add_argument("--results", required=True, help="Output results JSON file")
+    parser.add_argument("--logs", required=True, help="Output logs JSON file")
+    parser.add_argument("--image-root", default=None, help="Directory relative image paths are resolved against")
+    parser.add_argument("--poll-sec", type=float, default=30.0, help="First interval between two polls of the job")
+    parser.add_argument("--max-poll-sec", type=float, default=600.0, help="Cap of the polling interval")
+    parser.add_argument("--no-wait", action="store_true", help="Submit and exit, run again later to collect the results")
+    parser.add_argument("--fake-backend", action="store_true", help="Use the offline fake batch backend")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="[%(levelname)s] %(message)s")
+    logger.setLevel(logging.INFO) # The job's progress, without the HTTP client's request lines
+
+    genai_client = None
+    if args.fake_backend:
+        from storyteller.fakes import FakeGenAIClient
+        genai_client = FakeGenAIClient()
+
+    bulk_job = BulkJob(
+        model_id=args.model,
+        language=args.language,
+        results_path=args.results,
+        logs_path=args.logs,
+        genai_client=genai_client,
+        image_root=args.image_root,
+        poll_sec=0.0 if args.fake_backend else args.poll_sec,
+        max_poll_sec=args.max_poll_sec,
+    )
+    summary = bulk_job.run(args.manifest, wait=not args.no_wait)
+    if summary is None:
+        print(f"Job state saved in {bulk_job.state_path}, run the same command again to collect the results")
+        return
+    print(f"Completed {summary['completed']}, failed {summary['failed']}")
+    if summary["failed"]:
+        print(f"  failed albums written to {bulk_job.failed_path}, a manifest for storyteller.batch")
+
+
+if __name__ == "__main__":
+    main()
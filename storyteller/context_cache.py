@@ -0,0 +1,180 @@
+"""
+Context caching of the static start of the story requests.
+
+Every request starts with the same system prompt, instructions and one-shot
+example (images and output) of its language, only the user's images change.
+ContextCacheManager keeps one cached-content handle of that prefix per (model,
+language), created on first use and refreshed before its TTL runs out, so the
+requests only send the user's images and the prefix tokens are billed at the
+cached rate. Models or prefixes the backend cannot cache (Gemma 3, prefixes
+under the minimum cache size) fall back to sending the full request, as do the
+requests whose caches call is rate limited or fails on the server (429/5xx).
+"""
+import datetime
+import hashlib
+import logging
+import os
+import threading
+
+from google.genai import errors, types
+
+from storyteller.scheduler import is_retryable
+
+logger = logging.getLogger(__name__)
+
+# Explicit context caching is only offered for Gemini models
+CACHEABLE_MODEL_PREFIXES = ("gemini",)
+
+DEFAULT_TTL_SEC = int(os.environ.get("STORY_CONTEXT_CACHE_TTL_SEC", 3600))
+# Refresh a handle this long before it expires, so no request uses an expired one
+DEFAULT_REFRESH_MARGIN_SEC = 300
+
+
+def _prefix_fingerprint(system_instruction, prefix_contents: list) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr(system_instruction).encode("utf-8"))
+    for item in prefix_contents:
+        if isinstance(item, str):
+            digest.update(b"text:" + item.encode("utf-8"))
+        elif getattr(item, "inline_data", None) is not None:
+            digest.update(b"image:" + item.inline_data.data)
+        else:
+            digest.update(repr(item).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _CacheHandle:
+    def __init__(self, name: str, expire_time: float, token_count: int):
+        self.name = name
+        self.expire_time = expire_time # Unix time
+        self.token_count = token_count
+
+
+class ContextCacheManager:
+    """
+    Thread safe registry of the cached-content handles of the request prefixes.
+    """
+
+    def __init__(self, ttl_sec: int = DEFAULT_TTL_SEC, refresh_margin_sec: int = DEFAULT_REFRESH_MARGIN_SEC):
+        """
+        Args:
+            ttl_sec (int, optional): Lifetime requested for every handle.
+            refresh_margin_sec (int, optional): How long before expiry a handle is refreshed.
+        """
+        self.ttl_sec = ttl_sec
+        self.refresh_margin_sec = refresh_margin_sec
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._handles = {} # (client id, model, prefix fingerprint) -> _CacheHandle
+        self._unsupported = set() # Keys the backend refused to cache
+        self.created = 0
+        self.refreshed = 0
+        self.fallbacks = 0
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _expire_time(cached_content, ttl_sec: int) -> float:
+        if cached_content.expire_time is not None:
+            return cached_content.expire_time.timestamp()
+        return datetime.datetime.now(datetime.timezone.utc).timestamp() + ttl_sec
+
+    def get_cached_content(self, genai_client, model_id: str, system_instruction, prefix_contents: list):
+        """
+        Returns the handle of the cached prefix, creating or refreshing it if needed.
+
+        Args:
+            genai_client: The client the requests are sent with.
+            model_id (str): The model of the requests.
+            system_instruction: The system prompt of the requests (None if the model takes none).
+            prefix_contents (list): The static content items at the start of every request.
+
+        Returns:
+            _CacheHandle | None: None when the prefix cannot be cached, the request
+                                 is then sent in full.
+        """
+        if not model_id.startswith(CACHEABLE_MODEL_PREFIXES) or not hasattr(genai_client, "caches"):
+            return None
+        key = (id(genai_client), model_id, _prefix_fingerprint(system_instruction, prefix_contents))
+        if key in self._unsupported:
+            return None
+
+        with self._key_lock(key):
+            handle = self._handles.get(key)
+            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+            if handle is not None and handle.expire_time - now > self.refresh_margin_sec:
+                return handle
+            try:
+                if handle is not None:
+                    try:
+                        updated = genai_client.caches.update(
+                            name=handle.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_sec}s")
+                        )
+                        handle.expire_time = self._expire_time(updated, self.ttl_sec)
+                        self.refreshed += 1
+                        return handle
+                    except errors.ClientError:
+                        pass # The handle is gone already, create a new one
+                cached_content = genai_client.caches.create(
+                    model=model_id,
+                    config=types.CreateCachedContentConfig(
+                        contents=prefix_contents,
+                        system_instruction=system_instruction,
+                        ttl=f"{self.ttl_sec}s",
+                        display_name=f"story-prefix-{model_id}",
+                    ),
+                )
+            except errors.APIError as e:
+                self._handles.pop(key, None)
+                self.fallbacks += 1
+                if is_retryable(e):
+                    # Rate limited or down for now, this request is sent in full and the next one asks again
+                    logger.warning("Context caching failed for %s, sending the full request: %s", model_id, e)
+                    return None
+                # e.g. the prefix is under the model's minimum cache size, do not ask again
+                logger.warning("Context caching unavailable for %s, sending full requests: %s", model_id, e)
+                self._unsupported.add(key)
+                return None
+            usage = cached_content.usage_metadata
+            handle = _CacheHandle(
+                cached_content.name,
+                self._expire_time(cached_content, self.ttl_sec),
+                usage.total_token_count if usage else None,
+            )
+            self._handles[key] = handle
+            self.created += 1
+            return handle
+
+    def invalidate(self, handle: _CacheHandle) -> None:
+        """
+        Forgets a handle the backend no longer knows (e.g. deleted or expired early).
+        """
+        with self._lock:
+            for key, known in list(self._handles.items()):
+                if known is handle:
+                    del self._handles[key]
+
+    def stats(self) -> dict:
+        return {
+            "handles": len(self._handles),
+            "created": self.created,
+            "refreshed": self.refreshed,
+            "fallbacks": self.fallbacks,
+        }
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_default_context_cache() -> ContextCacheManager:
+    """
+    Returns the process wide context cache manager, created on first use.
+    """
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = ContextCacheManager()
+        return _default_manager
@@ -0,0 +1,845 @@
+"""
+Core story generation logic shared by the Streamlit app, the HTTP service and the
+batch tools. It has no Streamlit dependency: the API key comes from the caller or
+from GOOGLE_API_KEY (which .env can set).
+"""
+from dotenv import load_dotenv
+import os
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from google import genai
+from google.genai import errors, types
+import typing_extensions as typing
+
+from storyteller.context_cache import ContextCacheManager, get_default_context_cache
+from storyteller.image_preprocessing import ImageBudget, budgeted_size, estimate_image_tokens, preprocess_images
+from storyteller.metrics import StageTimer, estimate_text_tokens, get_metrics_registry
+from storyteller.language_packs import DEFAULT_LANGUAGE, get_language_pack
+from storyteller.one_shot import build_few_shot_content
+from storyteller.response_cache import ResponseCache, get_default_response_cache, make_cache_key
+from storyteller.response_parsing import StoryParseError, parse_story_response
+from storyteller.scheduler import DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT, RequestScheduler, get_default_scheduler
+from storyteller.stream_parser import IncrementalStoryParser
+
+logger = logging.getLogger(__name__)
+
+#Load environment variables for api key
+load_dotenv()
+
+
+# Schema for the visual storytelling task structured generation
+# The Gemini/Gemma model output format will follow this
+class StoryPart(typing.TypedDict):
+    image: typing.Annotated[int, "Should be the number in order according to the number of images in the input."]
+    story_part: typing.Annotated[str, "Should be the generated story for the corresponding image in order."]
+
+class Story(typing.TypedDict):
+    story: list[StoryPart]
+##########################################
+
+# GenAI clients are kept for the whole process, keyed by API key, so every request
+# reuses the same connection pool instead of paying connection setup again
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+# Event loop running in a daemon thread. All async SDK calls run on it, so the
+# async connection pool is always used from the same loop
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_shared_client(api_key: str, base_url: str = None) -> genai.Client:
+    """
+    Returns the process wide genai.Client for api_key, creating it on first use.
+    base_url points the client at another endpoint (e.g. the local mock server).
+    """
+    with _shared_clients_lock:
+        client = _shared_clients.get((api_key, base_url))
+        if client is None:
+            http_options = types.HttpOptions(base_url=base_url) if base_url else None
+            client = genai.Client(api_key=api_key, http_options=http_options)
+            _shared_clients[(api_key, base_url)] = client
+        return client
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the shared background event loop, starting its thread on first use.
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="genai-event-loop", daemon=True)
+            thread.start()
+            _background_loop = loop
+        return _background_loop
+
+
+def run_on_background_loop(coroutine):
+    """
+    Runs a coroutine on the shared background loop and blocks until its result.
+    """
+    loop = get_background_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError("Blocking calls cannot be made from the background event loop, await the async variant instead.")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+##########################################
+
+class GenAIAgent:
+    """
+    A utility class for interacting with Google's GenAI models,
+    handling synchronous and asynchronous generation.
+    """
+
+    # Configuration constants
+    DEFAULT_FLASH_MODEL_ID = "gemini-2.0-flash"
+    DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT = DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT
+
+    # The prompts of each language (system prompt, instructions, one-shot example output) are
+    # language packs, see storyteller.language_packs. Gemma 3 does not support system prompts,
+    # so the instructions repeat them to get the required structure
+
+    # Standard safety configurations
+    API_SAFETY_SETTINGS = [
+        types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF")
+    ]
+
+    def __init__(
+        self,
+        specified_model_id: str = None,
+        select_system_prompt: str = DEFAULT_LANGUAGE,
+        genai_client=None,
+        response_cache: ResponseCache = None,
+        context_cache: ContextCacheManager = None,
+        scheduler: RequestScheduler = None,
+        api_key: str = None,
+    ):
+        """
+        Initializes the GenAIAgent with model and system prompt settings.
+
+        Args:
+            specified_model_id (str, optional): The ID of the model to use.
+                                              Defaults to DEFAULT_FLASH_MODEL_ID.
+            select_system_prompt (str, optional): Language of the story, whose language pack
+                                                  gives the prompts. Defaults to English.
+            genai_client (optional): A ready client to use instead of building one,
+                                     e.g. storyteller.fakes.FakeGenAIClient for offline runs.
+            response_cache (ResponseCache, optional): Cache answering identical requests.
+                                                      None disables caching.
+            context_cache (ContextCacheManager, optional): Caches the static prompt prefix
+                                                           on the backend. None sends full requests.
+            scheduler (RequestScheduler, optional): Rate limits, queues and retries the
+                                                    requests. None sends them right away.
+            api_key (str, optional): Your Google API key, used when no genai_client is
+                                     given. Defaults to the GOOGLE_API_KEY environment variable.
+        """
+        self.chosen_model_id = specified_model_id or self.DEFAULT_FLASH_MODEL_ID
+        # Raises ValueError for a language without a pack
+        self.language_pack = get_language_pack(select_system_prompt or DEFAULT_LANGUAGE)
+        self.language = self.language_pack.language
+        self.response_cache = response_cache
+        self.context_cache = context_cache
+        self.scheduler = scheduler
+        self.active_system_prompt = self.language_pack.system_prompt
+
+        if genai_client is None:
+            api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+            if not api_key:
+                raise ValueError("No Google API key: pass api_key or set GOOGLE_API_KEY (e.g. in .env)")
+            genai_client = get_shared_client(api_key)
+        self.genai_client = genai_client # Client for generation
+
+        self.output_token_cap = 8192 # Maximum tokens for model response
+
+    def build_few_shot_content(self) -> list:
+        """
+        Returns the prompt with the one-shot example (instructions, example images
+        and example output) to put before the user's images.
+        """
+        return build_few_shot_content(self.language)
+
+    def build_generation_config(self, response_schema_definition) -> types.GenerateContentConfig:
+        """
+        Builds the generation config for the chosen model.
+        """
+        if(self.chosen_model_id=="gemini-2.0-flash"):
+            return types.GenerateContentConfig(
+                temperature=1,
+                system_instruction=self.active_system_prompt,
+                max_output_tokens=self.output_token_cap,
+                response_modalities=["TEXT"],
+                response_mime_type = "application/json",
+                response_schema = response_schema_definition,
+                safety_settings=self.API_SAFETY_SETTINGS
+            )
+        #Gemma 3 with the API does not support structured output or System Prompt
+        return types.GenerateContentConfig(
+            temperature=1,
+            max_output_tokens=self.output_token_cap,
+            response_modalities=["TEXT"],
+            safety_settings=self.API_SAFETY_SETTINGS
+        )
+
+    def estimate_input_tokens(self, input_content_list: list) -> int:
+        """
+        Estimates the input tokens of a request before sending it, for rate limiting.
+        """
+        # The images are preprocessed to the model budget, about one tile each
+        image_tokens = estimate_image_tokens(self.chosen_model_id, 768, 768)
+        tokens = estimate_text_tokens(self.active_system_prompt) if self.chosen_model_id.startswith("gemini") else 0
+        for item in input_content_list:
+            tokens += estimate_text_tokens(item) if isinstance(item, str) else image_tokens
+        return tokens
+
+    def _check_cache(self, input_content_list: list, content_generation_config, bypass_cache: bool):
+        """
+        Looks the request up in the response cache.
+
+        Returns:
+            tuple: (cache_key, cached_value), both None when caching is disabled.
+        """
+        if self.response_cache is None:
+            return None, None
+        cache_key = make_cache_key(
+            input_content_list, self.chosen_model_id, self.language, content_generation_config
+        )
+        if bypass_cache:
+            self.response_cache.record_bypass()
+            return cache_key, None
+        return cache_key, self.response_cache.get(cache_key)
+
+    @staticmethod
+    def _is_cacheable(generated_text: str, response_schema_definition) -> bool:
+        # An answer that cannot be read as a story would be replayed for the whole TTL
+        if not generated_text:
+            return False
+        if response_schema_definition is Story:
+            try:
+                parse_story_response(generated_text)
+            except StoryParseError:
+                return False
+        return True
+
+    def _cached_result(self, cached_value: dict, request_start_time: float, include_metrics_log: bool):
+        if include_metrics_log:
+            performance_log = dict(cached_value["log"])
+            performance_log["cache_hit"] = True
+            performance_log["elapsed_time_sec"] = round(time.time() - request_start_time, 2)
+            return cached_value["text"], performance_log
+        return cached_value["text"]
+
+    def _build_performance_log(self, usage_metadata, generated_text: str, request_start_time: float) -> dict:
+        performance_log = {
+            "model_used": self.chosen_model_id,
+            "output_tokens": usage_metadata.candidates_token_count if usage_metadata else None,
+            "input_tokens": usage_metadata.prompt_token_count if usage_metadata else None,
+            "elapsed_time_sec": round(time.time() - request_start_time, 2),
+        }
+        if self.context_cache is not None:
+            # Cached prefix tokens are part of input_tokens but billed at the cached rate
+            cached_tokens = (usage_metadata.cached_content_token_count if usage_metadata else None) or 0
+            performance_log["cached_input_tokens"] = cached_tokens
+            performance_log["uncached_input_tokens"] = (performance_log["input_tokens"] or 0) - cached_tokens
+        # Gemma 3 answers come without an output token count
+        if performance_log["output_tokens"] is None:
+            performance_log["output_tokens"] = estimate_text_tokens(generated_text)
+            performance_log["output_tokens_estimated"] = True
+        return performance_log
+
+    def _apply_context_cache(self, input_content_list: list, content_generation_config: types.GenerateContentConfig):
+        """
+        Replaces the static prefix of a request by its cached-content handle when
+        the backend can cache it.
+
+        Returns:
+            tuple: (contents, config, handle), unchanged with a None handle on fallback.
+        """
+        if self.context_cache is None:
+            return input_content_list, content_generation_config, None
+        prefix = self.build_few_shot_content()
+        starts_with_prefix = len(input_content_list) > len(prefix) and all(
+            item is prefix_item or (isinstance(item, str) and item == prefix_item)
+            for item, prefix_item in zip(input_content_list, prefix)
+        )
+        if not starts_with_prefix:
+            return input_content_list, content_generation_config, None
+        handle = self.context_cache.get_cached_content(
+            self.genai_client, self.chosen_model_id, content_generation_config.system_instruction, prefix
+        )
+        if handle is None:
+            return input_content_list, content_generation_config, None
+        # The system prompt is part of the cached content and may not be sent again
+        cached_config = content_generation_config.model_copy(
+            update={"cached_content": handle.name, "system_instruction": None}
+        )
+        return input_content_list[len(prefix):], cached_config, handle
+
+    async def _asend(self, contents: list, config, context_handle, input_content_list: list, content_generation_config):
+        try:
+            return await self.genai_client.aio.models.generate_content(
+                model=self.chosen_model_id, contents=contents, config=config
+            )
+        except errors.ClientError as e:
+            if context_handle is None or e.code not in (403, 404):
+                raise
+            # The cached prefix is gone (deleted or expired early), send the full request once
+            self.context_cache.invalidate(context_handle)
+            return await self.genai_client.aio.models.generate_content(
+                model=self.chosen_model_id, contents=input_content_list, config=content_generation_config
+            )
+
+    async def _agenerate(
+        self,
+        input_content_list: list,
+        content_generation_config: types.GenerateContentConfig,
+        include_metrics_log: bool,
+        request_start_time: float,
+        cache_key: str = None,
+        response_schema_definition=None,
+    ):
+        # Creating or refreshing the cached prefix is a blocking call, keep it off the event loop
+        contents, config, context_handle = await asyncio.to_thread(
+            self._apply_context_cache, input_content_list, content_generation_config
+        )
+        send_start = time.perf_counter()
+        try:
+            api_response = await self._asend(contents, config, context_handle, input_content_list, content_generation_config)
+        except asyncio.CancelledError:
+            # e.g. the losing request of a hedge, it ran at least this long
+            get_metrics_registry().observe_stage(
+                "model_request", self.chosen_model_id, self.language, time.perf_counter() - send_start
+            )
+            raise
+        model_request_sec = time.perf_counter() - send_start
+
+        generated_text = api_response.text
+        performance_log = self._build_performance_log(api_response.usage_metadata, generated_text, request_start_time)
+        if cache_key is not None and self._is_cacheable(generated_text, response_schema_definition):
+            await asyncio.to_thread(self.response_cache.put, cache_key, {"text": generated_text, "log": performance_log})
+            performance_log = dict(performance_log, cache_hit=False)
+        # Only this answer's request time, a cache hit replaying the log must not carry it
+        performance_log = dict(performance_log, model_request_sec=round(model_request_sec, 4))
+        if include_metrics_log:
+            return generated_text, performance_log
+        return generated_text
+
+    async def agenerate_single_response(
+        self,
+        input_content_list: list,
+        response_schema_definition,
+        include_metrics_log: bool = False,
+        bypass_cache: bool = False
+    ):
+        """
+        Async variant of generate_single_response using the SDK's async client.
+
+        The request always runs on the shared background event loop, which owns the
+        async connection pool, so this can be awaited from any event loop.
+        """
+        request_start_time = time.time()
+        content_generation_config = self.build_generation_config(response_schema_definition)
+        # Hashing the images is CPU work, keep it off the event loop
+        cache_key, cached_value = await asyncio.to_thread(
+            self._check_cache, input_content_list, content_generation_config, bypass_cache
+        )
+        if cached_value is not None:
+            return self._cached_result(cached_value, request_start_time, include_metrics_log)
+
+        background_loop = get_background_loop()
+
+        def send_request():
+            coroutine = self._agenerate(
+                input_content_list, content_generation_config, include_metrics_log, request_start_time, cache_key,
+                response_schema_definition,
+            )
+            if asyncio.get_running_loop() is background_loop:
+                return coroutine
+            return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, background_loop))
+
+        if self.scheduler is None:
+            return await send_request()
+        return await self.scheduler.arun(
+            self.chosen_model_id,
+            self.estimate_input_tokens(input_content_list),
+            send_request,
+            actual_tokens=self._logged_input_tokens if include_metrics_log else None,
+        )
+
+    def generate_single_response(
+        self,
+        input_content_list: list,
+        response_schema_definition,
+        include_metrics_log: bool = False,
+        bypass_cache: bool = False
+    ):
+        """
+        Generates a single content response from the model.
+        Blocking wrapper around agenerate_single_response.
+
+        Args:
+            input_content_list (list): Prompt text, image labels and images.
+            response_schema_definition: Schema of the structured output.
+            include_metrics_log (bool, optional): Also return the performance log.
+            bypass_cache (bool, optional): Skip the response cache lookup to get a
+                                           fresh sample. The new answer is still cached.
+        """
+        request_start_time = time.time()
+        content_generation_config = self.build_generation_config(response_schema_definition)
+        cache_key, cached_value = self._check_cache(input_content_list, content_generation_config, bypass_cache)
+        if cached_value is not None:
+            return self._cached_result(cached_value, request_start_time, include_metrics_log)
+
+        def send_request():
+            return run_on_background_loop(
+                self._agenerate(
+                    input_content_list, content_generation_config, include_metrics_log, request_start_time, cache_key,
+                    response_schema_definition,
+                )
+            )
+
+        if self.scheduler is None:
+            return send_request()
+        # Waiting for admission blocks this (the caller's) thread, not the event loop
+        return self.scheduler.run(
+            self.chosen_model_id,
+            self.estimate_input_tokens(input_content_list),
+            send_request,
+            actual_tokens=self._logged_input_tokens if include_metrics_log else None,
+        )
+
+    @staticmethod
+    def _logged_input_tokens(result) -> int:
+        _, performance_log = result
+        return performance_log.get("input_tokens")
+
+    def _open_stream(self, contents: list, config: types.GenerateContentConfig):
+        # Errors of the request surface on the first chunk, read it before anything is yielded
+        stream = iter(self.genai_client.models.generate_content_stream(
+            model=self.chosen_model_id, contents=contents, config=config
+        ))
+        first_chunk = next(stream, None)
+        if first_chunk is None:
+            return iter(())
+        return itertools.chain((first_chunk,), stream)
+
+    def _open_stream_with_context_cache(self, input_content_list: list, content_generation_config):
+        contents, config, context_handle = self._apply_context_cache(input_content_list, content_generation_config)
+        try:
+            return self._open_stream(contents, config)
+        except errors.ClientError as e:
+            if context_handle is None or e.code not in (403, 404):
+                raise
+            # The cached prefix is gone (deleted or expired early), send the full request once
+            self.context_cache.invalidate(context_handle)
+            return self._open_stream(input_content_list, content_generation_config)
+
+    def stream_single_response(
+        self,
+        input_content_list: list,
+        response_schema_definition,
+        performance_log: dict = None,
+        bypass_cache: bool = False
+    ):
+        """
+        Generates a response with the SDK's streaming generation, yielding the text
+        chunks as they arrive.
+
+        Args:
+            input_content_list (list): Prompt text, image labels and images.
+            response_schema_definition: Schema of the structured output.
+            performance_log (dict, optional): Filled with the metrics of the request
+                                              once the stream is finished.
+            bypass_cache (bool, optional): Skip the response cache lookup.
+
+        Yields:
+            str: The next piece of the response text.
+        """
+        request_start_time = time.time()
+        content_generation_config = self.build_generation_config(response_schema_definition)
+        cache_key, cached_value = self._check_cache(input_content_list, content_generation_config, bypass_cache)
+        if cached_value is not None:
+            # A cached answer is complete already, it arrives as one chunk
+            generated_text, cached_log = self._cached_result(cached_value, request_start_time, True)
+            cached_log["time_to_first_token_sec"] = cached_log["elapsed_time_sec"]
+            if performance_log is not None:
+                performance_log.update(cached_log)
+            yield generated_text
+            return
+
+        text_chunks = []
+        time_to_first_token = None
+        usage_metadata = None
+        if self.scheduler is None:
+            chunks = self._open_stream_with_context_cache(input_content_list, content_generation_config)
+        else:
+            # The input is processed once the first chunk arrives, the request leaves the
+            # concurrency budget then and only errors before it are retried
+            chunks = self.scheduler.run(
+                self.chosen_model_id,
+                self.estimate_input_tokens(input_content_list),
+                lambda: self._open_stream_with_context_cache(input_content_list, content_generation_config),
+            )
+        for chunk in chunks:
+            if chunk.usage_metadata is not None:
+                usage_metadata = chunk.usage_metadata
+            if not chunk.text:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = round(time.time() - request_start_time, 2)
+            text_chunks.append(chunk.text)
+            yield chunk.text
+
+        generated_text = "".join(text_chunks)
+        stream_log = self._build_performance_log(usage_metadata, generated_text, request_start_time)
+        stream_log["time_to_first_token_sec"] = time_to_first_token
+        if cache_key is not None and self._is_cacheable(generated_text, response_schema_definition):
+            self.response_cache.put(cache_key, {"text": generated_text, "log": stream_log})
+            stream_log["cache_hit"] = False
+        if performance_log is not None:
+            performance_log.update(stream_log)
+
+
+# Display names used in the app mapped to the model ids used by the API
+MODEL_IDS = {
+    "Gemma 3 (27B)": "gemma-3-27b-it",
+    "Gemini 2.0 Flash": "gemini-2.0-flash",
+}
+
+
+def resolve_model_id(llm_model_name):
+    """
+    Maps an app display name (or an already valid model id) to the API model id.
+    Unknown names fall back to Gemini 2.0 Flash, as the app always did.
+    """
+    if llm_model_name in MODEL_IDS.values():
+        return llm_model_name
+    return MODEL_IDS.get(llm_model_name, GenAIAgent.DEFAULT_FLASH_MODEL_ID)
+
+
+def prepare_story_request(image_data_list, llm_model_name, language, ai_handler=None, image_budget=None, timer=None):
+    """
+    Builds the agent and the request contents (one-shot example followed by the
+    labelled user images) of a story generation.
+
+    Returns:
+        tuple: (GenAIAgent, content list, preprocessing report)
+    """
+    timer = timer or StageTimer()
+    model_name = resolve_model_id(llm_model_name)
+
+    # Instance of the agent for story generation
+    if ai_handler is None:
+        ai_handler = GenAIAgent(
+            specified_model_id=model_name,
+            select_system_prompt=language,
+            response_cache=get_default_response_cache(),
+            context_cache=get_default_context_cache(),
+            scheduler=get_default_scheduler(),
+        )
+    # Downscale and re-encode the uploads to the model's image budget before sending them
+    with timer.span("preprocessing"):
+        image_parts, preprocessing_report = preprocess_images(image_data_list, ai_handler.chosen_model_id, image_budget)
+    timer.record("image_decode", preprocessing_report["decode_time_sec"])
+
+    with timer.span("request_build"):
+        user_content = ai_handler.build_few_shot_content()
+        for i, image in enumerate(image_parts):
+            user_content.append(f"{ai_handler.language_pack.image_label} {i+1}:")
+            user_content.append(image)
+    return ai_handler, user_content, preprocessing_report
+
+
+# LLM Logic
+def generate_story_with_llm(
+    image_data_list,
+    llm_model_name,
+    language,
+    include_metrics_log: bool = False,
+    ai_handler: GenAIAgent = None,
+    bypass_cache: bool = False,
+    image_budget: ImageBudget = None,
+):
+    """
+    Function to generate a story using an LLM.
+    Returns a list of story segments, one for each image.
+
+    Args:
+        image_data_list (list): A list of image data (e.g., bytes).
+        llm_model_name (str): The name of the selected LLM.
+        language (str): The selected language (one with a language pack, e.g. "English").
+        include_metrics_log (bool, optional): Also return the performance log
+                                              of the request.
+        ai_handler (GenAIAgent, optional): Agent to use instead of a new one.
+        bypass_cache (bool, optional): Ask the model for a fresh story even if an
+                                       identical request is cached.
+        image_budget (ImageBudget, optional): Overrides the per-model resolution and
+                                              quality budget of the uploaded images.
+
+    Returns:
+        list[str]: A list of story segments, or an empty list/error indication.
+                   With include_metrics_log, a (segments, log) tuple.
+    """
+    story_segments = []
+    request_start_time = time.perf_counter()
+    timer = StageTimer()
+    ai_handler, user_content, preprocessing_report = prepare_story_request(
+        image_data_list, llm_model_name, language, ai_handler, image_budget, timer
+    )
+
+    schema = Story
+    try:
+        with timer.span("model"):
+            gen_story, log = ai_handler.generate_single_response(input_content_list=user_content, response_schema_definition=schema, include_metrics_log = True, bypass_cache = bypass_cache)
+        logger.debug("Model answer: %s", gen_story)
+        # Raises StoryParseError when the answer cannot be recovered
+        with timer.span("parsing"):
+            final_story = parse_story_response(gen_story)
+    except Exception:
+        get_metrics_registry().record_error(ai_handler.chosen_model_id, language)
+        raise
+    log["preprocessing"] = preprocessing_report
+    # The model stage also holds the queue wait and cache hits, this one only the request
+    timer.record("model_request", log.get("model_request_sec"))
+    timer.record("total", time.perf_counter() - request_start_time)
+    log["stages"] = timer.as_dict()
+    get_metrics_registry().record_request(log, language)
+    logger.debug("Generation successful: %s", log)
+    for part in final_story["story"]:
+        story_segments.append(part["story_part"])
+    if include_metrics_log:
+        return story_segments, log
+    return story_segments
+
+
+def build_regenerate_part_content(ai_handler: GenAIAgent, story_parts: list, part_index: int, image_part) -> list:
+    """
+    Builds the request rewriting one story part: the instructions, the text of the
+    part and of its neighbours, and the part's image. No one-shot example is sent.
+    """
+    pack = ai_handler.language_pack
+    labels = pack.regenerate_part_labels
+    content = [pack.regenerate_part_prompt.format(part_number=part_index + 1)]
+    if part_index > 0:
+        content.append(f"{labels['previous']} ({part_index}): {story_parts[part_index - 1]}")
+    # The current text is sent too, so the model writes something else
+    content.append(f"{labels['current']} ({part_index + 1}): {story_parts[part_index]}")
+    if part_index + 1 < len(story_parts):
+        content.append(f"{labels['next']} ({part_index + 2}): {story_parts[part_index + 1]}")
+    content.append(f"{pack.image_label} {part_index + 1}:")
+    content.append(image_part)
+    return content
+
+
+def regenerate_story_part(
+    image_data,
+    story_parts: list,
+    part_index: int,
+    llm_model_name,
+    language,
+    include_metrics_log: bool = False,
+    ai_handler: GenAIAgent = None,
+    bypass_cache: bool = True,
+    image_budget: ImageBudget = None,
+    album_image_sizes: list = None,
+):
+    """
+    Writes a new version of one part of a story, sending only that part's image and
+    the neighbouring parts' text instead of the whole album and the one-shot example.
+
+    Args:
+        image_data: The image of the part (bytes, DecodedImage or PIL image).
+        story_parts (list[str]): The current story segments, in image order.
+        part_index (int): Index of the part to rewrite in story_parts.
+        llm_model_name (str): The name of the selected LLM.
+        language (str): The selected language (one with a language pack, e.g. "English").
+        include_metrics_log (bool, optional): Also return the performance log, whose
+                                              "regeneration" entry compares the request
+                                              with regenerating the whole story.
+        ai_handler (GenAIAgent, optional): Agent to use instead of a new one.
+        bypass_cache (bool, optional): Ask the model for a new part even if the same
+                                       request is cached. On by default, a repeated
+                                       regeneration should not return the same text.
+        image_budget (ImageBudget, optional): Overrides the per-model image budget.
+        album_image_sizes (list, optional): (width, height) of every image of the story,
+                                            in order, for the whole story estimate of the
+                                            log. Without them it is left out.
+
+    Returns:
+        str: The new story segment. With include_metrics_log, a (segment, log) tuple.
+
+    Raises:
+        StoryParseError: If the answer has no part for the image of the rewritten part.
+    """
+    if not 0 <= part_index < len(story_parts):
+        raise IndexError(f"No story part {part_index + 1} in a story of {len(story_parts)} parts")
+    if album_image_sizes is not None and len(album_image_sizes) != len(story_parts):
+        raise ValueError(f"Got {len(album_image_sizes)} image sizes for a story of {len(story_parts)} parts")
+    request_start_time = time.perf_counter()
+    timer = StageTimer()
+    model_name = resolve_model_id(llm_model_name)
+    if ai_handler is None:
+        ai_handler = GenAIAgent(
+            specified_model_id=model_name,
+            select_system_prompt=language,
+            response_cache=get_default_response_cache(),
+            scheduler=get_default_scheduler(),
+        )
+    with timer.span("preprocessing"):
+        image_parts, preprocessing_report = preprocess_images([image_data], ai_handler.chosen_model_id, image_budget)
+    timer.record("image_decode", preprocessing_report["decode_time_sec"])
+    with timer.span("request_build"):
+        user_content = build_regenerate_part_content(ai_handler, story_parts, part_index, image_parts[0])
+
+    try:
+        # Its own stage, so a part's latency does not lower the story latency percentiles
+        with timer.span("part_model"):
+            gen_story, log = ai_handler.generate_single_response(
+                input_content_list=user_content,
+                response_schema_definition=Story,
+                include_metrics_log=True,
+                bypass_cache=bypass_cache,
+            )
+        with timer.span("parsing"):
+            new_parts = parse_story_response(gen_story)["story"]
+        new_part = next((part for part in new_parts if part["image"] == part_index + 1), None)
+        if new_part is None:
+            # Another image's part would replace this one with text about a different picture
+            raise StoryParseError(f"The answer has no part for image {part_index + 1}", gen_story)
+    except Exception:
+        get_metrics_registry().record_error(ai_handler.chosen_model_id, language)
+        raise
+
+    # The images are counted at the size they are sent at, not as one tile each
+    model_id = ai_handler.chosen_model_id
+    part_input_tokens = (
+        ai_handler.estimate_input_tokens([item for item in user_content if isinstance(item, str)])
+        + preprocessing_report["estimated_image_tokens"]
+    )
+    # What regenerating the whole story would have cost: the one-shot example and every image
+    # in, every part out, at the story latency this model has shown so far
+    full_input_tokens = None
+    if album_image_sizes is not None:
+        full_content = ai_handler.build_few_shot_content()
+        full_content.extend(f"{ai_handler.language_pack.image_label} {i+1}:" for i in range(len(story_parts)))
+        full_input_tokens = ai_handler.estimate_input_tokens(full_content) + sum(
+            estimate_image_tokens(model_id, *budgeted_size(size, model_id, image_budget)) for size in album_image_sizes
+        )
+    full_output_tokens = estimate_text_tokens(json.dumps({"story": [
+        {"image": i + 1, "story_part": text} for i, text in enumerate(story_parts)
+    ]}))
+    full_latency, _ = get_metrics_registry().stage_percentile("total", ai_handler.chosen_model_id, language, 50)
+    part_total_sec = time.perf_counter() - request_start_time
+    log["regeneration"] = {
+        "part": part_index + 1,
+        "parts": len(story_parts),
+        "input_tokens_estimate": part_input_tokens,
+        "full_story_input_tokens_estimate": full_input_tokens,
+        "input_tokens_saved_estimate": full_input_tokens - part_input_tokens if full_input_tokens is not None else None,
+        "full_story_output_tokens_estimate": full_output_tokens,
+        "output_tokens_saved_estimate": full_output_tokens - (log.get("output_tokens") or 0),
+        "full_story_p50_sec": round(full_latency, 2) if full_latency is not None else None,
+        "latency_saved_sec": round(full_latency - part_total_sec, 2) if full_latency is not None else None,
+    }
+    log["preprocessing"] = preprocessing_report
+    timer.record("part_total", part_total_sec)
+    # A None total keeps elapsed_time_sec out of the full story "total" percentiles
+    log["stages"] = dict(timer.as_dict(), total=None)
+    get_metrics_registry().record_request(log, language)
+    logger.debug("Regenerated part %d: %s", part_index + 1, log["regeneration"])
+    if include_metrics_log:
+        return new_part["story_part"], log
+    return new_part["story_part"]
+
+
+def stream_story_with_llm(
+    image_data_list,
+    llm_model_name,
+    language,
+    performance_log: dict = None,
+    ai_handler: GenAIAgent = None,
+    bypass_cache: bool = False,
+    image_budget: ImageBudget = None,
+):
+    """
+    Streaming variant of generate_story_with_llm: yields each story segment as soon
+    as its part of the JSON answer is complete, while the rest is still generating.
+
+    Args:
+        image_data_list (list): A list of image data (e.g., bytes).
+        llm_model_name (str): The name of the selected LLM.
+        language (str): The selected language (one with a language pack, e.g. "English").
+        performance_log (dict, optional): Filled with the metrics of the request,
+                                          including time_to_first_part_sec.
+        ai_handler (GenAIAgent, optional): Agent to use instead of a new one.
+        bypass_cache (bool, optional): Ask the model for a fresh story.
+        image_budget (ImageBudget, optional): Overrides the per-model image budget.
+
+    Yields:
+        str: The next story segment, in image order.
+    """
+    request_start_time = time.time()
+    timer = StageTimer()
+    ai_handler, user_content, preprocessing_report = prepare_story_request(
+        image_data_list, llm_model_name, language, ai_handler, image_budget, timer
+    )
+    stream_log = {}
+    parser = IncrementalStoryParser()
+    time_to_first_part = None
+    stream_start = time.perf_counter()
+    try:
+        for chunk in ai_handler.stream_single_response(
+            input_content_list=user_content,
+            response_schema_definition=Story,
+            performance_log=stream_log,
+            bypass_cache=bypass_cache,
+        ):
+            with timer.span("parsing"):
+                completed_parts = parser.feed(chunk)
+            for part in completed_parts:
+                if time_to_first_part is None:
+                    time_to_first_part = round(time.time() - request_start_time, 2)
+                render_start = time.perf_counter()
+                yield part["story_part"]
+                # The caller resumes the generator once it has rendered the part
+                timer.record("rendering", time.perf_counter() - render_start)
+
+        if parser.parts_emitted == 0:
+            # The answer could not be read part by part, fall back to parsing it whole
+            with timer.span("parsing"):
+                final_story = parse_story_response(parser.text)
+            for part in final_story["story"]:
+                if time_to_first_part is None:
+                    time_to_first_part = round(time.time() - request_start_time, 2)
+                render_start = time.perf_counter()
+                yield part["story_part"]
+                timer.record("rendering", time.perf_counter() - render_start)
+    except Exception:
+        get_metrics_registry().record_error(ai_handler.chosen_model_id, language)
+        raise
+
+    # Parsing and rendering happen while the model is still streaming, the rest is model time
+    stream_sec = time.perf_counter() - stream_start
+    timer.record("model", stream_sec - timer.stages.get("parsing", 0.0) - timer.stages.get("rendering", 0.0))
+    timer.record("time_to_first_token", stream_log.get("time_to_first_token_sec"))
+    timer.record("total", time.time() - request_start_time)
+    stream_log["time_to_first_part_sec"] = time_to_first_part
+    stream_log["preprocessing"] = preprocessing_report
+    stream_log["stages"] = timer.as_dict()
+    get_metrics_registry().record_request(stream_log, language)
+    logger.debug("Generation successful: %s", stream_log)
+    if performance_log is not None:
+        performance_log.update(stream_log)
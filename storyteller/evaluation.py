@@ -0,0 +1,745 @@
+"""
+Automatic evaluation of generated stories against the reference album texts.
+
+Streams results_*.json files (entries with "texts" and "predicted_texts") and
+scores every album across a process pool, with the definitions behind
+final_results_dataset/code_dataset_and_model_processing/summary_of_automated_results.xlsx:
+- Words are the tokens of nltk's word_tokenize, punctuation included. The story
+  length is their count.
+- BLEU is nltk's sentence BLEU-4 with smoothing method4 and METEOR nltk's
+  meteor_score (Porter stems and WordNet synonyms, for both languages), on the
+  lower-cased tokens of the predicted and the reference story.
+- BERTScore F1 is optional and needs the bert_score package.
+- English FKGL is textstat's flesch_kincaid_grade (CMUdict syllables). The
+  Spanish variant counts the word_tokenize tokens as words, punctuation as
+  words without syllables, and the syllables by Spanish hyphenation (pyphen).
+- Intra-story repetition is the fraction of the trigrams of a story part that
+  repeat an earlier one of the same part, averaged over the parts and then the
+  stories. Inter-story repetition is the fraction of all the part trigrams of a
+  results file that are repeats. Both are case sensitive.
+The reference-free metrics are computed for the predicted and the reference
+(baseline) story.
+
+On the shipped results this reproduces BLEU, the story lengths to within 0.4
+words and the repetitions to within 0.005. The code behind the summary is not
+in the repository; the remaining differences are nltk's punkt sentence
+splitter (without its data, sentences are split at terminal punctuation),
+WordNet (without it METEOR only matches exact words and stems, 0.013 lower in
+English) and FKGL (within 0.2 in English and 0.6 in Spanish, where the exact
+inputs of the shipped values are unknown).
+
+Without nltk or textstat the scores fall back to regex tokens, METEOR without
+stems, BLEU with smoothing method1 and rule-based syllable counts.
+
+Per-album scores are cached by a hash of the album content and of the optional
+toolkits available, so re-running after a new batch only scores the new or
+changed albums. The trigram hashes behind the inter-story repetition are
+cached with them (blake2b, stable across processes and runs). The summary table is written as
+summary_of_automated_results.xlsx, in the layout of the shipped one, and the
+plots in comparison_plots/.
+
+Usage (from the repository root):
+    python -m storyteller.evaluation final_results_dataset/results_and_logs/results_*.json \
+        --output-dir evaluation_output
+"""
+import argparse
+import functools
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+try:
+    import ijson
+except ImportError: # Falls back to loading each results file at once
+    ijson = None
+
+try:
+    import nltk
+    from nltk.stem import PorterStemmer
+    from nltk.tokenize import NLTKWordTokenizer
+    from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+    from nltk.translate.meteor_score import meteor_score as nltk_meteor_score
+except ImportError: # Regex tokens, and METEOR then only matches exact words
+    nltk = None
+
+try:
+    import pyphen
+    from textstat.textstat import textstatistics
+except ImportError: # FKGL then counts syllables by rules
+    textstatistics = None
+
+# Bump when a metric changes, so cached scores are recomputed
+METRICS_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.environ.get("STORY_EVAL_CACHE_DIR", os.path.join(".cache", "evaluation"))
+ALBUMS_PER_BATCH = 64
+
+# results_<model>_<language>.json
+# The language is the last underscore-separated field, model names may contain underscores
+RESULTS_FILE_PATTERN = re.compile(r"results_(?P<model>.+)_(?P<language>[^_.]+)\.json$")
+MODEL_DISPLAY_NAMES = {"gemini20": "Gemini 2.0 Flash", "gemma3": "Gemma 3"}
+LANGUAGE_NAMES = {"eng": "English", "spa": "Spanish"}
+# nltk's names of the languages, for its sentence splitter
+NLTK_LANGUAGES = {"English": "english", "Spanish": "spanish"}
+
+# METEOR parameters of Banerjee & Lavie, as in nltk
+METEOR_ALPHA = 0.9
+METEOR_BETA = 3.0
+METEOR_GAMMA = 0.5
+# nltk's SmoothingFunction().method1 epsilon for n-gram orders without matches
+BLEU_EPSILON = 0.1
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORD_PATTERN = re.compile(r"[^\W\d_]+", re.UNICODE)
+_SENTENCE_END_PATTERN = re.compile(r"[.!?…]+")
+# Splits after terminal punctuation, the sentences when punkt's data is missing
+_SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+_ENGLISH_VOWEL_GROUPS = re.compile(r"[aeiouy]+")
+_SPANISH_VOWEL_GROUPS = re.compile(r"[aeiouáéíóúü]+")
+# Vowels that form a syllable of their own next to another one (hiatus)
+_SPANISH_STRONG_VOWELS = set("aeoáéíóú")
+
+
+def _has_nltk_data(resource: str) -> bool:
+    if nltk is None:
+        return False
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def scoring_backends() -> tuple:
+    """
+    Which of the optional toolkits the scores are computed with. The scores
+    differ without them, so they are part of the cache key.
+    """
+    return (
+        ("nltk", nltk is not None),
+        ("punkt", _has_nltk_data("tokenizers/punkt_tab")),
+        ("wordnet", _has_nltk_data("corpora/wordnet")),
+        ("textstat", textstatistics is not None),
+    )
+
+
+def _backend_available(name: str) -> bool:
+    return dict(scoring_backends())[name]
+
+
+@functools.lru_cache(maxsize=None)
+def _word_tokenizer():
+    # The tokenizer of nltk.word_tokenize, applied to each sentence
+    return NLTKWordTokenizer()
+
+
+def split_sentences(text: str, language: str) -> list:
+    if _backend_available("punkt"):
+        return nltk.sent_tokenize(text, language=NLTK_LANGUAGES.get(language, "english"))
+    return [sentence for sentence in _SENTENCE_SPLIT_PATTERN.split(text) if sentence.strip()]
+
+
+def word_tokenize(text: str, language: str) -> list:
+    """
+    Tokens of nltk's word_tokenize, punctuation included, in their original case.
+    """
+    if nltk is None:
+        return _TOKEN_PATTERN.findall(text)
+    tokenizer = _word_tokenizer()
+    return [token for sentence in split_sentences(text, language) for token in tokenizer.tokenize(sentence)]
+
+
+def _ngrams(tokens: list, n: int) -> Counter:
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def bleu4(hypothesis: list, reference: list) -> float:
+    """
+    Sentence BLEU-4 with uniform weights and a brevity penalty: nltk's with
+    smoothing method4, or method1 without nltk.
+    """
+    if not hypothesis or not reference:
+        return 0.0
+    if nltk is not None:
+        return sentence_bleu([reference], hypothesis, smoothing_function=SmoothingFunction().method4)
+    log_precision = 0.0
+    for n in range(1, 5):
+        hypothesis_ngrams = _ngrams(hypothesis, n)
+        total = sum(hypothesis_ngrams.values())
+        if total == 0:
+            return 0.0
+        reference_ngrams = _ngrams(reference, n)
+        matches = sum(min(count, reference_ngrams[ngram]) for ngram, count in hypothesis_ngrams.items())
+        log_precision += math.log((matches or BLEU_EPSILON) / total) / 4
+    brevity_penalty = 1.0 if len(hypothesis) > len(reference) else math.exp(1 - len(reference) / len(hypothesis))
+    return brevity_penalty * math.exp(log_precision)
+
+
+class _MemoizedStemmer:
+    # nltk's stemmers are slow and a results file only has a few thousand distinct words
+    def __init__(self, stemmer):
+        self._stemmer = stemmer
+        self._stems = {}
+
+    def stem(self, word: str) -> str:
+        stem = self._stems.get(word)
+        if stem is None:
+            stem = self._stems[word] = self._stemmer.stem(word)
+        return stem
+
+
+@functools.lru_cache(maxsize=None)
+def _stemmer():
+    # nltk's METEOR stems every language with the Porter stemmer
+    if nltk is None:
+        return None
+    return _MemoizedStemmer(PorterStemmer())
+
+
+def meteor(hypothesis: list, reference: list, stemmer=None) -> float:
+    """
+    nltk's METEOR. Without the WordNet corpus, the same alignment with exact and
+    stem matches only.
+    """
+    if not hypothesis or not reference:
+        return 0.0
+    if _backend_available("wordnet"):
+        return nltk_meteor_score([reference], hypothesis)
+    # Words are aligned greedily left to right, exact matches before stem matches
+    alignment = {}
+    unmatched_reference = defaultdict(list)
+    for position, word in enumerate(reference):
+        unmatched_reference[word].append(position)
+    for matcher in ("exact", "stem"):
+        if matcher == "stem":
+            if stemmer is None:
+                break
+            remaining = defaultdict(list)
+            for positions in unmatched_reference.values():
+                for position in positions:
+                    remaining[stemmer.stem(reference[position])].append(position)
+            for positions in remaining.values():
+                positions.sort()
+            unmatched_reference = remaining
+        for position, word in enumerate(hypothesis):
+            if position in alignment:
+                continue
+            key = word if matcher == "exact" else stemmer.stem(word)
+            candidates = unmatched_reference.get(key)
+            if candidates:
+                alignment[position] = candidates.pop(0)
+
+    matches = len(alignment)
+    if matches == 0:
+        return 0.0
+    precision = matches / len(hypothesis)
+    recall = matches / len(reference)
+    f_mean = precision * recall / (METEOR_ALPHA * precision + (1 - METEOR_ALPHA) * recall)
+    # A chunk is a run of matches adjacent in both the hypothesis and the reference
+    aligned = sorted(alignment.items())
+    chunks = 1 + sum(
+        1 for (h1, r1), (h2, r2) in zip(aligned, aligned[1:]) if h2 != h1 + 1 or r2 != r1 + 1
+    )
+    penalty = METEOR_GAMMA * (chunks / matches) ** METEOR_BETA
+    return f_mean * (1 - penalty)
+
+
+def count_syllables(word: str, language: str) -> int:
+    word = word.lower()
+    if language == "Spanish":
+        syllables = 0
+        for group in _SPANISH_VOWEL_GROUPS.findall(word):
+            # Diphthongs count once, adjacent strong vowels are separate syllables
+            syllables += 1 + sum(
+                1 for a, b in zip(group, group[1:]) if a in _SPANISH_STRONG_VOWELS and b in _SPANISH_STRONG_VOWELS
+            )
+        return max(1, syllables)
+    syllables = len(_ENGLISH_VOWEL_GROUPS.findall(word))
+    # Silent final e (but not the "-le" of "little")
+    if word.endswith("e") and not word.endswith("le") and syllables > 1:
+        syllables -= 1
+    return max(1, syllables)
+
+
+@functools.lru_cache(maxsize=None)
+def _english_readability():
+    readability = textstatistics()
+    readability.set_lang("en")
+    return readability
+
+
+@functools.lru_cache(maxsize=None)
+def _spanish_hyphenator():
+    return pyphen.Pyphen(lang="es")
+
+
+def _fkgl(words: int, sentences: int, syllables: int) -> float:
+    return 0.39 * words / max(1, sentences) + 11.8 * syllables / words - 15.59
+
+
+def fkgl(text: str, language: str) -> float:
+    """
+    Flesch-Kincaid grade level, textstat's in English and the word_tokenize
+    based variant in Spanish (see the module docstring).
+    """
+    if textstatistics is None:
+        words = _WORD_PATTERN.findall(text)
+        if not words:
+            return 0.0
+        sentences = len([s for s in _SENTENCE_END_PATTERN.split(text) if _WORD_PATTERN.search(s)])
+        return _fkgl(len(words), sentences, sum(count_syllables(word, language) for word in words))
+    if language != "Spanish":
+        return _english_readability().flesch_kincaid_grade(text)
+    tokens = word_tokenize(text, language)
+    if not tokens:
+        return 0.0
+    hyphenator = _spanish_hyphenator()
+    syllables = sum(len(hyphenator.positions(token)) + 1 for token in tokens if _WORD_PATTERN.search(token))
+    return _fkgl(len(tokens), len(split_sentences(text, language)), syllables)
+
+
+def _trigrams(tokens: list) -> list:
+    return [tuple(tokens[i:i + 3]) for i in range(len(tokens) - 2)]
+
+
+def intra_repetition(part_tokens: list) -> float:
+    """
+    Fraction of the trigrams of a story part that already appeared earlier in
+    it, averaged over the parts of the story.
+    """
+    rates = []
+    for tokens in part_tokens:
+        trigrams = _trigrams(tokens)
+        if trigrams:
+            rates.append(1 - len(set(trigrams)) / len(trigrams))
+    return sum(rates) / len(rates) if rates else 0.0
+
+
+def album_key(album: dict, language: str) -> str:
+    """
+    Content hash of an album's texts and of the scoring toolkits, the key of its cached scores.
+    """
+    payload = json.dumps(
+        [METRICS_VERSION, scoring_backends(), language, album.get("texts"), album.get("predicted_texts")],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _story_parts(parts) -> list:
+    return [part for part in parts or [] if isinstance(part, str)]
+
+
+def _story_text(parts) -> str:
+    return "\n".join(_story_parts(parts))
+
+
+def _part_tokens(parts, language: str) -> list:
+    return [word_tokenize(part, language) for part in _story_parts(parts)]
+
+
+def score_album(album: dict, language: str, stemmer=None) -> dict:
+    """
+    Scores one album: the predicted story against the reference, and the
+    reference-free metrics of both stories.
+    """
+    prediction_parts = _part_tokens(album.get("predicted_texts"), language)
+    reference_parts = _part_tokens(album.get("texts"), language)
+    prediction_tokens = [token.lower() for tokens in prediction_parts for token in tokens]
+    reference_tokens = [token.lower() for tokens in reference_parts for token in tokens]
+    return {
+        "bleu": bleu4(prediction_tokens, reference_tokens),
+        "meteor": meteor(prediction_tokens, reference_tokens, stemmer),
+        "length": len(prediction_tokens),
+        "baseline_length": len(reference_tokens),
+        "fkgl": fkgl(_story_text(album.get("predicted_texts")), language),
+        "baseline_fkgl": fkgl(_story_text(album.get("texts")), language),
+        "intra_rep": intra_repetition(prediction_parts),
+        "baseline_intra_rep": intra_repetition(reference_parts),
+        # Inter-story repetition needs the whole file, the trigrams are kept for it
+        "trigram_hashes": _trigram_hashes(prediction_parts).tobytes().hex(),
+        "baseline_trigram_hashes": _trigram_hashes(reference_parts).tobytes().hex(),
+    }
+
+
+def score_batch(batch: list, language: str) -> list:
+    """
+    Scores a batch of (key, album) pairs in a worker process.
+    """
+    stemmer = _stemmer()
+    return [(key, score_album(album, language, stemmer)) for key, album in batch]
+
+
+class ScoreCache:
+    """
+    Append-only JSONL store of per-album scores keyed by content hash.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "album_scores.jsonl")
+        self._scores = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue # Partial last line of an interrupted run
+                    self._scores[entry["key"]] = entry["scores"]
+
+    def get(self, key: str):
+        return self._scores.get(key)
+
+    def put_many(self, items: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for key, scores in items:
+                self._scores[key] = scores
+                f.write(json.dumps({"key": key, "scores": scores}) + "\n")
+
+
+def iter_albums(results_path: str):
+    """
+    Yields the album entries of a results file without loading it whole (with ijson).
+    """
+    with open(results_path, "rb") as f:
+        if ijson is None:
+            yield from json.load(f)
+        else:
+            yield from ijson.items(f, "item")
+
+
+def _trigram_hash(trigram: list) -> bytes:
+    # Unlike hash() of strings, blake2b is not salted per process, so the hashes can be cached
+    return hashlib.blake2b("\x00".join(trigram).encode("utf-8"), digest_size=8).digest()
+
+
+def _trigram_hashes(part_tokens: list) -> np.ndarray:
+    # Trigrams do not span two parts of a story
+    digests = b"".join(
+        _trigram_hash(tokens[i:i + 3]) for tokens in part_tokens for i in range(len(tokens) - 2)
+    )
+    return np.frombuffer(digests, dtype=np.int64)
+
+
+def _cached_trigram_hashes(hex_digests: str) -> np.ndarray:
+    return np.frombuffer(bytes.fromhex(hex_digests), dtype=np.int64)
+
+
+def inter_repetition(trigram_arrays: list) -> float:
+    """
+    Fraction of all the part trigrams of a set of stories that are repeats, within or across stories.
+    """
+    if not trigram_arrays:
+        return 0.0
+    trigrams = np.concatenate(trigram_arrays)
+    if trigrams.size == 0:
+        return 0.0
+    return 1 - np.unique(trigrams).size / trigrams.size
+
+
+def _bertscore_f1(predictions: list, references: list, language: str) -> list:
+    try:
+        from bert_score import score as bert_score
+    except ImportError as e:
+        raise ImportError("BERTScore needs the bert_score package (pip install bert-score)") from e
+    _, _, f1 = bert_score(predictions, references, lang="es" if language == "Spanish" else "en", verbose=False)
+    return f1.tolist()
+
+
+def evaluate_results_file(
+    results_path: str,
+    language: str,
+    cache: ScoreCache,
+    executor: ProcessPoolExecutor = None,
+    with_bertscore: bool = False,
+    max_batches_in_flight: int = 8,
+) -> tuple:
+    """
+    Scores every album of a results file, reusing the cached scores.
+
+    Args:
+        results_path (str): A results_*.json file.
+        language (str): "English" or "Spanish".
+        cache (ScoreCache): Per-album score cache.
+        executor (ProcessPoolExecutor, optional): Pool the batches are scored in;
+                                                  scored in process without one.
+        with_bertscore (bool, optional): Also compute BERTScore F1.
+        max_batches_in_flight (int, optional): Batches submitted to the pool at once.
+
+    Returns:
+        tuple: (list of per-album score dicts in file order, corpus metrics dict)
+    """
+    album_ids = []
+    keys = []
+    pending = set()
+    batch = []
+    # Only BERTScore-less albums need their texts kept, and only when it is requested
+    bertscore_inputs = {}
+
+    def flush():
+        if not batch:
+            return
+        if executor is None:
+            cache.put_many(score_batch(batch, language))
+        else:
+            pending.add(executor.submit(score_batch, list(batch), language))
+            # Bound the batches in flight so memory stays flat on large files
+            while len(pending) > max_batches_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    cache.put_many(future.result())
+        batch.clear()
+
+    for album in iter_albums(results_path):
+        key = album_key(album, language)
+        album_ids.append(album.get("album_id"))
+        keys.append(key)
+        cached = cache.get(key)
+        if cached is None:
+            batch.append((key, album))
+            if len(batch) >= ALBUMS_PER_BATCH:
+                flush()
+        if with_bertscore and (cached is None or "bertscore_f1" not in cached):
+            bertscore_inputs[key] = (_story_text(album.get("predicted_texts")), _story_text(album.get("texts")))
+    flush()
+    for future in pending:
+        cache.put_many(future.result())
+
+    if bertscore_inputs:
+        bertscore_keys = list(bertscore_inputs)
+        f1_scores = _bertscore_f1(
+            [bertscore_inputs[key][0] for key in bertscore_keys],
+            [bertscore_inputs[key][1] for key in bertscore_keys],
+            language,
+        )
+        cache.put_many([(key, dict(cache.get(key), bertscore_f1=f1)) for key, f1 in zip(bertscore_keys, f1_scores)])
+
+    album_scores = []
+    prediction_trigrams = []
+    reference_trigrams = []
+    for key, album_id in zip(keys, album_ids):
+        scores = dict(cache.get(key), album_id=album_id)
+        prediction_trigrams.append(_cached_trigram_hashes(scores.pop("trigram_hashes")))
+        reference_trigrams.append(_cached_trigram_hashes(scores.pop("baseline_trigram_hashes")))
+        album_scores.append(scores)
+    corpus_metrics = {
+        "inter_rep": inter_repetition(prediction_trigrams),
+        "baseline_inter_rep": inter_repetition(reference_trigrams),
+    }
+    return album_scores, corpus_metrics
+
+
+def parse_results_filename(results_path: str) -> tuple:
+    """
+    Returns the (model display name, language) of a results_<model>_<language>.json file.
+    """
+    match = RESULTS_FILE_PATTERN.search(os.path.basename(results_path))
+    if match is None:
+        raise ValueError(f"Expected a results_<model>_<language>.json file, got {results_path}")
+    model = MODEL_DISPLAY_NAMES.get(match["model"], match["model"])
+    language = LANGUAGE_NAMES.get(match["language"], match["language"])
+    return model, language
+
+
+def summarize(album_scores: list, corpus_metrics: dict) -> dict:
+    """
+    Averages the per-album scores of a results file.
+    """
+    summary = {}
+    names = sorted({name for scores in album_scores for name in scores if name != "album_id"})
+    for name in names:
+        values = np.array([scores[name] for scores in album_scores if scores.get(name) is not None], dtype=float)
+        summary[name] = float(values.mean()) if values.size else None
+    summary.update(corpus_metrics)
+    summary["albums"] = len(album_scores)
+    return summary
+
+
+REFERENCE_COLUMNS = ("Model", "METEOR", "BLEU", "BERTScore (F1)")
+STORY_COLUMNS = ("Model", "Avg Story Length (word count)", "FKGL", "Inter-Rep", "Intra-Rep")
+# Empty columns between the reference metrics and the story metrics
+TABLE_GAP_COLUMNS = 2
+
+
+def _reference_rows(summaries: dict, language: str) -> list:
+    rows = []
+    for (model, row_language), summary in sorted(summaries.items()):
+        if row_language != language:
+            continue
+        bertscore = summary.get("bertscore_f1")
+        rows.append([
+            model,
+            round(summary["meteor"], 3),
+            round(summary["bleu"], 3),
+            round(bertscore, 4) if bertscore is not None else None,
+        ])
+    return rows
+
+
+def _story_rows(summaries: dict, language: str) -> list:
+    rows = []
+    for (model, row_language), summary in sorted(summaries.items()):
+        if row_language != language:
+            continue
+        for prefix, row_model in (("baseline_", f"Baseline (used for {model})"), ("", model)):
+            rows.append([
+                row_model,
+                round(summary[f"{prefix}length"], 1),
+                round(summary[f"{prefix}fkgl"], 2),
+                round(summary[f"{prefix}inter_rep"], 3),
+                round(summary[f"{prefix}intra_rep"], 3),
+            ])
+    return rows
+
+
+def write_summary_table(summaries: dict, path: str) -> None:
+    """
+    Writes the summary table in the layout of summary_of_automated_results.xlsx:
+    a single sheet with the reference metrics, then the story metrics, each as
+    one block per language side by side under a merged language header.
+    """
+    from openpyxl import Workbook
+
+    languages = sorted({language for _, language in summaries})
+    workbook = Workbook()
+    sheet = workbook.active
+    column = 1
+    for columns, rows_of in ((REFERENCE_COLUMNS, _reference_rows), (STORY_COLUMNS, _story_rows)):
+        for language in languages:
+            sheet.cell(row=1, column=column, value=language)
+            sheet.merge_cells(start_row=1, start_column=column, end_row=1, end_column=column + len(columns) - 1)
+            for offset, header in enumerate(columns):
+                sheet.cell(row=2, column=column + offset, value=header)
+            for row_index, row in enumerate(rows_of(summaries, language), start=3):
+                for offset, value in enumerate(row):
+                    sheet.cell(row=row_index, column=column + offset, value=value)
+            column += len(columns)
+        column += TABLE_GAP_COLUMNS
+    workbook.save(path)
+
+
+def write_album_scores(per_file_scores: dict, path: str) -> None:
+    import pandas as pd
+
+    frames = []
+    for (model, language), album_scores in per_file_scores.items():
+        frame = pd.DataFrame(album_scores)
+        frame.insert(0, "language", language)
+        frame.insert(0, "model", model)
+        frames.append(frame)
+    pd.concat(frames, ignore_index=True).to_csv(path, index=False)
+
+
+def write_plots(summaries: dict, plots_dir: str) -> list:
+    """
+    Draws the comparison bar charts and returns the written paths.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(plots_dir, exist_ok=True)
+    models = sorted({model for model, _ in summaries})
+    languages = sorted({language for _, language in summaries})
+    written = []
+
+    def bar_chart(filename, title, groups, series):
+        # series: {label: [value per group]}
+        figure, axes = plt.subplots(figsize=(8, 5))
+        width = 0.8 / max(1, len(series))
+        positions = np.arange(len(groups))
+        for i, (label, values) in enumerate(series.items()):
+            values = [value if value is not None else 0 for value in values]
+            bars = axes.bar(positions + i * width - 0.4 + width / 2, values, width, label=label)
+            axes.bar_label(bars, fmt="%.3g", fontsize=8)
+        axes.set_xticks(positions)
+        axes.set_xticklabels(groups)
+        axes.set_title(title)
+        axes.legend()
+        figure.tight_layout()
+        path = os.path.join(plots_dir, filename)
+        figure.savefig(path, dpi=120)
+        plt.close(figure)
+        written.append(path)
+
+    def value(model, language, name):
+        return (summaries.get((model, language)) or {}).get(name)
+
+    for name, filename, title in (
+        ("bleu", "bleu_scores.png", "BLEU"),
+        ("meteor", "meteor_scores.png", "METEOR"),
+        ("bertscore_f1", "bertscore_f1_comparison.png", "BERTScore (F1)"),
+    ):
+        if all(value(model, language, name) is None for model in models for language in languages):
+            continue
+        bar_chart(filename, title, languages, {model: [value(model, language, name) for language in languages] for model in models})
+
+    groups = [f"{model}\n{language}" for language in languages for model in models]
+    bar_chart("story_lengths.png", "Average story length (words)", groups, {
+        "Generated": [value(model, language, "length") for language in languages for model in models],
+        "Baseline": [value(model, language, "baseline_length") for language in languages for model in models],
+    })
+    for language in languages:
+        bar_chart(f"fkgl_scores_{language.lower()}.png", f"FKGL ({language})", models, {
+            "Generated": [value(model, language, "fkgl") for model in models],
+            "Baseline": [value(model, language, "baseline_fkgl") for model in models],
+        })
+        bar_chart(f"repetition_scores_{language.lower()}.png", f"Repetition ({language})", models, {
+            "Inter-Rep": [value(model, language, "inter_rep") for model in models],
+            "Intra-Rep": [value(model, language, "intra_rep") for model in models],
+            "Baseline Inter-Rep": [value(model, language, "baseline_inter_rep") for model in models],
+            "Baseline Intra-Rep": [value(model, language, "baseline_intra_rep") for model in models],
+        })
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score results files and write the summary table and plots.")
+    parser.add_argument("results", nargs="+", help="results_<model>_<language>.json files")
+    parser.add_argument("--output-dir", default="evaluation_output", help="Directory of the table, scores and plots")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the per-album score cache")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Scoring processes (1 scores in process)")
+    parser.add_argument("--bertscore", action="store_true", help="Also compute BERTScore F1 (needs bert_score)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = ScoreCache(args.cache_dir)
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    summaries = {}
+    per_file_scores = {}
+    try:
+        for results_path in args.results:
+            model, language = parse_results_filename(results_path)
+            album_scores, corpus_metrics = evaluate_results_file(
+                results_path, language, cache, executor,
+                with_bertscore=args.bertscore, max_batches_in_flight=2 * args.workers,
+            )
+            per_file_scores[(model, language)] = album_scores
+            summaries[(model, language)] = summarize(album_scores, corpus_metrics)
+            summary = summaries[(model, language)]
+            print(
+                f"{model} / {language}: {summary['albums']} albums, BLEU {summary['bleu']:.3f}, "
+                f"METEOR {summary['meteor']:.3f}, FKGL {summary['fkgl']:.2f}, "
+                f"Inter-Rep {summary['inter_rep']:.3f}, Intra-Rep {summary['intra_rep']:.3f}"
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    write_summary_table(summaries, os.path.join(args.output_dir, "summary_of_automated_results.xlsx"))
+    write_album_scores(per_file_scores, os.path.join(args.output_dir, "album_scores.csv"))
+    write_plots(summaries, os.path.join(args.output_dir, "comparison_plots"))
+    print(f"Wrote the summary table, album scores and plots to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Local stand-ins for the Google GenAI client, so the generation pipeline can be
+exercised offline without spending API quota.
+"""
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from google.genai import errors, types
+
+from storyteller.metrics import estimate_text_tokens
+
+# Input tokens billed for one image of the prompt prefix (Gemini 2.0, up to 384 px)
+FAKE_IMAGE_TOKENS = 258
+
+# Matches the "<image label> N:" labels put before each user image ("Image 1:", "Imagen 1:")
+IMAGE_LABEL_PATTERN = re.compile(r"^\s*[^\W\d_]+ (\d+):\s*$")
+
+
+def labelled_image_numbers(contents) -> list:
+    """
+    Returns the numbers of the user images in a request, read from the image labels
+    after the last prompt text (so the one-shot example images are not counted).
+    """
+    numbers = []
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            match = IMAGE_LABEL_PATTERN.match(item)
+            if match:
+                numbers.append(int(match[1]))
+            else:
+                numbers = []
+    return numbers
+
+
+def build_fake_story_text(num_parts: int, fenced: bool = False, first_image: int = 1) -> str:
+    """
+    Builds a response text following the Story schema with num_parts parts, for
+    the images numbered from first_image (a regenerated part has a single image).
+    """
+    story = {
+        "story": [
+            {"image": i, "story_part": f"This is the fake story part number {i}."}
+            for i in range(first_image, first_image + num_parts)
+        ]
+    }
+    text = json.dumps(story, ensure_ascii=False, indent=2)
+    if fenced:
+        # Gemma 3 wraps its answers in markdown code fences
+        return f"```json\n{text}\n```"
+    return text
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, *, model, contents, config=None):
+        return self._client._respond(model, contents, config)
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        return self._client._respond_stream(model, contents, config)
+
+
+class _FakeAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, *, model, contents, config=None):
+        return await self._client._arespond(model, contents, config)
+
+
+class _FakeCaches:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, *, model, config=None):
+        return self._client._create_cache(model, config)
+
+    def update(self, *, name, config=None):
+        return self._client._update_cache(name, config)
+
+    def get(self, *, name):
+        return self._client._get_cache(name)
+
+    def delete(self, *, name):
+        self._client._cached_contents.pop(name, None)
+
+
+class _FakeFiles:
+    def __init__(self, client):
+        self._client = client
+
+    def upload(self, *, file, config=None):
+        return self._client._upload_file(file, config)
+
+    def download(self, *, file, destination=None, config=None):
+        return self._client._download_file(file, destination)
+
+
+class _FakeBatches:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, *, model, src, config=None):
+        return self._client._create_batch(model, src, config)
+
+    def get(self, *, name):
+        return self._client._get_batch(name)
+
+    def cancel(self, *, name):
+        self._client._batch_jobs[name]["state"] = types.JobState.JOB_STATE_CANCELLED
+
+
+class _FakeAio:
+    def __init__(self, client):
+        self.models = _FakeAsyncModels(client)
+
+
+class FakeGenAIClient:
+    """
+    Minimal stand-in for genai.Client implementing models.generate_content,
+    models.generate_content_stream, aio.models.generate_content, the
+    caches create/update/get/delete calls of context caching and the
+    files upload/download and batches create/get/cancel calls of batch jobs.
+
+    Responses follow the Story schema with one part per labelled image, after
+    a configurable latency. A fraction of the requests can fail with the same
+    errors the real SDK raises (429 / 5xx). Requests using a cached content
+    report its tokens as cached_content_token_count, unknown or expired handles
+    fail with 404 and Gemma models cannot be cached, like the real API. With
+    input_tokens_per_request=None the input tokens are estimated from the request.
+    A batch job runs once it has been polled batch_polls_until_done times, then
+    answers every line of its request file (or an error line, at error_rate).
+    """
+
+    def __init__(
+        self,
+        latency_sec: float = 0.0,
+        error_rate: float = 0.0,
+        error_code: int = 429,
+        input_tokens_per_request: int = 1800,
+        stream_chunks: int = 8,
+        seed: int = None,
+        context_cache_min_tokens: int = 0,
+        batch_polls_until_done: int = 2,
+    ):
+        self.latency_sec = latency_sec
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.input_tokens_per_request = input_tokens_per_request
+        self.stream_chunks = stream_chunks
+        self.context_cache_min_tokens = context_cache_min_tokens
+        self.batch_polls_until_done = batch_polls_until_done
+        self.request_count = 0
+        self._cached_contents = {} # name -> {"model", "tokens", "expire_time"}
+        self._cache_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+        self.caches = _FakeCaches(self)
+        self.files = _FakeFiles(self)
+        self.batches = _FakeBatches(self)
+        self._files_dir = None # Created on the first upload
+        self._files = {} # name -> local path
+        self._batch_jobs = {} # name -> {"model", "src", "state", "polls", "dest"}
+        self._file_ids = itertools.count(1)
+        self._batch_ids = itertools.count(1)
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.request_count += 1
+            failed = self._random.random() < self.error_rate
+        if failed:
+            error_class = errors.ClientError if self.error_code < 500 else errors.ServerError
+            raise error_class(
+                self.error_code,
+                {"error": {"code": self.error_code, "message": "Injected fake error", "status": "UNAVAILABLE"}},
+            )
+
+    @staticmethod
+    def _client_error(code: int, status: str, message: str) -> errors.ClientError:
+        return errors.ClientError(code, {"error": {"code": code, "message": message, "status": status}})
+
+    def _cached_content(self, name: str, now: float) -> types.CachedContent:
+        entry = self._cached_contents[name]
+        return types.CachedContent(
+            name=name,
+            model=entry["model"],
+            expire_time=datetime.datetime.fromtimestamp(entry["expire_time"], datetime.timezone.utc),
+            update_time=datetime.datetime.fromtimestamp(now, datetime.timezone.utc),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=entry["tokens"]),
+        )
+
+    def _create_cache(self, model, config) -> types.CachedContent:
+        if model.startswith("gemma"):
+            raise self._client_error(400, "INVALID_ARGUMENT", f"Model {model} does not support cached content")
+        tokens = estimate_text_tokens(str(config.system_instruction or ""))
+        for item in config.contents or []:
+            if isinstance(item, str):
+                tokens += estimate_text_tokens(item)
+            else:
+                tokens += FAKE_IMAGE_TOKENS
+        if tokens < self.context_cache_min_tokens:
+            raise self._client_error(
+                400, "INVALID_ARGUMENT",
+                f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.context_cache_min_tokens}",
+            )
+        now = time.time()
+        with self._lock:
+            name = f"cachedContents/fake-{next(self._cache_ids)}"
+            self._cached_contents[name] = {
+                "model": model, "tokens": tokens, "expire_time": now + float(config.ttl.rstrip("s")),
+            }
+        return self._cached_content(name, now)
+
+    def _update_cache(self, name, config) -> types.CachedContent:
+        now = time.time()
+        entry = self._cached_contents.get(name)
+        if entry is None or entry["expire_time"] <= now:
+            raise self._client_error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+        entry["expire_time"] = now + float(config.ttl.rstrip("s"))
+        return self._cached_content(name, now)
+
+    def _get_cache(self, name) -> types.CachedContent:
+        if name not in self._cached_contents:
+            raise self._client_error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+        return self._cached_content(name, time.time())
+
+    def _cached_tokens(self, config) -> int:
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return None
+        entry = self._cached_contents.get(name)
+        if entry is None or entry["expire_time"] <= time.time():
+            raise self._client_error(404, "NOT_FOUND", f"CachedContent not found: {name}")
+        return entry["tokens"]
+
+    def _prompt_tokens(self, contents, config, cached_tokens) -> int:
+        if self.input_tokens_per_request is not None and cached_tokens is None:
+            return self.input_tokens_per_request
+        # The cached prefix counts towards the prompt, on top of what the request sends
+        sent_tokens = estimate_text_tokens(str(getattr(config, "system_instruction", None) or ""))
+        sent_tokens += sum(
+            estimate_text_tokens(item) if isinstance(item, str) else FAKE_IMAGE_TOKENS
+            for item in (contents if isinstance(contents, list) else [contents])
+        )
+        return max(self.input_tokens_per_request or 0, (cached_tokens or 0) + sent_tokens)
+
+    def _build_response(self, model, contents, config=None) -> types.GenerateContentResponse:
+        cached_tokens = self._cached_tokens(config)
+        # Gemma answers with fenced JSON and no output token count, like the real API logs
+        is_gemma = model.startswith("gemma")
+        numbers = labelled_image_numbers(contents)
+        text = build_fake_story_text(len(numbers), fenced=is_gemma, first_image=numbers[0] if numbers else 1)
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=[types.Part(text=text)]),
+                    finish_reason=types.FinishReason.STOP,
+                )
+            ],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=self._prompt_tokens(contents, config, cached_tokens),
+                cached_content_token_count=cached_tokens,
+                candidates_token_count=None if is_gemma else len(text) // 4,
+            ),
+            model_version=model,
+        )
+
+    def _upload_file(self, file, config) -> types.File:
+        with self._lock:
+            if self._files_dir is None:
+                self._files_dir = tempfile.mkdtemp(prefix="fake_genai_files_")
+            name = f"files/fake-{next(self._file_ids)}"
+        path = os.path.join(self._files_dir, name.replace("/", "_"))
+        shutil.copyfile(file, path)
+        self._files[name] = path
+        return types.File(
+            name=name, display_name=getattr(config, "display_name", None), size_bytes=os.path.getsize(path)
+        )
+
+    def _download_file(self, file, destination):
+        path = self._files.get(file)
+        if path is None:
+            raise self._client_error(404, "NOT_FOUND", f"File not found: {file}")
+        if destination is None:
+            with open(path, "rb") as f:
+                return f.read()
+        shutil.copyfile(path, destination)
+        return None
+
+    def _create_batch(self, model, src, config) -> types.BatchJob:
+        if src not in self._files:
+            raise self._client_error(400, "INVALID_ARGUMENT", f"Unknown input file {src}")
+        with self._lock:
+            name = f"batches/fake-{next(self._batch_ids)}"
+            self._batch_jobs[name] = {
+                "model": model, "src": src, "state": types.JobState.JOB_STATE_PENDING, "polls": 0, "dest": None,
+            }
+        return self._get_batch(name, poll=False)
+
+    def _run_batch(self, job: dict) -> str:
+        # Answers the request file line by line, like the real job the output keeps the keys
+        with self._lock:
+            name = f"files/fake-{next(self._file_ids)}"
+        output_path = os.path.join(self._files_dir, name.replace("/", "_"))
+        with open(self._files[job["src"]], "r", encoding="utf-8") as requests_file, \
+                open(output_path, "w", encoding="utf-8") as output_file:
+            for line in requests_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                with self._lock:
+                    self.request_count += 1
+                    failed = self._random.random() < self.error_rate
+                if failed:
+                    result = {"key": entry.get("key"), "error": {"code": self.error_code, "message": "Injected fake error"}}
+                else:
+                    # Text parts as strings and the other parts as placeholders, to count the labelled images
+                    contents = [
+                        part.get("text") if "text" in part else part
+                        for content in entry["request"]["contents"] for part in content["parts"]
+                    ]
+                    response = self._build_response(job["model"], contents)
+                    result = {
+                        "key": entry.get("key"),
+                        "response": response.model_dump(mode="json", by_alias=True, exclude_none=True),
+                    }
+                output_file.write(json.dumps(result) + "\n")
+        self._files[name] = output_path
+        return name
+
+    def _get_batch(self, name, poll: bool = True) -> types.BatchJob:
+        job = self._batch_jobs.get(name)
+        if job is None:
+            raise self._client_error(404, "NOT_FOUND", f"Batch not found: {name}")
+        if poll and job["state"] in (types.JobState.JOB_STATE_PENDING, types.JobState.JOB_STATE_RUNNING):
+            job["polls"] += 1
+            if job["polls"] >= self.batch_polls_until_done:
+                job["dest"] = self._run_batch(job)
+                job["state"] = types.JobState.JOB_STATE_SUCCEEDED
+            else:
+                job["state"] = types.JobState.JOB_STATE_RUNNING
+        return types.BatchJob(
+            name=name,
+            model=job["model"],
+            state=job["state"],
+            dest=types.BatchJobDestination(file_name=job["dest"]) if job["dest"] else None,
+        )
+
+    def _respond(self, model, contents, config):
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        self._maybe_fail()
+        return self._build_response(model, contents, config)
+
+    async def _arespond(self, model, contents, config):
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+        self._maybe_fail()
+        return self._build_response(model, contents, config)
+
+    def _respond_stream(self, model, contents, config):
+        response = self._build_response(model, contents, config)
+        text = response.text
+        chunk_size = max(1, len(text) // self.stream_chunks + 1)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        # Like the real API, the first token takes longest and the rest is spread evenly
+        if self.latency_sec:
+            time.sleep(self.latency_sec * 0.3)
+        self._maybe_fail()
+        for i, chunk_text in enumerate(chunks):
+            if i and self.latency_sec:
+                time.sleep(self.latency_sec * 0.7 / len(chunks))
+            is_last = i == len(chunks) - 1
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=chunk_text)]))],
+                usage_metadata=response.usage_metadata if is_last else None,
+                model_version=model,
+            )
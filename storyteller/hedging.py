@@ -0,0 +1,300 @@
+"""
+Hedged story requests between Gemma 3 and Gemini 2.0 Flash.
+
+A hedged request is first sent to the chosen model. If that model has not
+answered by a deadline (a percentile of its recent request latency, without
+queueing and cache hits), or answers
+with something that is not a valid story for the album, the same album is also
+sent to the other model. Whichever valid Story arrives first is used and the
+other request is cancelled, which also releases its scheduler admission.
+
+The deadline comes from the latencies of the process' metrics registry once a
+model has enough of them, and from the recorded logs of
+final_results_dataset/results_and_logs before that. The performance log of a
+hedged request records the model that served it ("served_by"), whether the
+hedge fired and why, and the registry counts the hedges per model.
+
+The race runs on the shared background event loop. Its queue status updates
+are handed back to the calling thread, which owns the UI the callback draws on.
+"""
+import asyncio
+import logging
+import queue
+import time
+
+from storyteller.core import (
+    GenAIAgent,
+    Story,
+    get_background_loop,
+    prepare_story_request,
+    resolve_model_id,
+    run_on_background_loop,
+)
+from storyteller.image_preprocessing import ImageBudget
+from storyteller.latency_profiles import DEFAULT_LOGS_DIR, load_latency_profiles
+from storyteller.metrics import StageTimer, get_metrics_registry, percentile
+from storyteller.response_parsing import StoryParseError, parse_story_response
+from storyteller.scheduler import current_queue_callback, current_session_id, request_context
+
+logger = logging.getLogger(__name__)
+
+# The model each model hedges to
+HEDGE_MODELS = {
+    "gemma-3-27b-it": "gemini-2.0-flash",
+    "gemini-2.0-flash": "gemma-3-27b-it",
+}
+
+# Seconds between two checks of the race while relaying its queue status updates
+RELAY_POLL_INTERVAL_SEC = 0.05
+
+
+class HedgePolicy:
+    """
+    When to send a request to the other model.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_samples: int = 20,
+        deadline_sec: float = None,
+        hedge_on_invalid: bool = True,
+        logs_dir: str = DEFAULT_LOGS_DIR,
+    ):
+        """
+        Args:
+            percentile (float, optional): Percentile of the model request latency used as deadline.
+            min_samples (int, optional): Latencies the registry needs before they are
+                                         used instead of the recorded logs.
+            deadline_sec (float, optional): Fixed deadline overriding the percentile.
+            hedge_on_invalid (bool, optional): Also hedge when the answer is not a
+                                               valid story for the album.
+            logs_dir (str, optional): Directory of the recorded logs_*.json files.
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.deadline_sec = deadline_sec
+        self.hedge_on_invalid = hedge_on_invalid
+        self.logs_dir = logs_dir
+        self._recorded_latencies = None # model id prefix -> sorted elapsed_time_sec
+
+    def _recorded_percentile(self, model_id: str) -> float:
+        if self._recorded_latencies is None:
+            self._recorded_latencies = {
+                prefix: sorted(elapsed for _, elapsed in profile.samples)
+                for prefix, profile in load_latency_profiles(self.logs_dir).items()
+            }
+        for prefix, latencies in self._recorded_latencies.items():
+            if model_id.startswith(prefix):
+                return percentile(latencies, self.percentile)
+        return None
+
+    def deadline_for(self, model_id: str, language: str) -> float:
+        """
+        Returns the seconds to wait for model_id before hedging, None to never hedge on time.
+        """
+        if self.deadline_sec is not None:
+            return self.deadline_sec
+        # Not the model stage, whose cache hits and queue waits would move the deadline
+        live, count = get_metrics_registry().stage_percentile("model_request", model_id, language, self.percentile)
+        if count >= self.min_samples:
+            return live
+        return self._recorded_percentile(model_id)
+
+
+def hedge_model_for(model_id: str) -> str:
+    try:
+        return HEDGE_MODELS[model_id]
+    except KeyError:
+        raise ValueError(f"No model to hedge {model_id} with, expected one of {list(HEDGE_MODELS)}") from None
+
+
+def _like_agent(agent: GenAIAgent, model_id: str) -> GenAIAgent:
+    # Same client, caches and scheduler, other model
+    return GenAIAgent(
+        specified_model_id=model_id,
+        select_system_prompt=agent.language,
+        genai_client=agent.genai_client,
+        response_cache=agent.response_cache,
+        context_cache=agent.context_cache,
+        scheduler=agent.scheduler,
+    )
+
+
+class _Attempt:
+    # Outcome of one model's request
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.story = None
+        self.log = None
+        self.error = None
+        self.valid = False
+
+
+async def _run_attempt(agent: GenAIAgent, content: list, image_count: int, bypass_cache: bool) -> _Attempt:
+    attempt = _Attempt(agent.chosen_model_id)
+    try:
+        text, attempt.log = await agent.agenerate_single_response(
+            content, Story, include_metrics_log=True, bypass_cache=bypass_cache
+        )
+        attempt.story = parse_story_response(text)
+        # A story that does not match the album cannot be shown image by image
+        attempt.valid = len(attempt.story["story"]) == image_count
+    except Exception as e:
+        attempt.error = e
+    return attempt
+
+
+async def _race(
+    primary_agent: GenAIAgent,
+    primary_content: list,
+    fallback_agent: GenAIAgent,
+    image_data_list: list,
+    language: str,
+    policy: HedgePolicy,
+    deadline_sec: float,
+    image_budget: ImageBudget,
+    bypass_cache: bool,
+    session_id: str,
+    on_queue_update,
+) -> tuple:
+    image_count = len(image_data_list)
+    with request_context(session_id, on_queue_update):
+        primary = asyncio.create_task(_run_attempt(primary_agent, primary_content, image_count, bypass_cache))
+        done, _ = await asyncio.wait({primary}, timeout=deadline_sec)
+        if primary in done:
+            attempt = primary.result()
+            invalid = attempt.error is None or isinstance(attempt.error, StoryParseError)
+            if attempt.valid or (invalid and not policy.hedge_on_invalid):
+                if attempt.story is None:
+                    raise attempt.error
+                return attempt, [attempt], None
+            reason = "invalid_output" if invalid else "error"
+        else:
+            reason = "deadline"
+
+        # Only hedged requests pay for preprocessing the images to the other model's budget
+        _, fallback_content, _ = await asyncio.to_thread(
+            prepare_story_request, image_data_list, fallback_agent.chosen_model_id, language, fallback_agent, image_budget
+        )
+        fallback = asyncio.create_task(_run_attempt(fallback_agent, fallback_content, image_count, bypass_cache))
+        pending = {fallback} if primary.done() else {primary, fallback}
+        finished = [primary.result()] if primary.done() else []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = task.result()
+                    finished.append(attempt)
+                    if attempt.valid:
+                        return attempt, finished, reason
+        finally:
+            # Cancelling the loser releases its scheduler admission, wait for it so none is left held
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    # No valid story, a parsed one with the wrong number of parts still beats nothing
+    for attempt in finished:
+        if attempt.story is not None:
+            return attempt, finished, reason
+    raise finished[-1].error
+
+
+def _run_relaying_queue_updates(race, on_queue_update):
+    # The scheduler reports from the loop's thread, the updates are passed to on_queue_update on this one
+    if on_queue_update is None:
+        return run_on_background_loop(race(None))
+    updates = queue.SimpleQueue()
+    future = asyncio.run_coroutine_threadsafe(race(updates.put), get_background_loop())
+    try:
+        while True:
+            try:
+                status = updates.get(timeout=RELAY_POLL_INTERVAL_SEC)
+            except queue.Empty:
+                if future.done():
+                    return future.result()
+                continue
+            on_queue_update(status)
+    except BaseException:
+        # e.g. the app stopped the script from the callback, the race must not go on without it
+        future.cancel()
+        raise
+
+
+def generate_story_hedged(
+    image_data_list,
+    llm_model_name,
+    language,
+    include_metrics_log: bool = False,
+    ai_handler: GenAIAgent = None,
+    bypass_cache: bool = False,
+    image_budget: ImageBudget = None,
+    policy: HedgePolicy = None,
+):
+    """
+    generate_story_with_llm with a hedge to the other model (see the module docstring).
+
+    Args:
+        image_data_list (list): A list of image data (e.g., bytes).
+        llm_model_name (str): The name of the model asked first.
+        language (str): The selected language (one with a language pack, e.g. "English").
+        include_metrics_log (bool, optional): Also return the performance log,
+                                              with served_by, hedge_fired and hedge_reason.
+        ai_handler (GenAIAgent, optional): Agent of the first model. The agent of the
+                                           other model shares its client, caches and scheduler.
+        bypass_cache (bool, optional): Ask the models for a fresh story.
+        image_budget (ImageBudget, optional): Overrides the per-model image budget.
+        policy (HedgePolicy, optional): Deadline and triggers of the hedge.
+
+    Returns:
+        list[str]: The story segments. With include_metrics_log, a (segments, log) tuple.
+    """
+    policy = policy or HedgePolicy()
+    request_start_time = time.perf_counter()
+    timer = StageTimer()
+    primary_agent, primary_content, preprocessing_report = prepare_story_request(
+        image_data_list, llm_model_name, language, ai_handler, image_budget, timer
+    )
+    primary_model = primary_agent.chosen_model_id
+    fallback_agent = _like_agent(primary_agent, hedge_model_for(resolve_model_id(primary_model)))
+    deadline_sec = policy.deadline_for(primary_model, language)
+
+    try:
+        with timer.span("hedged_model"):
+            session_id = current_session_id()
+            winner, attempts, reason = _run_relaying_queue_updates(
+                lambda on_queue_update: _race(
+                    primary_agent, primary_content, fallback_agent, image_data_list, language,
+                    policy, deadline_sec, image_budget, bypass_cache, session_id, on_queue_update,
+                ),
+                current_queue_callback(),
+            )
+    except Exception:
+        get_metrics_registry().record_error(primary_model, language)
+        raise
+
+    log = dict(winner.log)
+    log.update({
+        "served_by": winner.model_id,
+        "primary_model": primary_model,
+        "hedge_fired": reason is not None,
+        "hedge_reason": reason,
+        "hedge_deadline_sec": round(deadline_sec, 2) if deadline_sec is not None else None,
+        "attempts": [
+            {"model": attempt.model_id, "valid": attempt.valid, "error": repr(attempt.error) if attempt.error else None}
+            for attempt in attempts
+        ],
+    })
+    log["preprocessing"] = preprocessing_report
+    # The winner's own request time, so each model's deadline follows its own latency
+    timer.record("model", winner.log.get("elapsed_time_sec"))
+    timer.record("model_request", winner.log.get("model_request_sec"))
+    timer.record("total", time.perf_counter() - request_start_time)
+    log["stages"] = timer.as_dict()
+    get_metrics_registry().record_request(log, language)
+    logger.debug("Served by %s%s: %s", winner.model_id, f" after a hedge ({reason})" if reason else "", log)
+
+    story_segments = [part["story_part"] for part in winner.story["story"]]
+    if include_metrics_log:
+        return story_segments, log
+    return story_segments
@@ -0,0 +1,311 @@
+"""
+Concurrent download of the album images of dataset manifests.
+
+Replaces the one-by-one download loop of the Extract_spanish_dataset notebook.
+ImageFetcher downloads the image URLs of storyteller.bloom_extract manifests with:
+- one requests.Session with a keep-alive connection pool,
+- a bounded number of downloads in flight,
+- a token bucket per host (storyteller.scheduler.TokenBucket),
+- retries with full jitter backoff on connection errors, 429 and 5xx (honouring
+  Retry-After).
+Downloads land in a content-addressed store (objects/<sha256>), so an URL is
+fetched once and identical images behind different URLs are stored once. The
+manifest's image paths are then hard links into the store. The outcome of every
+URL, including the failures and their error, is appended to the store's
+fetch log, so an interrupted or partly failed run resumes where it stopped.
+
+Usage:
+    python -m storyteller.image_fetcher manifests/bloom_spa.jsonl --image-root images --workers 16
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from storyteller.batch import load_manifest
+from storyteller.scheduler import TokenBucket
+
+DEFAULT_STORE_DIR = os.environ.get("STORY_IMAGE_CACHE_DIR", os.path.join(".cache", "images"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Failures of the connection rather than of the request, worth another try
+RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+CHUNK_SIZE = 1 << 16
+
+
+class FetchError(RuntimeError):
+    """
+    Raised when an image cannot be downloaded.
+    """
+
+    def __init__(self, message: str, retryable: bool, retry_after: float = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _retry_after_sec(response) -> float:
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None # An HTTP date, fall back to the backoff
+
+
+class ImageFetcher:
+    """
+    Thread safe downloader of image URLs into a content-addressed store.
+    """
+
+    def __init__(
+        self,
+        store_dir: str = DEFAULT_STORE_DIR,
+        workers: int = 16,
+        per_host_rps: float = 10.0,
+        max_retries: int = 4,
+        base_backoff_sec: float = 1.0,
+        max_backoff_sec: float = 30.0,
+        timeout: tuple = (5, 30),
+        session: requests.Session = None,
+    ):
+        """
+        Args:
+            store_dir (str, optional): Directory of the image objects and the fetch log.
+            workers (int, optional): Maximum number of downloads in flight.
+            per_host_rps (float, optional): Requests per second allowed to each host.
+            max_retries (int, optional): Retries of a failed download.
+            base_backoff_sec (float, optional): Backoff of the first retry, doubled after each.
+            max_backoff_sec (float, optional): Cap of the backoff.
+            timeout (tuple, optional): Connect and read timeouts in seconds.
+            session (requests.Session, optional): Session to use instead of a new one.
+        """
+        self.store_dir = store_dir
+        self.workers = max(1, workers)
+        self.per_host_rps = per_host_rps
+        self.max_retries = max_retries
+        self.base_backoff_sec = base_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self._host_buckets = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._url_locks = {}
+        self.log_path = os.path.join(store_dir, "fetch_log.jsonl")
+        self._fetched = {} # url -> fetch log record of its last attempt
+        self.counters = {"downloaded": 0, "reused": 0, "duplicates": 0, "failed": 0, "retries": 0, "bytes": 0}
+        os.makedirs(os.path.join(store_dir, "objects"), exist_ok=True)
+        self._load_log()
+
+    def _load_log(self) -> None:
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # A line cut off by a crash
+                self._fetched[record["url"]] = record
+
+    def _append_log(self, record: dict) -> None:
+        with self._lock:
+            self._fetched[record["url"]] = record
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def object_path(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.store_dir, "objects", sha256[:2], f"{sha256}{extension}")
+
+    def _host_bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._host_buckets.get(host)
+            if bucket is None:
+                bucket = self._host_buckets[host] = TokenBucket(self.per_host_rps, max(1.0, self.per_host_rps))
+            return bucket
+
+    def _url_lock(self, url: str) -> threading.Lock:
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def _download_once(self, url: str) -> tuple:
+        # Streams the body to a temporary file of the store, hashing it on the way
+        self._host_bucket(url).acquire()
+        try:
+            response = self.session.get(url, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise FetchError(f"{type(e).__name__}: {e}", retryable=isinstance(e, RETRYABLE_EXCEPTIONS)) from e
+        with response:
+            if response.status_code != 200:
+                raise FetchError(
+                    f"HTTP {response.status_code}",
+                    retryable=response.status_code in RETRYABLE_STATUS_CODES,
+                    retry_after=_retry_after_sec(response),
+                )
+            digest = hashlib.sha256()
+            size = 0
+            descriptor, tmp_path = tempfile.mkstemp(dir=os.path.join(self.store_dir, "objects"), suffix=".part")
+            try:
+                with os.fdopen(descriptor, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+            except requests.RequestException as e:
+                os.remove(tmp_path)
+                raise FetchError(f"{type(e).__name__}: {e}", retryable=isinstance(e, RETRYABLE_EXCEPTIONS)) from e
+        return tmp_path, digest.hexdigest(), size
+
+    def fetch(self, url: str) -> dict:
+        """
+        Downloads url into the store unless the fetch log has it already.
+
+        Returns:
+            dict: Fetch log record, {"url", "status": "ok", "sha256", "path", "bytes"}
+                  or {"url", "status": "failed", "error", "attempts"}.
+        """
+        with self._url_lock(url):
+            known = self._fetched.get(url)
+            if known is not None and known["status"] == "ok" and os.path.exists(known["path"]):
+                with self._lock:
+                    self.counters["reused"] += 1
+                return known
+
+            extension = os.path.splitext(urlparse(url).path)[1].lower() or ".jpg"
+            attempt = 0
+            while True:
+                try:
+                    tmp_path, sha256, size = self._download_once(url)
+                    break
+                except FetchError as e:
+                    if not e.retryable or attempt >= self.max_retries:
+                        record = {"url": url, "status": "failed", "error": str(e), "attempts": attempt + 1}
+                        self._append_log(record)
+                        with self._lock:
+                            self.counters["failed"] += 1
+                        return record
+                    delay = self._random.uniform(0, min(self.max_backoff_sec, self.base_backoff_sec * 2 ** attempt))
+                    if e.retry_after is not None:
+                        delay = max(delay, e.retry_after)
+                    with self._lock:
+                        self.counters["retries"] += 1
+                    attempt += 1
+                    time.sleep(delay)
+
+            path = self.object_path(sha256, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock:
+                duplicate = os.path.exists(path)
+                if duplicate:
+                    # Same content already stored from another URL
+                    os.remove(tmp_path)
+                    self.counters["duplicates"] += 1
+                else:
+                    os.chmod(tmp_path, 0o644) # mkstemp files are private to the user
+                    os.replace(tmp_path, path)
+                self.counters["downloaded"] += 1
+                self.counters["bytes"] += size
+            record = {"url": url, "status": "ok", "sha256": sha256, "path": path, "bytes": size}
+            self._append_log(record)
+            return record
+
+    def materialize(self, record: dict, target_path: str) -> None:
+        """
+        Places a stored image at target_path, as a hard link when the filesystem allows it.
+        """
+        if os.path.exists(target_path):
+            if os.path.samefile(record["path"], target_path):
+                return
+            os.remove(target_path)
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        try:
+            os.link(record["path"], target_path)
+        except OSError:
+            shutil.copyfile(record["path"], target_path)
+
+    def fetch_manifest(self, manifest_path: str, image_root: str, show_progress: bool = True) -> dict:
+        """
+        Downloads every image of a manifest and places it at its path under image_root.
+
+        Returns:
+            dict: {"images", "ok", "failed": [{"album_id", "image", "url", "error"}]}
+        """
+        jobs = []
+        for album in load_manifest(manifest_path):
+            urls = album.get("image_urls") or []
+            for image_path, url in zip(album["images"], urls):
+                jobs.append((album["album_id"], image_path, url))
+
+        summary = {"images": len(jobs), "ok": 0, "failed": []}
+        # An URL shared by several albums is downloaded once, then placed at every path
+        unique_urls = list(dict.fromkeys(url for _, _, url in jobs if url))
+        records = {}
+        progress = tqdm(total=len(unique_urls), desc="Images", disable=not show_progress)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in unique_urls}
+            for future in as_completed(futures):
+                records[futures[future]] = future.result()
+                progress.update(1)
+        progress.close()
+
+        for album_id, image_path, url in jobs:
+            record = records.get(url) if url else {"status": "failed", "error": "No URL in the manifest"}
+            if record["status"] == "ok":
+                self.materialize(record, os.path.join(image_root, image_path))
+                summary["ok"] += 1
+            else:
+                summary["failed"].append({"album_id": album_id, "image": image_path, "url": url, "error": record["error"]})
+        return summary
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the images of album manifests.")
+    parser.add_argument("manifests", nargs="+", help="Manifests with images and image_urls (e.g. bloom_spa.jsonl)")
+    parser.add_argument("--image-root", required=True, help="Directory the manifests' image paths are relative to")
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR, help="Content-addressed image store and fetch log")
+    parser.add_argument("--workers", type=int, default=16, help="Maximum number of downloads in flight")
+    parser.add_argument("--per-host-rps", type=float, default=10.0, help="Requests per second allowed to each host")
+    parser.add_argument("--max-retries", type=int, default=4)
+    args = parser.parse_args()
+
+    fetcher = ImageFetcher(
+        store_dir=args.store_dir,
+        workers=args.workers,
+        per_host_rps=args.per_host_rps,
+        max_retries=args.max_retries,
+    )
+    for manifest_path in args.manifests:
+        summary = fetcher.fetch_manifest(manifest_path, args.image_root)
+        print(f"{manifest_path}: {summary['ok']} of {summary['images']} images, {len(summary['failed'])} failed")
+        if summary["failed"]:
+            failures_path = f"{manifest_path}.failed.jsonl"
+            with open(failures_path, "w", encoding="utf-8") as f:
+                for failure in summary["failed"]:
+                    f.write(json.dumps(failure) + "\n")
+            print(f"  failures written to {failures_path}, run again to retry them")
+    print(f"Fetcher: {fetcher.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Image preprocessing before upload to the model.
+
+Uploaded photos are downscaled and re-encoded to a per-model resolution and
+quality budget, with their metadata stripped, so requests carry fewer input
+tokens and smaller payloads. The 2-5 images of a request are processed in
+parallel (Pillow releases the GIL while decoding, resizing and encoding).
+"""
+import io
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from google.genai import types
+from PIL import Image, ImageOps
+
+
+@dataclass(frozen=True)
+class ImageBudget:
+    """
+    Resolution and encoding budget of the images sent to a model.
+    """
+    max_side: int # Longest side in pixels after downscaling
+    quality: int = 85 # JPEG quality of the re-encoded image
+
+
+@dataclass(frozen=True)
+class DecodedImage:
+    """
+    An upload decoded ahead of the preprocessing (see storyteller.image_store),
+    with the size of the upload for the savings report.
+    """
+    image: Image.Image
+    original_bytes: int # Size of the uploaded file
+    original_size: tuple # (width, height) of the upload, before any downscaling
+
+
+# Gemini 2.0 tiles images in 768x768 crops of 258 tokens each, so one tile is enough
+# for a story frame. Gemma 3 resizes every image to 896x896 (256 tokens) on its side,
+# sending more pixels than that only costs payload size.
+MODEL_IMAGE_BUDGETS = {
+    "gemini-2.0-flash": ImageBudget(max_side=768),
+    "gemma-3-27b-it": ImageBudget(max_side=896),
+}
+DEFAULT_IMAGE_BUDGET = ImageBudget(max_side=768)
+
+# Shared pool so a request does not pay thread start-up, sized for the 5 images limit
+_preprocess_executor = ThreadPoolExecutor(max_workers=min(5, os.cpu_count() or 1), thread_name_prefix="image-preprocess")
+
+
+def estimate_image_tokens(model_id: str, width: int, height: int) -> int:
+    """
+    Estimates the input tokens the model bills for an image of the given size.
+    """
+    if model_id.startswith("gemma"):
+        return 256
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+def budgeted_size(size: tuple, model_id: str, budget: ImageBudget = None) -> tuple:
+    """
+    Returns the (width, height) an image of the given size is downscaled to for the model.
+    """
+    budget = budget or MODEL_IMAGE_BUDGETS.get(model_id, DEFAULT_IMAGE_BUDGET)
+    width, height = size
+    scale = min(1.0, budget.max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    # JPEG has no alpha channel, transparent areas are put over a white background
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def preprocess_image(image_data, model_id: str, budget: ImageBudget = None):
+    """
+    Downscales and re-encodes one image as a JPEG part without metadata.
+
+    Args:
+        image_data (bytes | DecodedImage | PIL.Image.Image): The uploaded image.
+        model_id (str): The model the image is sent to.
+        budget (ImageBudget, optional): Overrides the budget of the model.
+
+    Returns:
+        tuple: (types.Part, stats dict of the image)
+    """
+    budget = budget or MODEL_IMAGE_BUDGETS.get(model_id, DEFAULT_IMAGE_BUDGET)
+    decode_start = time.perf_counter()
+    if isinstance(image_data, (bytes, bytearray)):
+        original_bytes = len(image_data)
+        image = Image.open(io.BytesIO(image_data))
+        original_size = None
+    elif isinstance(image_data, DecodedImage):
+        image = image_data.image
+        original_bytes = image_data.original_bytes
+        original_size = image_data.original_size
+    else:
+        image = image_data
+        original_bytes = None # Unknown, the upload was already decoded
+        original_size = None
+    image.load()
+    decode_sec = time.perf_counter() - decode_start
+    original_size = original_size or image.size
+
+    # Apply the EXIF orientation before the metadata is dropped
+    image = ImageOps.exif_transpose(image)
+    image = to_rgb(image)
+    if max(image.size) > budget.max_side:
+        image = image.copy()
+        image.thumbnail((budget.max_side, budget.max_side), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    # Saving without exif/icc/comment arguments strips the metadata
+    image.save(buffer, format="JPEG", quality=budget.quality, optimize=True)
+    processed = buffer.getvalue()
+
+    stats = {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(processed),
+        "tokens_before": estimate_image_tokens(model_id, *original_size),
+        "tokens_after": estimate_image_tokens(model_id, *image.size),
+        "decode_sec": decode_sec,
+    }
+    return types.Part.from_bytes(data=processed, mime_type="image/jpeg"), stats
+
+
+def preprocess_images(image_data_list: list, model_id: str, budget: ImageBudget = None):
+    """
+    Preprocesses the images of a request in parallel.
+
+    Args:
+        image_data_list (list): Images as bytes, DecodedImage or PIL images, in story order.
+        model_id (str): The model the images are sent to.
+        budget (ImageBudget, optional): Overrides the budget of the model.
+
+    Returns:
+        tuple: (list of types.Part in the same order, request level savings report)
+    """
+    start_time = time.time()
+    results = list(_preprocess_executor.map(
+        lambda image_data: preprocess_image(image_data, model_id, budget), image_data_list
+    ))
+    parts = [part for part, _ in results]
+    image_stats = [stats for _, stats in results]
+
+    known_original = [stats for stats in image_stats if stats["original_bytes"] is not None]
+    original_bytes = sum(stats["original_bytes"] for stats in known_original)
+    processed_bytes = sum(stats["processed_bytes"] for stats in image_stats)
+    tokens_before = sum(stats["tokens_before"] for stats in image_stats)
+    tokens_after = sum(stats["tokens_after"] for stats in image_stats)
+    report = {
+        "images": len(image_stats),
+        "processed_bytes": processed_bytes,
+        "estimated_image_tokens": tokens_after,
+        "estimated_tokens_saved": tokens_before - tokens_after,
+        "preprocess_time_sec": round(time.time() - start_time, 3),
+        # Summed over the images, which are decoded in parallel
+        "decode_time_sec": round(sum(stats["decode_sec"] for stats in image_stats), 3),
+    }
+    if len(known_original) == len(image_stats):
+        report["original_bytes"] = original_bytes
+        report["bytes_saved"] = original_bytes - processed_bytes
+    return parts, report
@@ -0,0 +1,186 @@
+"""
+Process wide, memory bounded store of the uploaded images.
+
+Images are addressed by the SHA-256 of their uploaded bytes, so sessions only
+keep keys and the same photo uploaded twice is held once. Each upload is decoded
+once, into a source image already oriented, converted to RGB and downscaled to
+the largest model image budget (JPEG uploads are decoded at reduced scale). The
+previews, the story display images and the model requests are all derived from
+that source, the latter with the size of the upload for the savings report.
+Renditions are made lazily at the widths the app renders and kept in the same
+LRU as the sources, under one memory cap.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+from storyteller.image_preprocessing import MODEL_IMAGE_BUDGETS, DecodedImage, to_rgb
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("STORY_IMAGE_STORE_MB", 256)) * 2**20)
+
+# Nothing sent to a model needs more pixels than its image budget
+SOURCE_MAX_SIDE = max(budget.max_side for budget in MODEL_IMAGE_BUDGETS.values())
+
+# Widths the app renders the images at
+PREVIEW_WIDTH = 150
+DISPLAY_WIDTH = 400
+
+
+def _decoded_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def decode_source_image(image_data: bytes, max_side: int = SOURCE_MAX_SIDE) -> DecodedImage:
+    """
+    Decodes an upload into an oriented RGB image whose longest side is at most max_side.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    original_size = image.size
+    # JPEG decoders can skip detail directly (power of two scales), far cheaper than a full decode
+    image.draft("RGB", (max_side, max_side))
+    image.load()
+    image = to_rgb(ImageOps.exif_transpose(image))
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return DecodedImage(image=image, original_bytes=len(image_data), original_size=original_size)
+
+
+class ImageStore:
+    """
+    Thread safe, content addressed LRU of decoded images and their renditions.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, source_max_side: int = SOURCE_MAX_SIDE):
+        """
+        Args:
+            max_bytes (int, optional): Cap of the decoded pixels held, sources and renditions.
+            source_max_side (int, optional): Longest side of the stored source images.
+        """
+        self.max_bytes = max_bytes
+        self.source_max_side = source_max_side
+        # (key, width) -> (rendition, bytes), and (key, None) -> (DecodedImage of the source, bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._decode_locks = {} # key -> lock, so concurrent puts of one image decode it once
+        self.counters = {"decodes": 0, "hits": 0, "renditions": 0, "evictions": 0}
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return (key, None) in self._entries
+
+    def _get(self, entry_key):
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(entry_key)
+            return entry[0]
+
+    def _add(self, entry_key, item) -> None:
+        size = _decoded_bytes(item.image if isinstance(item, DecodedImage) else item)
+        with self._lock:
+            previous = self._entries.pop(entry_key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[entry_key] = (item, size)
+            self._bytes += size
+            # The entry just added stays even if it alone exceeds the cap
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    def put(self, image_data: bytes) -> str:
+        """
+        Stores an uploaded image, decoding it unless it is already stored.
+
+        Returns:
+            str: The key of the image.
+
+        Raises:
+            PIL.UnidentifiedImageError: If the bytes are not an image.
+        """
+        key = hashlib.sha256(image_data).hexdigest()
+        if self._get((key, None)) is not None:
+            with self._lock:
+                self.counters["hits"] += 1
+            return key
+        with self._lock:
+            decode_lock = self._decode_locks.setdefault(key, threading.Lock())
+        with decode_lock:
+            if self._get((key, None)) is None:
+                self._add((key, None), decode_source_image(image_data, self.source_max_side))
+                with self._lock:
+                    self.counters["decodes"] += 1
+        with self._lock:
+            self._decode_locks.pop(key, None)
+        return key
+
+    def decoded(self, key: str) -> DecodedImage:
+        """
+        Returns the source image with the size of its upload, the input of the model requests.
+
+        Raises:
+            KeyError: If the image was evicted (or never stored), put it again.
+        """
+        decoded = self._get((key, None))
+        if decoded is None:
+            raise KeyError(key)
+        return decoded
+
+    def source(self, key: str) -> Image.Image:
+        """
+        Returns the decoded source image.
+
+        Raises:
+            KeyError: If the image was evicted (or never stored), put it again.
+        """
+        return self.decoded(key).image
+
+    def rendition(self, key: str, width: int) -> Image.Image:
+        """
+        Returns the image downscaled to width (never upscaled), made on first use.
+
+        Raises:
+            KeyError: If neither the rendition nor the source is stored.
+        """
+        image = self._get((key, width))
+        if image is not None:
+            return image
+        source = self.source(key)
+        if source.width <= width:
+            return source
+        image = source.copy()
+        image.thumbnail((width, source.height * width // source.width + 1), Image.Resampling.LANCZOS)
+        self._add((key, width), image)
+        with self._lock:
+            self.counters["renditions"] += 1
+        return image
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+            stats["sources"] = sum(1 for _, width in self._entries if width is None)
+            stats["bytes"] = self._bytes
+            return stats
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_image_store() -> ImageStore:
+    """
+    Returns the process wide image store shared by the app sessions.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ImageStore()
+        return _default_store
@@ -0,0 +1,117 @@
+"""
+Registry of the story languages, loaded from data files.
+
+Each language is a pack directory under one_shot_examples/ holding a pack.json
+and the one-shot example images:
+
+    one_shot_examples/<language in lower case, spaces as "_">/pack.json
+    {
+        "language": "English",
+        "image_label": "Image",            # Labels the images in the prompt ("Image 1:")
+        "system_prompt": "...",            # System instruction (Gemini)
+        "user_prompt": "...",              # Instructions ending right before the example images
+        "example_output": "...",           # Example answer and the marker where the user input starts
+        "images": ["00.png", ...],         # Example images, relative to the pack, in story order
+        "regenerate_part_prompt": "...",   # Rewrites one part, formatted with {part_number}
+        "regenerate_part_labels": {"previous": "...", "current": "...", "next": "..."}
+    }
+
+Adding a language only takes a new pack directory (and a restart). Listing the
+languages only reads the directory names, once per process, and a pack is read the first time its language is
+used (its example images later still, by storyteller.one_shot), so the start-up
+time and memory do not grow with the number of installed packs.
+"""
+import functools
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+DEFAULT_PACKS_DIR = os.environ.get("STORY_LANGUAGE_PACKS_DIR", "one_shot_examples")
+DEFAULT_LANGUAGE = "English"
+PACK_FILE_NAME = "pack.json"
+PACK_REQUIRED_KEYS = (
+    "language", "image_label", "system_prompt", "user_prompt", "example_output", "images",
+    "regenerate_part_prompt", "regenerate_part_labels",
+)
+
+# lru_cache does not stop two threads from reading the same pack at once
+_load_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class LanguagePack:
+    """
+    Prompts and one-shot example of a story language.
+    """
+    language: str
+    image_label: str
+    system_prompt: str
+    user_prompt: str
+    example_output: str
+    image_paths: tuple
+    regenerate_part_prompt: str
+    regenerate_part_labels: dict
+
+
+def pack_dir_name(language: str) -> str:
+    return language.lower().replace(" ", "_")
+
+
+def available_languages(packs_dir: str = DEFAULT_PACKS_DIR) -> list:
+    """
+    Returns the names of the installed languages, from their pack directory names.
+    """
+    # The app asks on every rerun, the directory is scanned once
+    return list(_scan_languages(packs_dir))
+
+
+@functools.lru_cache(maxsize=None)
+def _scan_languages(packs_dir: str) -> tuple:
+    languages = []
+    for entry in sorted(os.scandir(packs_dir), key=lambda entry: entry.name):
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, PACK_FILE_NAME)):
+            languages.append(" ".join(word.capitalize() for word in entry.name.split("_")))
+    # The default language first, it is the default choice of the interfaces
+    if DEFAULT_LANGUAGE in languages:
+        languages.remove(DEFAULT_LANGUAGE)
+        languages.insert(0, DEFAULT_LANGUAGE)
+    return tuple(languages)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_language_pack(language: str, packs_dir: str) -> LanguagePack:
+    pack_dir = os.path.join(packs_dir, pack_dir_name(language))
+    pack_path = os.path.join(pack_dir, PACK_FILE_NAME)
+    if not os.path.exists(pack_path):
+        raise ValueError(f"No language pack for {language!r}, expected {pack_path}")
+    with open(pack_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    missing = [key for key in PACK_REQUIRED_KEYS if key not in data]
+    if missing:
+        raise ValueError(f"Language pack {pack_path} is missing the keys {missing}")
+    return LanguagePack(
+        language=data["language"],
+        image_label=data["image_label"],
+        system_prompt=data["system_prompt"],
+        user_prompt=data["user_prompt"],
+        example_output=data["example_output"],
+        image_paths=tuple(os.path.join(pack_dir, image) for image in data["images"]),
+        regenerate_part_prompt=data["regenerate_part_prompt"],
+        regenerate_part_labels=dict(data["regenerate_part_labels"]),
+    )
+
+
+def get_language_pack(language: str, packs_dir: str = DEFAULT_PACKS_DIR) -> LanguagePack:
+    """
+    Returns the pack of a language, reading it on first use.
+
+    Args:
+        language (str): Language name, e.g. "English" or "Spanish".
+        packs_dir (str, optional): Directory of the pack directories.
+
+    Raises:
+        ValueError: If the language has no pack or its pack is incomplete.
+    """
+    with _load_lock:
+        return _load_language_pack(language, packs_dir)
@@ -0,0 +1,61 @@
+"""
+Latencies recorded by the generation logs of final_results_dataset/results_and_logs.
+
+Each model family has a profile of the (input tokens, elapsed_time_sec) pairs
+its logs recorded. The hedged requests take their first deadlines from it and
+the mock Gemini server replays it.
+"""
+import glob
+import json
+import os
+import random
+
+DEFAULT_LOGS_DIR = "final_results_dataset/results_and_logs"
+
+# Recorded log files of each model family, matched by model id prefix
+LOG_FILE_PATTERNS = {
+    "gemini": "logs_gemini20_*.json",
+    "gemma": "logs_gemma3_*.json",
+}
+
+
+class LatencyProfile:
+    """
+    Recorded (input_tokens, elapsed_time_sec) pairs of a model, sampled together
+    so a long request also has the large input that came with it.
+    """
+
+    def __init__(self, samples: list):
+        if not samples:
+            raise ValueError("A latency profile needs at least one sample")
+        self.samples = samples
+
+    @classmethod
+    def from_log_files(cls, paths: list) -> "LatencyProfile":
+        samples = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                log = entry.get("log") or {}
+                if log.get("elapsed_time_sec") is not None:
+                    samples.append((log.get("input_tokens") or 0, log["elapsed_time_sec"]))
+        return cls(samples)
+
+    def sample(self, rng: random.Random) -> tuple:
+        return rng.choice(self.samples)
+
+
+def load_latency_profiles(logs_dir: str = DEFAULT_LOGS_DIR) -> dict:
+    """
+    Loads the latency profile of every model family with recorded logs.
+
+    Returns:
+        dict: {model id prefix: LatencyProfile}
+    """
+    profiles = {}
+    for prefix, pattern in LOG_FILE_PATTERNS.items():
+        paths = sorted(glob.glob(os.path.join(logs_dir, pattern)))
+        if paths:
+            profiles[prefix] = LatencyProfile.from_log_files(paths)
+    return profiles
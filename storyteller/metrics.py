@@ -0,0 +1,256 @@
+"""
+Per-stage latency instrumentation of the generation pipeline.
+
+Each request times its stages (image decode, preprocessing, request build,
+model call, the model request alone without queueing, time to first token,
+parsing and rendering) with a StageTimer. The
+finished performance logs are recorded in a process wide MetricsRegistry, which
+keeps latency histograms and percentiles per model and language and exports
+them as JSONL or in the Prometheus text format.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Latency histogram buckets in seconds, covering cached answers up to slow model calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 7.5, 10, 15, 20, 30, 60)
+PERCENTILES = (50, 90, 95, 99)
+
+# Average characters per token of the Gemini/Gemma tokenizers on prose
+CHARS_PER_TOKEN = 4
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Estimates the token count of a text, for answers where the API omits it (Gemma 3).
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class StageTimer:
+    """
+    Collects the duration of the stages of one request.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Times the enclosed block and adds it to the stage.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time)
+
+    def record(self, stage: str, seconds: float) -> None:
+        if seconds is None:
+            return
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> dict:
+        return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    """
+    Returns the percentile of already sorted values, with linear interpolation.
+    """
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * percent / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+class _Histogram:
+    def __init__(self, sample_size: int):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        # Recent values kept for the percentiles
+        self.samples = deque(maxlen=sample_size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    Thread safe store of request metrics, labelled by model and language.
+    """
+
+    def __init__(self, sample_size: int = 2000, jsonl_path: str = None):
+        """
+        Args:
+            sample_size (int, optional): Recent observations kept per histogram for percentiles.
+            jsonl_path (str, optional): File every recorded request is appended to.
+        """
+        self.sample_size = sample_size
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._histograms = {} # (stage, model, language) -> _Histogram
+        self._counters = defaultdict(float) # (name, model, language) -> value
+        self._records = deque(maxlen=sample_size)
+
+    def record_request(self, performance_log: dict, language: str) -> None:
+        """
+        Records the performance log of a finished request.
+
+        Args:
+            performance_log (dict): Log with model_used, tokens, elapsed_time_sec
+                                    and the per-stage "stages" timings. Without a
+                                    "total" stage, elapsed_time_sec is used.
+            language (str): The story language.
+        """
+        model = performance_log.get("model_used") or "unknown"
+        record = dict(performance_log, language=language, timestamp=round(time.time(), 3))
+        stages = dict(performance_log.get("stages") or {})
+        stages.setdefault("total", performance_log.get("elapsed_time_sec"))
+        with self._lock:
+            for stage, seconds in stages.items():
+                if seconds is not None:
+                    self._observe(stage, model, language, seconds)
+            self._counters[("requests_total", model, language)] += 1
+            if performance_log.get("cache_hit"):
+                self._counters[("cache_hits_total", model, language)] += 1
+            if performance_log.get("hedge_fired"):
+                # Counted against the model that was asked first
+                self._counters[("hedges_total", performance_log.get("primary_model") or model, language)] += 1
+            for name in ("input_tokens", "cached_input_tokens", "output_tokens"):
+                if performance_log.get(name):
+                    self._counters[(f"{name}_total", model, language)] += performance_log[name]
+            self._records.append(record)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def _observe(self, stage: str, model: str, language: str, seconds: float) -> None:
+        key = (stage, model, language)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(self.sample_size)
+        histogram.observe(seconds)
+
+    def observe_stage(self, stage: str, model: str, language: str, seconds: float) -> None:
+        """
+        Records one stage duration outside of a finished request (e.g. a cancelled one).
+        """
+        with self._lock:
+            self._observe(stage, model, language, seconds)
+
+    def stage_percentile(self, stage: str, model: str, language: str, percent: float) -> tuple:
+        """
+        Returns (percentile in seconds, observation count) of a stage, (None, 0) if unobserved.
+        """
+        with self._lock:
+            histogram = self._histograms.get((stage, model, language))
+            if histogram is None:
+                return None, 0
+            return percentile(sorted(histogram.samples), percent), histogram.count
+
+    def record_error(self, model: str, language: str) -> None:
+        with self._lock:
+            self._counters[("errors_total", model, language)] += 1
+
+    def percentiles(self) -> dict:
+        """
+        Returns {model: {language: {stage: {"count", "p50", "p90", "p95", "p99"}}}}.
+        """
+        summary = {}
+        with self._lock:
+            for (stage, model, language), histogram in sorted(self._histograms.items()):
+                values = sorted(histogram.samples)
+                stage_summary = {"count": histogram.count}
+                for percent in PERCENTILES:
+                    stage_summary[f"p{percent}"] = round(percentile(values, percent), 4)
+                summary.setdefault(model, {}).setdefault(language, {})[stage] = stage_summary
+        return summary
+
+    def export_jsonl(self, path: str) -> int:
+        """
+        Writes the recent request records to a JSONL file and returns how many.
+        """
+        with self._lock:
+            records = list(self._records)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return len(records)
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP story_stage_duration_seconds Duration of the story generation stages.",
+            "# TYPE story_stage_duration_seconds histogram",
+        ]
+        quantile_lines = [
+            "# HELP story_stage_duration_quantile_seconds Recent percentiles of the stage durations.",
+            "# TYPE story_stage_duration_quantile_seconds gauge",
+        ]
+        with self._lock:
+            for (stage, model, language), histogram in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",model="{model}",language="{language}"'
+                # Bucket counts are cumulative already, as Prometheus expects
+                for bound, count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                    lines.append(f'story_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'story_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"story_stage_duration_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"story_stage_duration_seconds_count{{{labels}}} {histogram.count}")
+                values = sorted(histogram.samples)
+                for percent in PERCENTILES:
+                    quantile_lines.append(
+                        f'story_stage_duration_quantile_seconds{{{labels},quantile="{percent / 100}"}} '
+                        f"{percentile(values, percent):.6f}"
+                    )
+            counter_names = sorted({name for name, _, _ in self._counters})
+            for name in counter_names:
+                lines.append(f"# TYPE story_{name} counter")
+                for (counter_name, model, language), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f'story_{name}{{model="{model}",language="{language}"}} {value:g}')
+        return "\n".join(lines + quantile_lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes the Prometheus text format to a file (e.g. for node_exporter's textfile collector).
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Returns the process wide metrics registry. Set STORY_METRICS_JSONL to also
+    append every request to a JSONL file.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry(jsonl_path=os.environ.get("STORY_METRICS_JSONL"))
+        return _registry
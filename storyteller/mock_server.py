@@ -0,0 +1,306 @@
+"""
+Local HTTP stand-ins for the Gemini API and for image hosts, for load tests that
+must not spend quota or hit the real hosts.
+
+MockGenAIServer answers the generateContent and streamGenerateContent (SSE)
+endpoints of the REST API that google-genai calls. Each answer follows the Story
+schema and replays an (input tokens, elapsed_time_sec) pair sampled from the
+recorded generation logs of the model (final_results_dataset/results_and_logs),
+so latency and token usage under load match what the real API produced. A
+fraction of the requests can be answered with 429 / 5xx errors.
+
+Point a client at it with:
+    genai.Client(api_key="mock", http_options=types.HttpOptions(base_url=server.base_url))
+
+MockImageServer serves fixed image bytes by path, with optional latency and
+429/503 errors, and counts the requests and connections it received.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from storyteller.fakes import build_fake_story_text, labelled_image_numbers
+from storyteller.latency_profiles import load_latency_profiles
+
+ERROR_STATUSES = {
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+_MODEL_PATH_PATTERN = re.compile(r"/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+
+def _request_texts(body: dict) -> list:
+    # Text parts in order, with a placeholder for every image so labels stay aligned
+    items = []
+    for content in body.get("contents") or []:
+        for part in content.get("parts") or []:
+            items.append(part["text"] if "text" in part else None)
+    return items
+
+
+class _MockGenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockGenAIServer"
+
+    def log_message(self, format, *args):
+        # Load tests send thousands of requests, keep stderr quiet
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        match = _MODEL_PATH_PATTERN.search(self.path)
+        if match is None:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}", "status": "NOT_FOUND"}})
+            return
+        model, method = match.groups()
+
+        plan = self.server.plan_response(model)
+        if plan["error_code"]:
+            # Errors come back fast, like the quota check of the real API
+            time.sleep(min(plan["latency_sec"], 0.05))
+            code = plan["error_code"]
+            self._send_json(code, {"error": {"code": code, "message": "Injected mock error", "status": ERROR_STATUSES.get(code, "UNKNOWN")}})
+            return
+
+        is_gemma = model.startswith("gemma")
+        numbers = labelled_image_numbers(_request_texts(body))
+        text = build_fake_story_text(len(numbers), fenced=is_gemma, first_image=numbers[0] if numbers else 1)
+        usage = {"promptTokenCount": plan["input_tokens"], "totalTokenCount": plan["input_tokens"]}
+        if not is_gemma:
+            # Gemma 3 answers carry no output token count
+            usage["candidatesTokenCount"] = len(text) // 4
+            usage["totalTokenCount"] += usage["candidatesTokenCount"]
+
+        if method == "streamGenerateContent":
+            self._send_stream(model, text, usage, plan["latency_sec"])
+        else:
+            time.sleep(plan["latency_sec"])
+            self._send_json(200, self._response_body(model, text, usage, finished=True))
+
+    @staticmethod
+    def _response_body(model: str, text: str, usage: dict, finished: bool) -> dict:
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        body = {"candidates": [candidate], "modelVersion": model}
+        if usage:
+            body["usageMetadata"] = usage
+        return body
+
+    def _send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, model: str, text: str, usage: dict, latency_sec: float):
+        chunk_count = self.server.stream_chunks
+        chunk_size = max(1, len(text) // chunk_count + 1)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # The first token takes longest, the rest of the recorded latency is spread evenly
+        time.sleep(latency_sec * 0.3)
+        for i, chunk_text in enumerate(chunks):
+            if i:
+                time.sleep(latency_sec * 0.7 / len(chunks))
+            is_last = i == len(chunks) - 1
+            event = self._response_body(model, chunk_text, usage if is_last else None, finished=is_last)
+            self._write_chunk(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockGenAIServer(ThreadingHTTPServer):
+    """
+    Threaded mock of the Gemini REST API replaying recorded latency profiles.
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        profiles: dict = None,
+        time_scale: float = 1.0,
+        error_rate: float = 0.0,
+        error_codes: tuple = (429, 500, 503),
+        stream_chunks: int = 8,
+        seed: int = None,
+    ):
+        """
+        Args:
+            host (str, optional): Interface to listen on.
+            port (int, optional): Port to listen on, 0 picks a free one.
+            profiles (dict, optional): {model id prefix: LatencyProfile}, loaded
+                                       from the recorded logs by default.
+            time_scale (float, optional): Multiplier of the replayed latencies (e.g. 0.1
+                                          to run a load test ten times faster).
+            error_rate (float, optional): Fraction of requests answered with an error.
+            error_codes (tuple, optional): HTTP codes the injected errors are drawn from.
+            stream_chunks (int, optional): Number of SSE events of a streamed answer.
+            seed (int, optional): Seed of the sampling, for reproducible runs.
+        """
+        super().__init__((host, port), _MockGenAIHandler)
+        self.profiles = profiles if profiles is not None else load_latency_profiles()
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def plan_response(self, model: str) -> dict:
+        """
+        Draws the latency, input tokens and injected error of the next answer.
+        """
+        profile = next((p for prefix, p in self.profiles.items() if model.startswith(prefix)), None)
+        with self._lock:
+            self.request_count += 1
+            if profile is not None:
+                input_tokens, elapsed_sec = profile.sample(self._random)
+            else:
+                input_tokens, elapsed_sec = 1800, 1.0
+            error_code = None
+            if self._random.random() < self.error_rate:
+                error_code = self._random.choice(self.error_codes)
+                self.error_count += 1
+        return {"input_tokens": input_tokens, "latency_sec": elapsed_sec * self.time_scale, "error_code": error_code}
+
+    def start(self) -> "MockGenAIServer":
+        """
+        Serves in a daemon thread and returns the server.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-genai-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _MockImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockImageServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_GET(self):
+        body = self.server.images.get(self.path)
+        error_code = self.server.plan_error(self.path)
+        if self.server.latency_sec:
+            time.sleep(self.server.latency_sec)
+        if error_code or body is None:
+            self.send_response(error_code or 404)
+            if error_code == 429:
+                self.send_header("Retry-After", str(self.server.retry_after_sec))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockImageServer(ThreadingHTTPServer):
+    """
+    Threaded image host serving {path: bytes}, e.g. {"/photos/1.jpg": b"..."}.
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        images: dict,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_sec: float = 0.0,
+        error_rate: float = 0.0,
+        error_codes: tuple = (429, 503),
+        retry_after_sec: int = 0,
+        seed: int = None,
+    ):
+        """
+        Args:
+            images (dict): Bytes served by path, other paths answer 404.
+            host (str, optional): Interface to listen on.
+            port (int, optional): Port to listen on, 0 picks a free one.
+            latency_sec (float, optional): Delay before every answer.
+            error_rate (float, optional): Fraction of requests answered with an error.
+            error_codes (tuple, optional): HTTP codes the injected errors are drawn from.
+            retry_after_sec (int, optional): Retry-After header of the injected 429 answers.
+            seed (int, optional): Seed of the error sampling.
+        """
+        super().__init__((host, port), _MockImageHandler)
+        self.images = images
+        self.latency_sec = latency_sec
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after_sec = retry_after_sec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.connection_count = 0
+        self.requests_by_path = {}
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_connection(self) -> None:
+        with self._lock:
+            self.connection_count += 1
+
+    def plan_error(self, path: str) -> int:
+        with self._lock:
+            self.request_count += 1
+            self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+            if self._random.random() < self.error_rate:
+                self.error_count += 1
+                return self._random.choice(self.error_codes)
+            return None
+
+    def start(self) -> "MockImageServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-image-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,62 @@
+"""
+One-shot example assets for the story prompts.
+
+The example images are read and encoded only the first time a language is used,
+then kept for the whole process as ready-to-send image parts, so neither the app
+start-up nor the Streamlit reruns pay for them.
+"""
+import functools
+import threading
+
+from storyteller.image_preprocessing import ImageBudget, preprocess_image
+from storyteller.language_packs import get_language_pack
+
+# The examples only show the task, 384 px keeps each one at the minimum image cost (258 tokens)
+ONE_SHOT_IMAGE_BUDGET = ImageBudget(max_side=384, quality=80)
+
+# lru_cache does not stop two threads from loading the same language at once
+_load_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_one_shot_image_parts(language: str) -> tuple:
+    parts = []
+    for path in get_language_pack(language).image_paths:
+        with open(path, "rb") as f:
+            part, _ = preprocess_image(f.read(), model_id="", budget=ONE_SHOT_IMAGE_BUDGET)
+        parts.append(part)
+    return tuple(parts)
+
+
+def load_one_shot_image_parts(language: str) -> tuple:
+    """
+    Returns the encoded example images of a language, loading them on first use.
+
+    Args:
+        language (str): A language with a language pack, e.g. "English".
+
+    Returns:
+        tuple[types.Part]: The example images in story order.
+    """
+    with _load_lock:
+        return _load_one_shot_image_parts(language)
+
+
+def build_few_shot_content(language: str) -> list:
+    """
+    Builds the static start of a story request from the language pack: the
+    instructions, the labelled example images and the expected example output.
+
+    Args:
+        language (str): A language with a language pack, e.g. "English".
+
+    Returns:
+        list: Content items to put before the user's labelled images.
+    """
+    pack = get_language_pack(language)
+    content = [pack.user_prompt]
+    for i, part in enumerate(load_one_shot_image_parts(language)):
+        content.append(f"{pack.image_label} {i+1}:")
+        content.append(part)
+    content.append(pack.example_output)
+    return content
@@ -0,0 +1,260 @@
+"""
+Content-addressed cache of model responses.
+
+Identical requests (same images, model, language, prompt and generation config)
+are answered from the cache instead of paying model latency and tokens again.
+There are two tiers: a small in-memory LRU and a size-bounded on-disk store with
+LRU eviction and a TTL, shared by every process using the same cache directory.
+The disk tier is read and written outside the lock of the memory tier, so a slow
+disk never holds up the memory hits.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from google.genai import types
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get("STORY_CACHE_DIR", os.path.join(".cache", "responses"))
+
+
+def _describe_config_value(value):
+    # Response schemas are classes (e.g. the Story TypedDict), identify them by name
+    if isinstance(value, type):
+        return f"{value.__module__}.{value.__qualname__}"
+    return str(value)
+
+
+def _hash_content_item(digest, item) -> None:
+    if isinstance(item, str):
+        digest.update(b"text:")
+        digest.update(item.encode("utf-8"))
+    elif isinstance(item, (bytes, bytearray)):
+        digest.update(b"bytes:")
+        digest.update(item)
+    elif isinstance(item, Image.Image):
+        digest.update(f"image:{item.mode}:{item.size}:".encode("utf-8"))
+        digest.update(item.tobytes())
+    elif isinstance(item, types.Part) and item.inline_data is not None:
+        digest.update(f"part:{item.inline_data.mime_type}:".encode("utf-8"))
+        digest.update(item.inline_data.data)
+    elif isinstance(item, types.Part) and item.text is not None:
+        digest.update(b"text:")
+        digest.update(item.text.encode("utf-8"))
+    else:
+        digest.update(f"other:{item!r}".encode("utf-8"))
+    digest.update(b"\0")
+
+
+def make_cache_key(content_list: list, model_id: str, language: str, generation_config=None) -> str:
+    """
+    Builds the cache key of a request as a SHA-256 over everything that changes the answer.
+
+    Args:
+        content_list (list): Request contents (prompt text, labels and images).
+        model_id (str): The model id.
+        language (str): The story language.
+        generation_config (types.GenerateContentConfig, optional): Generation settings.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"model:{model_id}\0language:{language}\0".encode("utf-8"))
+    if generation_config is not None:
+        config_dict = generation_config.model_dump(exclude_none=True)
+        digest.update(json.dumps(config_dict, sort_keys=True, default=_describe_config_value).encode("utf-8"))
+        digest.update(b"\0")
+    for item in content_list:
+        _hash_content_item(digest, item)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Two tier (memory + disk) LRU cache of generated responses with hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        memory_max_entries: int = 256,
+        disk_max_bytes: int = 64 * 1024 * 1024,
+        ttl_sec: float = 7 * 24 * 3600,
+    ):
+        """
+        Args:
+            cache_dir (str, optional): Directory of the on-disk tier. None disables it.
+            memory_max_entries (int, optional): Entries kept in the in-memory tier.
+            disk_max_bytes (int, optional): Size bound of the on-disk tier.
+            ttl_sec (float, optional): Age after which an entry is no longer served.
+        """
+        self.cache_dir = cache_dir
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_sec = ttl_sec
+        self._memory = OrderedDict() # key -> (stored_at, value)
+        self._lock = threading.Lock() # Memory tier and counters
+        self._disk_lock = threading.RLock() # Size accounting and eviction of the disk tier
+        self._disk_bytes = None # Computed lazily on the first write
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _is_expired(self, stored_at: float) -> bool:
+        return self.ttl_sec is not None and time.time() - stored_at > self.ttl_sec
+
+    def _remember(self, key: str, stored_at: float, value) -> None:
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str):
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not isinstance(entry.get("stored_at"), (int, float)) or "value" not in entry:
+            # Malformed (e.g. written by an older version), a miss
+            self._remove_disk_entry(path)
+            return None
+        if self._is_expired(entry["stored_at"]):
+            self._remove_disk_entry(path)
+            return None
+        os.utime(path) # Mark as recently used for the LRU eviction
+        return entry
+
+    def _remove_disk_entry(self, path: str) -> bool:
+        with self._disk_lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return False
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+            return True
+
+    def _scan_disk(self) -> list:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict_disk(self) -> None:
+        # Called with the disk lock held
+        entries = sorted(self._scan_disk())
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        evictions = 0
+        for _, _, path in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            if self._remove_disk_entry(path):
+                evictions += 1
+        with self._lock:
+            self.counters["evictions"] += evictions
+
+    def _write_disk(self, key: str, stored_at: float, value) -> None:
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"stored_at": stored_at, "value": value})
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        with self._disk_lock:
+            try:
+                previous_size = os.path.getsize(path) # An overwritten entry no longer counts
+            except OSError:
+                previous_size = 0
+            os.replace(tmp_path, path)
+
+            if self._disk_bytes is None:
+                self._evict_disk()
+            else:
+                self._disk_bytes += len(data.encode("utf-8")) - previous_size
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._evict_disk()
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key, or None on a miss or an expired entry.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._is_expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            self._memory.pop(key, None)
+
+        disk_entry = self._read_disk(key) if self.cache_dir else None
+        with self._lock:
+            if disk_entry is not None:
+                self._remember(key, disk_entry["stored_at"], disk_entry["value"])
+                self.counters["disk_hits"] += 1
+                return disk_entry["value"]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value) -> None:
+        """
+        Stores a JSON serializable value under key in both tiers.
+        """
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, value)
+        if self.cache_dir:
+            try:
+                self._write_disk(key, stored_at, value)
+            except OSError as e:
+                # The disk tier is best effort, the memory tier still serves the entry
+                logger.warning("Could not write response cache entry: %s", e)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.counters["bypassed"] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters together with the hit rate and tier sizes.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+            return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_response_cache() -> ResponseCache:
+    """
+    Returns the process wide response cache used by the app.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
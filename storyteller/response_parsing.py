@@ -0,0 +1,223 @@
+"""
+Parsing of the model answers into a Story.
+
+The standard library JSON parser is tried first, json5 only when the answer is
+not strict JSON. The JSON object is extracted from any surrounding prose or
+markdown fences (Gemma 3 has no structured output), answers cut off by the
+output token cap are repaired, and the result is checked against the
+Story/StoryPart schema. Answers that cannot be recovered raise StoryParseError.
+"""
+import json
+
+import json5
+
+
+class StoryParseError(ValueError):
+    """
+    Raised when a model answer cannot be turned into a valid Story.
+    """
+
+    def __init__(self, message: str, raw_text: str):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+def _strip_fences(text: str) -> str:
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _scan_open_containers(text: str):
+    """
+    Scans JSON text and returns the containers still open at the end, whether the
+    end is inside a string, and the index right after the last complete element
+    of an array (None if there is none).
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_element_end = None
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append((char, index))
+        elif char in "}]" and stack:
+            stack.pop()
+            if char == "}" and stack and stack[-1][0] == "[":
+                last_element_end = (index + 1, list(stack))
+    return stack, in_string, last_element_end
+
+
+def _find_value_end(text: str, start: int):
+    """
+    Returns the index right after the JSON value opening at start, or None if the
+    text ends before the value is closed.
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+
+def _close(text: str, stack: list) -> str:
+    closers = "".join("}" if opening == "{" else "]" for opening, _ in reversed(stack))
+    return text + closers
+
+
+def repair_truncated_json(text: str):
+    """
+    Returns candidate repairs of a JSON text that was cut off, most complete first:
+    the text with the open string and containers closed, then the text cut after
+    the last complete array element (dropping the partial one).
+    """
+    stack, in_string, last_element_end = _scan_open_containers(text)
+    candidates = []
+    if stack:
+        closed = text + '"' if in_string else text
+        closed = closed.rstrip()
+        # A dangling separator or key would still be invalid once closed
+        if closed.endswith(","):
+            closed = closed[:-1]
+        elif closed.endswith(":"):
+            closed += " null"
+        candidates.append(_close(closed, stack))
+    if last_element_end is not None:
+        end, element_stack = last_element_end
+        candidates.append(_close(text[:end], element_stack))
+    return candidates
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text), "json"
+    except ValueError:
+        return json5.loads(text), "json5"
+
+
+def validate_story(data) -> dict:
+    """
+    Checks parsed data against the Story/StoryPart schema and normalizes it.
+
+    A bare list of parts is accepted as the story, a missing or non numeric image
+    number is replaced by the position of the part. A last part without text
+    (from a repaired truncation) is dropped.
+
+    Raises:
+        ValueError: If the data does not describe a story.
+    """
+    if isinstance(data, list):
+        data = {"story": data}
+    if not isinstance(data, dict) or not isinstance(data.get("story"), list):
+        raise ValueError('Expected an object with a "story" list')
+
+    parts = data["story"]
+    if parts and (not isinstance(parts[-1], dict) or not isinstance(parts[-1].get("story_part"), str)):
+        parts = parts[:-1]
+    if not parts:
+        raise ValueError("The story has no parts")
+
+    story = []
+    for position, part in enumerate(parts, start=1):
+        if not isinstance(part, dict) or not isinstance(part.get("story_part"), str):
+            raise ValueError(f"Story part {position} has no story_part text")
+        image = part.get("image")
+        try:
+            image = int(image)
+        except (TypeError, ValueError):
+            image = position
+        story.append({"image": image, "story_part": part["story_part"]})
+    return {"story": story}
+
+
+def parse_story_response_detailed(text: str):
+    """
+    Parses a model answer into a Story and reports how it was recovered.
+
+    Args:
+        text (str): The raw model answer.
+
+    Returns:
+        tuple: (Story dict, method) with method one of "json" (strict JSON),
+               "extracted" (strict JSON inside other text), "json5" or "repaired".
+
+    Raises:
+        StoryParseError: If no valid Story can be recovered.
+    """
+    if not text or not text.strip():
+        raise StoryParseError("The model returned an empty answer", text or "")
+    stripped = _strip_fences(text)
+    errors = []
+
+    # Fast path, the whole answer is strict JSON
+    try:
+        return validate_story(json.loads(stripped)), "json"
+    except ValueError as e:
+        errors.append(f"json: {e}")
+
+    start = stripped.find("{")
+    list_start = stripped.find("[")
+    if start == -1 or (list_start != -1 and list_start < start and '"story"' not in stripped):
+        start = list_start
+    if start == -1:
+        raise StoryParseError("No JSON object found in the model answer", text)
+
+    # Try each balanced JSON value in the answer, skipping surrounding prose
+    while start != -1:
+        value_end = _find_value_end(stripped, start)
+        if value_end is None:
+            break
+        try:
+            data, method = _loads(stripped[start:value_end])
+            return validate_story(data), "extracted" if method == "json" else method
+        except ValueError as e:
+            errors.append(f"value@{start}: {e}")
+        start = stripped.find("{", value_end)
+
+    # The last value never closes: the answer was cut off by the output token cap
+    if start != -1:
+        candidates = repair_truncated_json(stripped[start:])
+        # Every candidate goes through the fast parser before any json5 attempt
+        for loads in (json.loads, json5.loads):
+            for candidate in candidates:
+                try:
+                    return validate_story(loads(candidate)), "repaired"
+                except ValueError as e:
+                    errors.append(f"repair: {e}")
+
+    raise StoryParseError(f"Could not parse the model answer as a story ({errors[-1]})", text)
+
+
+def parse_story_response(text: str) -> dict:
+    """
+    Parses a model answer into a Story dict ({"story": [{"image", "story_part"}]}).
+
+    Raises:
+        StoryParseError: If no valid Story can be recovered.
+    """
+    story, _ = parse_story_response_detailed(text)
+    return story
@@ -0,0 +1,473 @@
+"""
+Process wide admission control of the model requests.
+
+Every Streamlit session (and batch run) of the process sends its requests through
+one RequestScheduler, so a burst of users queues up instead of hitting the
+provider's rate limits all at once. For each model the scheduler keeps:
+- token buckets for the requests per minute and input tokens per minute,
+- a cap on the input tokens of the requests in flight,
+- a bounded wait queue served round robin across sessions, so one session
+  with many requests cannot starve the others.
+Requests failing with 429 or 5xx are retried with jittered exponential backoff,
+and a 429 empties the model's request bucket so every session slows down.
+
+The session and the queue status callback of a request are taken from
+request_context(), which the app sets around a generation.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from google.genai import errors
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT = 8192
+
+# Seconds between two checks of a waiting request (a release wakes threads earlier)
+POLL_INTERVAL_SEC = 0.25
+ASYNC_POLL_INTERVAL_SEC = 0.05
+
+_session_id = contextvars.ContextVar("story_session_id", default=None)
+_queue_callback = contextvars.ContextVar("story_queue_callback", default=None)
+
+
+class SchedulerBusyError(RuntimeError):
+    """
+    Raised when a request cannot be queued (queue full) or waited too long.
+    """
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    """
+    Rate limits of a model on the API.
+    """
+    requests_per_minute: float
+    tokens_per_minute: float
+    concurrent_input_tokens: int = DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT
+
+
+# Free tier limits of the Gemini API, STORY_RATE_LIMITS overrides them (JSON of
+# {"model id": {"requests_per_minute": ..., "tokens_per_minute": ...}})
+MODEL_RATE_LIMITS = {
+    "gemini-2.0-flash": ModelLimits(requests_per_minute=15, tokens_per_minute=1_000_000),
+    "gemma-3-27b-it": ModelLimits(requests_per_minute=30, tokens_per_minute=15_000),
+}
+DEFAULT_MODEL_LIMITS = ModelLimits(requests_per_minute=15, tokens_per_minute=250_000)
+
+
+def load_rate_limits() -> dict:
+    limits = dict(MODEL_RATE_LIMITS)
+    overrides = os.environ.get("STORY_RATE_LIMITS")
+    if overrides:
+        for model_id, values in json.loads(overrides).items():
+            limits[model_id] = ModelLimits(**values)
+    return limits
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket refilled continuously at rate_per_sec up to capacity.
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount tokens are available (0 if they are now).
+        """
+        # A request larger than the bucket would never fit, it waits for a full bucket
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                return 0.0
+            return (amount - self._tokens) / self.rate_per_sec
+
+    def consume(self, amount: float) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """
+        Takes amount tokens if available and returns 0, else returns the seconds to wait.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate_per_sec
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Blocks until amount tokens are taken.
+        """
+        while True:
+            wait = self.try_acquire(amount)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def adjust(self, delta: float) -> None:
+        """
+        Takes delta more tokens (or gives them back if negative), e.g. once the real
+        cost of a request is known. The bucket may go into debt.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+    def drain(self) -> None:
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+class _Ticket:
+    def __init__(self, session_id: str, tokens: int):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class _ModelQueue:
+    def __init__(self, limits: ModelLimits, burst_fraction: float):
+        self.limits = limits
+        self.request_bucket = TokenBucket(
+            limits.requests_per_minute / 60, max(1.0, limits.requests_per_minute * burst_fraction)
+        )
+        self.token_bucket = TokenBucket(limits.tokens_per_minute / 60, limits.tokens_per_minute * burst_fraction)
+        self.sessions = OrderedDict() # session id -> deque of tickets, in round robin order
+        self.size = 0
+        self.in_flight = 0
+        self.in_flight_tokens = 0
+
+    def push(self, ticket: _Ticket) -> None:
+        self.sessions.setdefault(ticket.session_id, deque()).append(ticket)
+        self.size += 1
+
+    def remove(self, ticket: _Ticket) -> None:
+        tickets = self.sessions.get(ticket.session_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            self.size -= 1
+            if not tickets:
+                del self.sessions[ticket.session_id]
+
+    def head(self) -> _Ticket:
+        for tickets in self.sessions.values():
+            return tickets[0]
+        return None
+
+    def position(self, ticket: _Ticket) -> int:
+        # 1-based position when the sessions are served round robin
+        session_ids = list(self.sessions)
+        own_index = session_ids.index(ticket.session_id)
+        rank = self.sessions[ticket.session_id].index(ticket)
+        ahead = rank
+        for index, session_id in enumerate(session_ids):
+            if session_id != ticket.session_id:
+                ahead += min(len(self.sessions[session_id]), rank + (1 if index < own_index else 0))
+        return ahead + 1
+
+    def try_admit(self, ticket: _Ticket) -> float:
+        """
+        Admits the ticket if it is its turn and the limits allow it. Returns 0 when
+        admitted, else the seconds worth waiting before trying again.
+        """
+        if self.head() is not ticket:
+            return POLL_INTERVAL_SEC
+        # A request over the concurrency budget still runs alone, or it would never run
+        if self.in_flight and self.in_flight_tokens + ticket.tokens > self.limits.concurrent_input_tokens:
+            return POLL_INTERVAL_SEC
+        wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(ticket.tokens))
+        if wait > 0:
+            return wait
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(ticket.tokens)
+        self.remove(ticket)
+        # The session goes to the back of the round robin
+        if ticket.session_id in self.sessions:
+            self.sessions.move_to_end(ticket.session_id)
+        self.in_flight += 1
+        self.in_flight_tokens += ticket.tokens
+        return 0.0
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether an API error is worth retrying: rate limited (429) or a server error (5xx).
+    """
+    return isinstance(error, errors.APIError) and (error.code == 429 or (error.code or 0) >= 500)
+
+
+def current_session_id() -> str:
+    """
+    Returns the session set by request_context(), to carry it into another thread or task.
+    """
+    return _session_id.get()
+
+
+def current_queue_callback():
+    """
+    Returns the queue status callback set by request_context(), to carry it into another thread or task.
+    """
+    return _queue_callback.get()
+
+
+@contextmanager
+def request_context(session_id: str = None, on_queue_update=None):
+    """
+    Sets the session and the queue status callback of the requests made inside.
+
+    Args:
+        session_id (str, optional): Requests of one session are served in turn with
+                                    the other sessions' requests.
+        on_queue_update (callable, optional): Called with {"position", "queue_depth",
+                                              "waited_sec"} while a request waits, and
+                                              with "retry_in_sec"/"attempt" before a retry.
+    """
+    session_token = _session_id.set(session_id)
+    callback_token = _queue_callback.set(on_queue_update)
+    try:
+        yield
+    finally:
+        _session_id.reset(session_token)
+        _queue_callback.reset(callback_token)
+
+
+class RequestScheduler:
+    """
+    Admission control and retries of the model requests of the process.
+    """
+
+    def __init__(
+        self,
+        limits: dict = None,
+        max_queue_size: int = 64,
+        max_wait_sec: float = 300,
+        max_retries: int = 4,
+        base_backoff_sec: float = 1.0,
+        max_backoff_sec: float = 30.0,
+        burst_fraction: float = 0.25,
+    ):
+        """
+        Args:
+            limits (dict, optional): {model id: ModelLimits}, MODEL_RATE_LIMITS by default.
+            max_queue_size (int, optional): Requests allowed to wait per model.
+            max_wait_sec (float, optional): Longest a request waits for admission.
+            max_retries (int, optional): Retries of a request failing with 429/5xx.
+            base_backoff_sec (float, optional): Backoff cap of the first retry, doubled every retry.
+            max_backoff_sec (float, optional): Largest backoff cap.
+            burst_fraction (float, optional): Share of a minute's budget that can be spent at once.
+        """
+        self.limits = limits if limits is not None else load_rate_limits()
+        self.max_queue_size = max_queue_size
+        self.max_wait_sec = max_wait_sec
+        self.max_retries = max_retries
+        self.base_backoff_sec = base_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.burst_fraction = burst_fraction
+        self._condition = threading.Condition()
+        self._queues = {}
+        self._random = random.Random()
+        self.retries = 0
+
+    def _queue(self, model_id: str) -> _ModelQueue:
+        queue = self._queues.get(model_id)
+        if queue is None:
+            limits = self.limits.get(model_id, DEFAULT_MODEL_LIMITS)
+            queue = self._queues[model_id] = _ModelQueue(limits, self.burst_fraction)
+        return queue
+
+    def _enqueue(self, model_id: str, estimated_tokens: int) -> tuple:
+        ticket = _Ticket(_session_id.get() or "anonymous", estimated_tokens)
+        with self._condition:
+            queue = self._queue(model_id)
+            if queue.size >= self.max_queue_size:
+                raise SchedulerBusyError(f"Too many requests waiting for {model_id} ({queue.size})")
+            queue.push(ticket)
+        return queue, ticket
+
+    def _try_admit(self, queue: _ModelQueue, ticket: _Ticket) -> tuple:
+        # Returns (wait seconds, status), with 0 seconds once admitted
+        wait = queue.try_admit(ticket)
+        if wait == 0:
+            return 0.0, None
+        waited_sec = time.monotonic() - ticket.enqueued_at
+        if waited_sec > self.max_wait_sec:
+            queue.remove(ticket)
+            self._condition.notify_all()
+            raise SchedulerBusyError(f"Waited {waited_sec:.0f} s for a free slot")
+        status = {"position": queue.position(ticket), "queue_depth": queue.size, "waited_sec": round(waited_sec, 1)}
+        return wait, status
+
+    @staticmethod
+    def _report(status: dict) -> None:
+        callback = _queue_callback.get()
+        if callback is not None and status is not None:
+            callback(status)
+
+    def acquire(self, model_id: str, estimated_tokens: int) -> tuple:
+        """
+        Blocks until the request may be sent and returns its admission (pass it to release).
+
+        Raises:
+            SchedulerBusyError: If the queue is full or the wait exceeds max_wait_sec.
+        """
+        queue, ticket = self._enqueue(model_id, estimated_tokens)
+        try:
+            while True:
+                with self._condition:
+                    wait, status = self._try_admit(queue, ticket)
+                    if wait == 0:
+                        return queue, ticket
+                    self._condition.wait(min(wait, POLL_INTERVAL_SEC))
+                self._report(status)
+        except BaseException:
+            self._abandon(queue, ticket)
+            raise
+
+    async def acquire_async(self, model_id: str, estimated_tokens: int) -> tuple:
+        """
+        acquire for event loops: polls instead of blocking the loop's thread.
+        """
+        queue, ticket = self._enqueue(model_id, estimated_tokens)
+        try:
+            while True:
+                with self._condition:
+                    wait, status = self._try_admit(queue, ticket)
+                if wait == 0:
+                    return queue, ticket
+                self._report(status)
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL_SEC))
+        except BaseException:
+            self._abandon(queue, ticket)
+            raise
+
+    def _abandon(self, queue: _ModelQueue, ticket: _Ticket) -> None:
+        with self._condition:
+            queue.remove(ticket)
+            self._condition.notify_all()
+
+    def release(self, admission: tuple, actual_tokens: int = None) -> None:
+        """
+        Ends an admitted request, charging the token bucket its real input tokens if known.
+        """
+        queue, ticket = admission
+        with self._condition:
+            queue.in_flight -= 1
+            queue.in_flight_tokens -= ticket.tokens
+            if actual_tokens is not None:
+                queue.token_bucket.adjust(actual_tokens - ticket.tokens)
+            self._condition.notify_all()
+
+    def _before_retry(self, model_id: str, error: Exception, attempt: int) -> float:
+        # Full jitter backoff, and a 429 slows every session of the model down
+        if not is_retryable(error) or attempt >= self.max_retries:
+            raise error
+        if error.code == 429:
+            with self._condition:
+                self._queue(model_id).request_bucket.drain()
+        self.retries += 1
+        delay = self._random.uniform(0, min(self.max_backoff_sec, self.base_backoff_sec * 2 ** attempt))
+        logger.warning("%s answered %s, retrying in %.1f s (attempt %d)", model_id, error.code, delay, attempt + 1)
+        self._report({"retry_in_sec": round(delay, 1), "attempt": attempt + 1, "error_code": error.code})
+        return delay
+
+    def run(self, model_id: str, estimated_tokens: int, call, actual_tokens=None):
+        """
+        Runs call() once admitted, retrying it on 429/5xx.
+
+        Args:
+            model_id (str): The model of the request.
+            estimated_tokens (int): Input tokens of the request.
+            call (callable): Sends the request and returns its result.
+            actual_tokens (callable, optional): Returns the real input tokens of a result.
+        """
+        attempt = 0
+        while True:
+            admission = self.acquire(model_id, estimated_tokens)
+            try:
+                result = call()
+            except Exception as e:
+                self.release(admission)
+                delay = self._before_retry(model_id, e, attempt)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.release(admission)
+                raise
+            self.release(admission, actual_tokens(result) if actual_tokens else None)
+            return result
+
+    async def arun(self, model_id: str, estimated_tokens: int, call, actual_tokens=None):
+        """
+        Async run: call() returns an awaitable, waits do not block the event loop.
+        """
+        attempt = 0
+        while True:
+            admission = await self.acquire_async(model_id, estimated_tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                self.release(admission)
+                delay = self._before_retry(model_id, e, attempt)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled, e.g. the losing request of a hedge
+                self.release(admission)
+                raise
+            self.release(admission, actual_tokens(result) if actual_tokens else None)
+            return result
+
+    def stats(self) -> dict:
+        """
+        Returns {model id: {"queued", "in_flight", "in_flight_tokens"}} and the retry count.
+        """
+        with self._condition:
+            models = {
+                model_id: {"queued": queue.size, "in_flight": queue.in_flight, "in_flight_tokens": queue.in_flight_tokens}
+                for model_id, queue in self._queues.items()
+            }
+        return {"models": models, "retries": self.retries}
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> RequestScheduler:
+    """
+    Returns the process wide scheduler shared by all the sessions.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
@@ -0,0 +1,308 @@
+"""
+HTTP API of the story generation, independent of the Streamlit app.
+
+    POST /v1/stories         multipart form: 2 to 5 "images" files, "model",
+                             "language", "fresh" and "hedge". Returns the Story
+                             JSON and the performance log of the request.
+    POST /v1/stories/stream  Same form, answers NDJSON: one {"image", "story_part"}
+                             line per part as soon as it is generated, then a
+                             {"done": true, "log"} line.
+    GET  /healthz            Load of the worker pool.
+    GET  /metrics            Process metrics in the Prometheus text format.
+
+The generations run on a bounded pool of worker threads, sharing the process'
+scheduler, caches and metrics registry. Requests beyond the workers wait in a
+bounded backlog; past it the service answers 503 with a Retry-After header
+instead of queueing without end, as it does when the scheduler turns a request
+down or the model backend is rate limited. Other model backend errors answer
+502. A request keeps its place in the pool until its worker is done, even when
+the client goes away before. Each request is a scheduler session of its own unless the client sends
+an X-Session-Id header.
+
+Usage:
+    uvicorn storyteller.service:app --host 0.0.0.0 --port 8000
+    python -m storyteller.service --port 8000 --fake-backend
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from google.genai import errors
+from PIL import UnidentifiedImageError
+
+from storyteller.context_cache import get_default_context_cache
+from storyteller.core import MODEL_IDS, GenAIAgent, generate_story_with_llm, resolve_model_id, stream_story_with_llm
+from storyteller.hedging import generate_story_hedged
+from storyteller.language_packs import DEFAULT_LANGUAGE, available_languages
+from storyteller.metrics import get_metrics_registry
+from storyteller.response_cache import get_default_response_cache
+from storyteller.response_parsing import StoryParseError
+from storyteller.scheduler import SchedulerBusyError, get_default_scheduler, request_context
+
+DEFAULT_WORKERS = int(os.environ.get("STORY_SERVICE_WORKERS", 8))
+# Requests allowed to wait for a worker, beyond the ones being served
+DEFAULT_MAX_BACKLOG = int(os.environ.get("STORY_SERVICE_MAX_BACKLOG", 16))
+MAX_IMAGE_BYTES = int(float(os.environ.get("STORY_SERVICE_MAX_IMAGE_MB", 10)) * 2**20)
+MIN_IMAGES = 2
+MAX_IMAGES = 5
+RETRY_AFTER_SEC = 5
+
+
+class _WorkerPool:
+    """
+    Thread pool that turns work down once its backlog is full.
+    """
+
+    def __init__(self, workers: int, max_backlog: int):
+        self.workers = max(1, workers)
+        self.max_backlog = max(0, max_backlog)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="story-service")
+        self._lock = threading.Lock()
+        self.admitted = 0 # Requests being served or waiting for a worker
+        self.rejected = 0
+
+    def admit(self) -> None:
+        with self._lock:
+            if self.admitted >= self.workers + self.max_backlog:
+                self.rejected += 1
+                raise _busy("The story service is at capacity")
+            self.admitted += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.admitted -= 1
+
+    def submit(self, context: contextvars.Context, function, *args):
+        # The worker runs in the request's context, so the scheduler sees its session
+        return self.executor.submit(context.run, function, *args)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_backlog": self.max_backlog,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+def _busy(detail: str) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(RETRY_AFTER_SEC)})
+
+
+def _request_error(error: Exception) -> HTTPException:
+    # Maps a failed generation to the status the client should act on
+    if isinstance(error, SchedulerBusyError):
+        return _busy(str(error))
+    if isinstance(error, StoryParseError):
+        return HTTPException(status_code=502, detail="The model's answer could not be read as a story")
+    if isinstance(error, UnidentifiedImageError):
+        return HTTPException(status_code=400, detail="An upload is not a readable image")
+    if isinstance(error, errors.APIError):
+        # The scheduler's retries are spent, the quota comes back later
+        if error.code == 429 or error.status == "RESOURCE_EXHAUSTED":
+            return _busy("The model backend is rate limited")
+        return HTTPException(status_code=502, detail=f"The model backend answered {error.code} {error.status}")
+    return None
+
+
+async def _read_images(images: list) -> list:
+    if not MIN_IMAGES <= len(images) <= MAX_IMAGES:
+        raise HTTPException(status_code=422, detail=f"Upload {MIN_IMAGES} to {MAX_IMAGES} images, got {len(images)}")
+    image_data_list = []
+    for upload in images:
+        data = await upload.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise HTTPException(
+                status_code=413, detail=f"{upload.filename} is larger than {MAX_IMAGE_BYTES // 2**20} MB"
+            )
+        image_data_list.append(data)
+    return image_data_list
+
+
+def _check_options(model: str, language: str) -> str:
+    if model not in MODEL_IDS and model not in MODEL_IDS.values():
+        raise HTTPException(status_code=422, detail=f"Unknown model {model!r}, expected one of {list(MODEL_IDS.values())}")
+    languages = available_languages()
+    if language not in languages:
+        raise HTTPException(status_code=422, detail=f"Unknown language {language!r}, expected one of {languages}")
+    return resolve_model_id(model)
+
+
+def create_app(genai_client=None, workers: int = DEFAULT_WORKERS, max_backlog: int = DEFAULT_MAX_BACKLOG) -> FastAPI:
+    """
+    Builds the service.
+
+    Args:
+        genai_client (optional): Client of the agents, e.g. storyteller.fakes.FakeGenAIClient.
+                                 Defaults to the shared client of GOOGLE_API_KEY.
+        workers (int, optional): Generations running at once.
+        max_backlog (int, optional): Requests waiting for a worker before answering 503.
+    """
+    app = FastAPI(title="Visual Storyteller AI")
+    pool = _WorkerPool(workers, max_backlog)
+    app.state.pool = pool
+
+    def build_agent(model_id: str, language: str) -> GenAIAgent:
+        return GenAIAgent(
+            specified_model_id=model_id,
+            select_system_prompt=language,
+            genai_client=genai_client,
+            response_cache=get_default_response_cache(),
+            context_cache=get_default_context_cache(),
+            scheduler=get_default_scheduler(),
+        )
+
+    def generate(image_data_list, model_id, language, fresh, hedge):
+        agent = build_agent(model_id, language)
+        generate_story = generate_story_hedged if hedge else generate_story_with_llm
+        return generate_story(
+            image_data_list=image_data_list,
+            llm_model_name=model_id,
+            language=language,
+            include_metrics_log=True,
+            ai_handler=agent,
+            bypass_cache=fresh,
+        )
+
+    @app.post("/v1/stories")
+    async def create_story(
+        images: list[UploadFile] = File(...),
+        model: str = Form(GenAIAgent.DEFAULT_FLASH_MODEL_ID),
+        language: str = Form(DEFAULT_LANGUAGE),
+        fresh: bool = Form(False),
+        hedge: bool = Form(False),
+        x_session_id: str = Header(None),
+    ):
+        model_id = _check_options(model, language)
+        image_data_list = await _read_images(images)
+        pool.admit()
+        try:
+            with request_context(x_session_id or uuid.uuid4().hex):
+                context = contextvars.copy_context()
+            running = pool.submit(context, generate, image_data_list, model_id, language, fresh, hedge)
+        except BaseException:
+            pool.release()
+            raise
+        # Released when the worker is done, not when the client goes away while it still runs
+        running.add_done_callback(lambda _: pool.release())
+        try:
+            segments, log = await asyncio.wrap_future(running)
+        except Exception as e:
+            error = _request_error(e)
+            if error is None:
+                raise
+            raise error from e
+        return {"story": [{"image": i + 1, "story_part": part} for i, part in enumerate(segments)], "log": log}
+
+    @app.post("/v1/stories/stream")
+    async def stream_story(
+        images: list[UploadFile] = File(...),
+        model: str = Form(GenAIAgent.DEFAULT_FLASH_MODEL_ID),
+        language: str = Form(DEFAULT_LANGUAGE),
+        fresh: bool = Form(False),
+        x_session_id: str = Header(None),
+    ):
+        model_id = _check_options(model, language)
+        image_data_list = await _read_images(images)
+        pool.admit()
+        log = {}
+        with request_context(x_session_id or uuid.uuid4().hex):
+            context = contextvars.copy_context()
+
+        def stream_parts():
+            # Nothing runs before the first next() in a worker, where a failing setup releases the admission
+            yield from stream_story_with_llm(
+                image_data_list=image_data_list,
+                llm_model_name=model_id,
+                language=language,
+                performance_log=log,
+                ai_handler=build_agent(model_id, language),
+                bypass_cache=fresh,
+            )
+
+        parts = stream_parts()
+        running = None # Future of the worker advancing the generator
+
+        async def next_part():
+            nonlocal running
+            running = pool.submit(context, next, parts, None)
+            return await asyncio.wrap_future(running)
+
+        def finish():
+            # A worker may still be inside the generator (client gone), close it after that worker
+            def close(_=None):
+                pool.submit(context, parts.close).add_done_callback(lambda _: pool.release())
+            if running is None or running.done():
+                close()
+            else:
+                running.add_done_callback(close)
+
+        # The first part is awaited here, so preprocessing and admission errors still get a status code
+        try:
+            first_part = await next_part()
+        except BaseException as e:
+            finish()
+            error = _request_error(e) if isinstance(e, Exception) else None
+            if error is None:
+                raise
+            raise error from e
+
+        async def lines():
+            try:
+                part, index = first_part, 1
+                while part is not None:
+                    yield json.dumps({"image": index, "story_part": part}) + "\n"
+                    part = await next_part()
+                    index += 1
+                yield json.dumps({"done": True, "log": log}) + "\n"
+            except Exception as e:
+                # The status is sent already, the error ends the stream
+                yield json.dumps({"done": True, "error": repr(e)}) + "\n"
+            finally:
+                finish()
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/healthz")
+    async def healthz():
+        return pool.stats()
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(get_metrics_registry().to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the story generation over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Generations running at once")
+    parser.add_argument("--max-backlog", type=int, default=DEFAULT_MAX_BACKLOG,
+                        help="Requests waiting for a worker before answering 503")
+    parser.add_argument("--fake-backend", action="store_true", help="Use the offline fake model backend")
+    args = parser.parse_args()
+
+    genai_client = None
+    if args.fake_backend:
+        from storyteller.fakes import FakeGenAIClient
+        genai_client = FakeGenAIClient()
+    uvicorn.run(create_app(genai_client, args.workers, args.max_backlog), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Incremental parser for streamed story responses.
+
+The model writes {"story": [{"image": ..., "story_part": ...}, ...]} a few tokens
+at a time. IncrementalStoryParser scans the text as it arrives and returns every
+story part as soon as its JSON object is closed, so the app can show it while
+the following parts are still being generated.
+"""
+import json
+
+import json5
+
+
+class IncrementalStoryParser:
+    """
+    Emits the completed StoryPart objects of a streamed response.
+
+    Text outside the JSON (e.g. the markdown fences Gemma 3 adds) is ignored.
+    Braces and brackets inside strings are skipped by tracking string/escape state.
+    Every character is scanned once, and only the text of the part being read is
+    kept for slicing, so a long answer is parsed in linear time.
+    """
+
+    def __init__(self):
+        self._chunks = [] # Everything received so far
+        self._buffer = "" # Received text from the start of the part being read
+        self._buffer_start = 0 # Index of the buffer's first character in the whole text
+        self._position = 0 # Next character to scan
+        self._stack = [] # Open containers, as (opening character, start index)
+        self._in_string = False
+        self._escaped = False
+        self.parts_emitted = 0
+
+    @property
+    def text(self) -> str:
+        """
+        Everything received so far.
+        """
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> list:
+        """
+        Adds a chunk of the response.
+
+        Args:
+            chunk (str): The next piece of the streamed text.
+
+        Returns:
+            list[dict]: Story parts completed by this chunk, in order.
+        """
+        self._chunks.append(chunk)
+        buffer = self._buffer + chunk
+        offset = self._buffer_start
+        completed = []
+        for index in range(self._position, offset + len(buffer)):
+            char = buffer[index - offset]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                # Strings only matter inside the JSON, not in surrounding prose
+                self._in_string = bool(self._stack)
+            elif char in "{[":
+                self._stack.append((char, index))
+            elif char in "}]" and self._stack:
+                opening, start = self._stack.pop()
+                # Story parts are the objects that are elements of an array
+                if char == "}" and opening == "{" and self._stack and self._stack[-1][0] == "[":
+                    part = self._parse_part(buffer[start - offset:index + 1 - offset])
+                    if part is not None:
+                        completed.append(part)
+        self._position = offset + len(buffer)
+
+        # Only an open part is sliced out later, the text before it is not needed again
+        keep_from = self._position
+        for depth, (opening, start) in enumerate(self._stack):
+            if opening == "{" and depth and self._stack[depth - 1][0] == "[":
+                keep_from = start
+                break
+        self._buffer = buffer[keep_from - offset:]
+        self._buffer_start = keep_from
+        self.parts_emitted += len(completed)
+        return completed
+
+    @staticmethod
+    def _parse_part(object_text: str):
+        try:
+            part = json.loads(object_text)
+        except ValueError:
+            try:
+                part = json5.loads(object_text)
+            except ValueError:
+                return None
+        # The app renders the part as it is, only a well formed StoryPart is emitted
+        if not isinstance(part, dict) or not isinstance(part.get("story_part"), str):
+            return None
+        image = part.get("image")
+        if not isinstance(image, int) or isinstance(image, bool):
+            return None
+        return part
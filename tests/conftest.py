@@ -0,0 +1,31 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def repo_cwd(monkeypatch):
+    # The language packs are read from one_shot_examples/, relative to the repository
+    monkeypatch.chdir(REPO_DIR)
+
+
+def write_manifest(tmp_path, album_count: int, images_per_album: int = 3) -> str:
+    """
+    Writes small PNG albums under tmp_path/images and their JSONL manifest.
+    """
+    image_dir = tmp_path / "images"
+    image_dir.mkdir(exist_ok=True)
+    manifest_path = tmp_path / "manifest.jsonl"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for album in range(album_count):
+            images = []
+            for index in range(images_per_album):
+                name = f"album{album}_{index}.png"
+                Image.new("RGB", (16, 16), (album * 40 % 256, index * 60, 90)).save(image_dir / name)
+                images.append(name)
+            f.write(json.dumps({"album_id": f"album{album}", "images": images, "texts": ["t"] * images_per_album}) + "\n")
+    return str(manifest_path)
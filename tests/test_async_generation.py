@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from storyteller import core
+from storyteller.core import (
+    GenAIAgent,
+    Story,
+    get_background_loop,
+    get_shared_client,
+    run_on_background_loop,
+)
+from storyteller.fakes import FakeGenAIClient
+
+CONTENT = ["Write a story.", "Image 1:", "Image 2:"]
+
+
+@pytest.fixture
+def no_shared_clients(monkeypatch):
+    monkeypatch.setattr(core, "_shared_clients", {})
+
+
+def test_shared_client_per_api_key(no_shared_clients):
+    client = get_shared_client("key-a")
+    assert get_shared_client("key-a") is client
+    assert get_shared_client("key-b") is not client
+    assert get_shared_client("key-a", base_url="http://127.0.0.1:9") is not client
+
+
+def test_agents_reuse_the_shared_client(no_shared_clients, monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "key-a")
+    first = GenAIAgent("gemini-2.0-flash", "English")
+    second = GenAIAgent("gemma-3-27b-it", "Spanish")
+    assert first.genai_client is second.genai_client is get_shared_client("key-a")
+    assert GenAIAgent(api_key="key-b").genai_client is get_shared_client("key-b")
+
+
+def test_agent_without_api_key(no_shared_clients, monkeypatch):
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    with pytest.raises(ValueError, match="GOOGLE_API_KEY"):
+        GenAIAgent()
+
+
+def test_sync_wrapper_matches_the_async_call():
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=FakeGenAIClient())
+    text, log = agent.generate_single_response(CONTENT, Story, include_metrics_log=True)
+    async_text, async_log = asyncio.run(agent.agenerate_single_response(CONTENT, Story, include_metrics_log=True))
+    assert async_text == text
+    assert async_log["model_used"] == log["model_used"] == "gemini-2.0-flash"
+    assert agent.generate_single_response(CONTENT, Story) == text
+
+
+def test_async_requests_run_concurrently_from_another_loop():
+    client = FakeGenAIClient(latency_sec=0.3)
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=client)
+
+    async def generate_many():
+        return await asyncio.gather(*(agent.agenerate_single_response(CONTENT, Story) for _ in range(8)))
+
+    start = time.perf_counter()
+    texts = asyncio.run(generate_many())
+    # One after the other would take 2.4 s
+    assert time.perf_counter() - start < 1.5
+    assert len(set(texts)) == 1
+    assert client.request_count == 8
+
+
+def test_async_requests_on_the_background_loop():
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=FakeGenAIClient())
+    text = run_on_background_loop(agent.agenerate_single_response(CONTENT, Story))
+    assert '"story"' in text
+
+
+def test_blocking_call_from_the_background_loop_is_refused():
+    async def blocking_call():
+        coroutine = asyncio.sleep(0)
+        with pytest.raises(RuntimeError, match="Blocking calls"):
+            run_on_background_loop(coroutine)
+        return asyncio.get_running_loop()
+
+    assert run_on_background_loop(blocking_call()) is get_background_loop()
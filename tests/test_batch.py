@@ -0,0 +1,62 @@
+import json
+import logging
+
+from conftest import write_manifest
+from storyteller.batch import BatchRunner, load_manifest
+from storyteller.fakes import FakeGenAIClient
+
+
+def make_runner(tmp_path, genai_client) -> BatchRunner:
+    return BatchRunner(
+        model_id="gemini-2.0-flash",
+        language="English",
+        results_path=str(tmp_path / "results.json"),
+        logs_path=str(tmp_path / "logs.json"),
+        concurrency=2,
+        image_root=str(tmp_path / "images"),
+        genai_client=genai_client,
+        use_scheduler=False,
+    )
+
+
+def test_resume_redoes_only_unfinished_albums(tmp_path, caplog):
+    albums = load_manifest(write_manifest(tmp_path, album_count=6))
+
+    # The first run loses some albums to backend errors, as an interrupted run would
+    first = make_runner(tmp_path, FakeGenAIClient(error_rate=0.5, error_code=503, seed=3))
+    with caplog.at_level(logging.WARNING, logger="storyteller.batch"):
+        first_summary = first.run(albums, show_progress=False)
+    assert len(caplog.records) == first_summary["failed"]
+    assert first_summary["completed"] > 0
+    assert first_summary["failed"] > 0
+    assert first_summary["completed"] + first_summary["failed"] == len(albums)
+
+    client = FakeGenAIClient()
+    second_summary = make_runner(tmp_path, client).run(albums, show_progress=False)
+    assert second_summary == {"completed": first_summary["failed"], "skipped": first_summary["completed"], "failed": 0}
+    assert client.request_count == first_summary["failed"]
+
+    with open(tmp_path / "results.json", "r", encoding="utf-8") as f:
+        results = json.load(f)
+    assert [result["album_id"] for result in results] == [album["album_id"] for album in albums]
+    assert all(len(result["predicted_texts"]) == 3 for result in results)
+
+
+def test_truncated_checkpoint_line_is_redone(tmp_path):
+    albums = load_manifest(write_manifest(tmp_path, album_count=3))
+    runner = make_runner(tmp_path, FakeGenAIClient())
+    runner.run(albums, show_progress=False)
+
+    # A crash while appending leaves the last record cut short
+    with open(runner.checkpoint_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(runner.checkpoint_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:-1])
+        f.write(lines[-1][:20])
+    redone_album = json.loads(lines[-1])["album_id"]
+
+    assert redone_album not in runner.load_checkpoint()
+    client = FakeGenAIClient()
+    summary = make_runner(tmp_path, client).run(albums, show_progress=False)
+    assert summary == {"completed": 1, "skipped": 2, "failed": 0}
+    assert client.request_count == 1
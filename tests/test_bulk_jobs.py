@@ -0,0 +1,90 @@
+import json
+
+from PIL import Image
+
+from storyteller.bulk_jobs import BulkJob
+from storyteller.fakes import FakeGenAIClient
+
+IMAGE_COUNTS = {"album0": 2, "album1": 5, "album2": 3, "album3": 4}
+
+
+def write_manifest(tmp_path, image_counts: dict) -> str:
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    manifest_path = tmp_path / "manifest.jsonl"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for album_id, count in image_counts.items():
+            images = [f"{album_id}_{index}.png" for index in range(count)]
+            for index, name in enumerate(images):
+                Image.new("RGB", (16, 16), (index * 50, 80, 120)).save(image_dir / name)
+            f.write(json.dumps({"album_id": album_id, "images": images, "texts": [album_id] * count}) + "\n")
+    return str(manifest_path)
+
+
+def make_job(tmp_path, client) -> BulkJob:
+    return BulkJob(
+        model_id="gemini-2.0-flash",
+        language="English",
+        results_path=str(tmp_path / "results.json"),
+        logs_path=str(tmp_path / "logs.json"),
+        genai_client=client,
+        image_root=str(tmp_path / "images"),
+        poll_sec=0.001,
+    )
+
+
+def reverse_output(client):
+    # The real output file is not in request order, check that the albums do not rely on it
+    download = client.files.download
+
+    def reversed_download(*, file, destination=None, config=None):
+        download(file=file, destination=destination)
+        with open(destination, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(destination, "w", encoding="utf-8") as f:
+            f.writelines(reversed(lines))
+
+    client.files.download = reversed_download
+
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_results_are_mapped_back_to_their_albums(tmp_path):
+    manifest_path = write_manifest(tmp_path, IMAGE_COUNTS)
+    client = FakeGenAIClient()
+    reverse_output(client)
+    job = make_job(tmp_path, client)
+
+    assert job.run(manifest_path, show_progress=False) == {"completed": len(IMAGE_COUNTS), "failed": 0}
+    results = read_json(job.results_path)
+    assert [result["album_id"] for result in results] == list(IMAGE_COUNTS)
+    for result in results:
+        # The fake writes one part per image, so a result of another album has the wrong length
+        assert len(result["predicted_texts"]) == IMAGE_COUNTS[result["album_id"]]
+        assert result["texts"] == [result["album_id"]] * IMAGE_COUNTS[result["album_id"]]
+    logs = read_json(job.logs_path)
+    assert [log["album_id"] for log in logs] == list(IMAGE_COUNTS)
+    assert all(log["log"]["batch_job"] == "batches/fake-1" for log in logs)
+    assert job.load_state() is None
+
+
+def test_failed_and_unreadable_albums_are_listed(tmp_path):
+    manifest_path = write_manifest(tmp_path, IMAGE_COUNTS)
+    (tmp_path / "images" / "album2_1.png").unlink()
+    client = FakeGenAIClient(error_rate=0.5, error_code=500, seed=1)
+    job = make_job(tmp_path, client)
+
+    summary = job.run(manifest_path, show_progress=False)
+    with open(job.failed_path, "r", encoding="utf-8") as f:
+        failed = {album["album_id"]: album["error"] for album in map(json.loads, f)}
+    assert failed["album2"] == "Not in the job"
+    # The other failures are the error lines of the job
+    assert any("Injected fake error" in error for error in failed.values())
+    results = read_json(job.results_path)
+    assert summary == {"completed": len(results), "failed": len(failed)}
+    assert [result["album_id"] for result in results] == [album_id for album_id in IMAGE_COUNTS if album_id not in failed]
+    for result in results:
+        assert len(result["predicted_texts"]) == IMAGE_COUNTS[result["album_id"]]
@@ -0,0 +1,99 @@
+import io
+import logging
+
+import pytest
+from google.genai import errors
+from PIL import Image
+
+from storyteller.context_cache import ContextCacheManager
+from storyteller.core import GenAIAgent, generate_story_with_llm
+from storyteller.fakes import FakeGenAIClient
+
+MODEL_ID = "gemini-2.0-flash"
+
+
+def album_images(count: int = 3) -> list:
+    images = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), (index * 70, 30, 200)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def generate(client, context_cache) -> tuple:
+    agent = GenAIAgent(
+        specified_model_id=MODEL_ID,
+        select_system_prompt="English",
+        genai_client=client,
+        context_cache=context_cache,
+    )
+    return generate_story_with_llm(
+        image_data_list=album_images(),
+        llm_model_name=MODEL_ID,
+        language="English",
+        include_metrics_log=True,
+        ai_handler=agent,
+    )
+
+
+def test_prefix_is_cached_and_reused():
+    client = FakeGenAIClient(input_tokens_per_request=None)
+    context_cache = ContextCacheManager()
+    for _ in range(2):
+        segments, log = generate(client, context_cache)
+        assert len(segments) == 3
+        assert log["cached_input_tokens"] > 0
+    assert context_cache.stats()["created"] == 1
+
+
+def test_refused_prefix_falls_back_to_full_requests(caplog):
+    # The one-shot prefix is under the backend's minimum cache size
+    client = FakeGenAIClient(input_tokens_per_request=None, context_cache_min_tokens=10**9)
+    context_cache = ContextCacheManager()
+    with caplog.at_level(logging.WARNING, logger="storyteller.context_cache"):
+        for _ in range(2):
+            segments, log = generate(client, context_cache)
+            assert len(segments) == 3
+            assert log["cached_input_tokens"] == 0
+    assert [record.getMessage().startswith("Context caching unavailable") for record in caplog.records] == [True]
+    # The refusal is remembered, the second request does not ask again
+    assert context_cache.stats()["fallbacks"] == 1
+    assert context_cache.stats()["handles"] == 0
+
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_failing_caches_api_falls_back_to_full_requests(monkeypatch, code):
+    client = FakeGenAIClient(input_tokens_per_request=None)
+    context_cache = ContextCacheManager()
+    create = client.caches.create
+    error_class = errors.ClientError if code < 500 else errors.ServerError
+
+    def failing_create(**kwargs):
+        raise error_class(code, {"error": {"code": code, "message": "Injected caches error", "status": "UNAVAILABLE"}})
+
+    monkeypatch.setattr(client.caches, "create", failing_create)
+    segments, log = generate(client, context_cache)
+    assert len(segments) == 3
+    assert log["cached_input_tokens"] == 0
+
+    # A transient failure does not rule the prefix out, it is cached once the API recovers
+    monkeypatch.setattr(client.caches, "create", create)
+    segments, log = generate(client, context_cache)
+    assert len(segments) == 3
+    assert log["cached_input_tokens"] > 0
+
+
+def test_deleted_handle_is_replaced():
+    client = FakeGenAIClient(input_tokens_per_request=None)
+    context_cache = ContextCacheManager()
+    generate(client, context_cache)
+    for name in list(client._cached_contents):
+        client.caches.delete(name=name)
+
+    segments, log = generate(client, context_cache)
+    assert len(segments) == 3
+    assert log["cached_input_tokens"] == 0
+    segments, log = generate(client, context_cache)
+    assert log["cached_input_tokens"] > 0
+    assert context_cache.stats()["created"] == 2
@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import subprocess
+import sys
+
+import pytest
+
+from storyteller import evaluation
+from storyteller.evaluation import (
+    ScoreCache,
+    bleu4,
+    evaluate_results_file,
+    fkgl,
+    inter_repetition,
+    intra_repetition,
+    meteor,
+    parse_results_filename,
+)
+
+ALBUMS = [
+    {
+        "album_id": "1",
+        "texts": ["The cat sat on the mat.", "Then it slept."],
+        "predicted_texts": ["The cat sat on the mat.", "It slept on the mat."],
+    },
+    {
+        "album_id": "2",
+        "texts": ["We went to the beach.", "The sea was cold."],
+        "predicted_texts": ["We went to the beach.", "We went to the sea."],
+    },
+    {"album_id": "3", "texts": ["A quiet day."], "predicted_texts": ["A very quiet day at home."]},
+]
+
+
+def write_results(tmp_path, albums, name="results_gemini20_eng.json") -> str:
+    path = tmp_path / name
+    path.write_text(json.dumps(albums), encoding="utf-8")
+    return str(path)
+
+
+def test_bleu_of_a_matching_prefix_is_the_brevity_penalty():
+    reference = "a b c d e f g h".split()
+    assert bleu4(reference, reference) == pytest.approx(1.0)
+    assert bleu4(reference[:4], reference) == pytest.approx(math.exp(1 - 8 / 4))
+    assert bleu4([], reference) == 0.0
+
+
+@pytest.mark.parametrize(
+    "hypothesis, reference, expected",
+    [
+        # One chunk of m matches: f_mean * (1 - 0.5 * (1 / m) ** 3)
+        ("the cat sat on the mat", "the cat sat on the mat", 1 - 0.5 / 6 ** 3),
+        ("the cat sat", "the cat sat on the mat", 0.5 / (0.9 + 0.1 * 0.5) * (1 - 0.5 / 3 ** 3)),
+        # Two chunks of two matches
+        ("sat mat the cat", "the cat sat mat", 1 - 0.5 * (2 / 4) ** 3),
+        ("dog", "the cat", 0.0),
+    ],
+)
+def test_meteor_known_values(hypothesis, reference, expected):
+    assert meteor(hypothesis.split(), reference.split()) == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.skipif(evaluation.nltk is None, reason="Stem matches need nltk")
+def test_meteor_matches_stems():
+    assert meteor(["cats", "running"], ["cat", "running"], evaluation._stemmer()) == pytest.approx(1 - 0.5 / 2 ** 3)
+
+
+def test_fkgl_formula():
+    # 0.39 * words / sentences + 11.8 * syllables / words - 15.59
+    assert evaluation._fkgl(10, 1, 10) == pytest.approx(0.11)
+    assert evaluation._fkgl(20, 2, 30) == pytest.approx(0.39 * 10 + 11.8 * 1.5 - 15.59)
+
+
+@pytest.mark.skipif(evaluation.textstatistics is None, reason="Needs textstat and pyphen")
+@pytest.mark.parametrize(
+    "text, language, expected",
+    [
+        # 6 words of one syllable in one sentence
+        ("The cat sat on the mat.", "English", 0.39 * 6 + 11.8 - 15.59),
+        # 4 tokens (the period has no syllables) and 5 syllables: el, ga-to, co-me
+        ("El gato come.", "Spanish", 0.39 * 4 + 11.8 * 5 / 4 - 15.59),
+    ],
+)
+def test_fkgl_known_values(text, language, expected):
+    assert fkgl(text, language) == pytest.approx(expected, abs=0.01)
+
+
+@pytest.mark.parametrize(
+    "word, language, syllables",
+    [("little", "English", 2), ("make", "English", 1), ("the", "English", 1), ("poeta", "Spanish", 3), ("ciudad", "Spanish", 2)],
+)
+def test_rule_based_syllables(word, language, syllables):
+    assert evaluation.count_syllables(word, language) == syllables
+
+
+def test_repetition_known_values():
+    # abc bca cab abc: one of the four trigrams repeats, the second part has none
+    assert intra_repetition([list("abcabc")]) == pytest.approx(0.25)
+    assert intra_repetition([list("abcabc"), list("xyz")]) == pytest.approx(0.125)
+    assert intra_repetition([["too", "short"]]) == 0.0
+
+    first = evaluation._trigram_hashes([list("abcd")])
+    second = evaluation._trigram_hashes([list("bcde"), list("ab")])
+    # abc bcd | bcd cde: one of the four trigrams repeats across the stories
+    assert inter_repetition([first, second]) == pytest.approx(0.25)
+    assert inter_repetition([]) == 0.0
+
+
+def test_trigram_hashes_are_stable_across_processes():
+    tokens = [["The", "cat", "sat", "on", "the", "mat"]]
+    script = (
+        "from storyteller.evaluation import _trigram_hashes;"
+        f"print(_trigram_hashes({tokens!r}).tobytes().hex())"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONHASHSEED="123"),
+    ).stdout.strip()
+    assert output == evaluation._trigram_hashes(tokens).tobytes().hex()
+    assert evaluation._trigram_hashes(tokens).size == 4
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        ("results_gemini20_eng.json", ("Gemini 2.0 Flash", "English")),
+        ("results/results_gemma3_spa.json", ("Gemma 3", "Spanish")),
+        ("results_gemma_3_27b_it_eng.json", ("gemma_3_27b_it", "English")),
+    ],
+)
+def test_results_filename(filename, expected):
+    assert parse_results_filename(filename) == expected
+
+
+def test_results_filename_without_language():
+    with pytest.raises(ValueError):
+        parse_results_filename("results_gemini20.json")
+
+
+def test_cached_scores_and_trigrams_are_reused(tmp_path, monkeypatch):
+    results_path = write_results(tmp_path, ALBUMS)
+    cache_dir = str(tmp_path / "cache")
+    first_scores, first_metrics = evaluate_results_file(results_path, "English", ScoreCache(cache_dir))
+    assert [scores["album_id"] for scores in first_scores] == ["1", "2", "3"]
+    assert "trigram_hashes" not in first_scores[0]
+    assert first_scores[0]["bleu"] > first_scores[2]["bleu"]
+    assert 0 < first_metrics["inter_rep"] < 1
+
+    # A new run reads everything from the cache file, the texts are not tokenized again
+    def fail(*args, **kwargs):
+        raise AssertionError("Album scored again")
+
+    monkeypatch.setattr(evaluation, "score_batch", fail)
+    monkeypatch.setattr(evaluation, "word_tokenize", fail)
+    second_scores, second_metrics = evaluate_results_file(results_path, "English", ScoreCache(cache_dir))
+    assert second_scores == first_scores
+    assert second_metrics == pytest.approx(first_metrics)
+
+
+def test_only_changed_albums_are_scored_again(tmp_path, monkeypatch):
+    cache = ScoreCache(str(tmp_path / "cache"))
+    evaluate_results_file(write_results(tmp_path, ALBUMS), "English", cache)
+
+    scored = []
+    score_batch = evaluation.score_batch
+
+    def counting_score_batch(batch, language):
+        scored.extend(album["album_id"] for _, album in batch)
+        return score_batch(batch, language)
+
+    monkeypatch.setattr(evaluation, "score_batch", counting_score_batch)
+    changed = ALBUMS[:2] + [dict(ALBUMS[2], predicted_texts=["A quiet day. A quiet day."])]
+    scores, metrics = evaluate_results_file(write_results(tmp_path, changed), "English", cache)
+    assert scored == ["3"]
+    assert scores[2]["intra_rep"] > 0
+    # The repeated trigrams of the changed story count for the whole file
+    fresh_scores, fresh_metrics = evaluate_results_file(
+        write_results(tmp_path, changed), "English", ScoreCache(str(tmp_path / "fresh"))
+    )
+    assert metrics == pytest.approx(fresh_metrics)
+    assert scores[2]["bleu"] == pytest.approx(fresh_scores[2]["bleu"])
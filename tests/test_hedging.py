@@ -0,0 +1,111 @@
+import io
+import threading
+import time
+
+from google.genai import types
+from PIL import Image
+
+from storyteller.core import GenAIAgent, prepare_story_request, run_on_background_loop
+from storyteller.fakes import FakeGenAIClient
+from storyteller.hedging import HedgePolicy, _race, generate_story_hedged
+from storyteller.metrics import get_metrics_registry
+from storyteller.scheduler import ModelLimits, RequestScheduler, request_context
+
+PRIMARY_MODEL = "gemma-3-27b-it"
+FALLBACK_MODEL = "gemini-2.0-flash"
+
+
+class UnreadableClient(FakeGenAIClient):
+    # Answers with text that is not a story
+    async def _arespond(self, model, contents, config):
+        self._maybe_fail()
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="Sorry, no story.")]))],
+        )
+
+
+def album_images(count: int = 3) -> list:
+    images = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (16, 16), (index * 70, 30, 200)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_scheduler() -> RequestScheduler:
+    limits = ModelLimits(requests_per_minute=6000, tokens_per_minute=10**9)
+    return RequestScheduler(limits={PRIMARY_MODEL: limits, FALLBACK_MODEL: limits}, max_retries=0)
+
+
+def race(primary_client, fallback_client, scheduler, deadline_sec, policy=None):
+    images = album_images()
+    primary_agent = GenAIAgent(PRIMARY_MODEL, "English", genai_client=primary_client, scheduler=scheduler)
+    fallback_agent = GenAIAgent(FALLBACK_MODEL, "English", genai_client=fallback_client, scheduler=scheduler)
+    _, primary_content, _ = prepare_story_request(images, PRIMARY_MODEL, "English", primary_agent)
+    return run_on_background_loop(_race(
+        primary_agent, primary_content, fallback_agent, images, "English",
+        policy or HedgePolicy(), deadline_sec, None, False, "test", None,
+    ))
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    scheduler = make_scheduler()
+    start = time.perf_counter()
+    winner, attempts, reason = race(FakeGenAIClient(latency_sec=5), FakeGenAIClient(), scheduler, deadline_sec=0.05)
+    assert time.perf_counter() - start < 2
+    assert (winner.model_id, reason) == (FALLBACK_MODEL, "deadline")
+    assert [attempt.model_id for attempt in attempts] == [FALLBACK_MODEL]
+    # The cancelled primary gave its admission back
+    assert scheduler.stats()["models"][PRIMARY_MODEL]["in_flight"] == 0
+    assert scheduler.stats()["models"][FALLBACK_MODEL]["in_flight"] == 0
+
+
+def test_fast_primary_is_not_hedged():
+    fallback_client = FakeGenAIClient()
+    winner, attempts, reason = race(FakeGenAIClient(), fallback_client, make_scheduler(), deadline_sec=5)
+    assert (winner.model_id, reason) == (PRIMARY_MODEL, None)
+    assert fallback_client.request_count == 0
+
+
+def test_unreadable_answer_is_hedged():
+    winner, attempts, reason = race(UnreadableClient(), FakeGenAIClient(), make_scheduler(), deadline_sec=5)
+    assert (winner.model_id, reason) == (FALLBACK_MODEL, "invalid_output")
+    assert [(attempt.model_id, attempt.valid) for attempt in attempts] == [(PRIMARY_MODEL, False), (FALLBACK_MODEL, True)]
+
+
+def test_failing_primary_is_hedged():
+    primary_client = FakeGenAIClient(error_rate=1.0, error_code=500)
+    winner, attempts, reason = race(primary_client, FakeGenAIClient(), make_scheduler(), deadline_sec=5)
+    assert (winner.model_id, reason) == (FALLBACK_MODEL, "error")
+
+
+def test_deadline_follows_the_model_request_stage():
+    registry = get_metrics_registry()
+    language = "Deadline test"
+    for _ in range(20):
+        registry.observe_stage("model_request", PRIMARY_MODEL, language, 2.0)
+        # Cache hits and queue waits are in the model stage only
+        registry.observe_stage("model", PRIMARY_MODEL, language, 0.001)
+    assert HedgePolicy(min_samples=20).deadline_for(PRIMARY_MODEL, language) == 2.0
+
+
+def test_queue_updates_reach_the_calling_thread():
+    scheduler = RequestScheduler(
+        limits={PRIMARY_MODEL: ModelLimits(requests_per_minute=6000, tokens_per_minute=10**9, concurrent_input_tokens=1)}
+    )
+    # Another session holds the only slot for a moment, so the hedged request has to wait
+    with request_context("other session"):
+        admission = scheduler.acquire(PRIMARY_MODEL, 1)
+    threading.Timer(0.3, scheduler.release, args=(admission,)).start()
+
+    threads = []
+    agent = GenAIAgent(PRIMARY_MODEL, "English", genai_client=FakeGenAIClient(), scheduler=scheduler)
+    with request_context("app session", lambda status: threads.append((threading.current_thread(), status))):
+        segments = generate_story_hedged(
+            album_images(), PRIMARY_MODEL, "English", ai_handler=agent, policy=HedgePolicy(deadline_sec=10)
+        )
+    assert len(segments) == 3
+    assert threads
+    assert all(thread is threading.current_thread() for thread, _ in threads)
+    assert threads[0][1]["position"] == 1
@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+from storyteller.image_fetcher import ImageFetcher
+from storyteller.mock_server import MockImageServer
+
+IMAGES = {f"/photos/{index}.jpg": bytes([index]) * (1000 + index) for index in range(6)}
+
+
+@pytest.fixture
+def image_server(request):
+    options = getattr(request, "param", {})
+    server = MockImageServer(dict(IMAGES), seed=7, **options).start()
+    yield server
+    server.stop()
+
+
+def make_fetcher(store_dir, **options) -> ImageFetcher:
+    options = {"workers": 4, "per_host_rps": 1000.0, "base_backoff_sec": 0.001, "max_backoff_sec": 0.01, **options}
+    return ImageFetcher(store_dir=str(store_dir), **options)
+
+
+def write_manifest(tmp_path, base_url: str, paths: list) -> str:
+    manifest_path = tmp_path / "manifest.jsonl"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for album in range(0, len(paths), 3):
+            album_paths = paths[album:album + 3]
+            f.write(json.dumps({
+                "album_id": f"album{album // 3}",
+                "images": [path.lstrip("/") for path in album_paths],
+                "image_urls": [base_url + path for path in album_paths],
+                "texts": ["t"] * len(album_paths),
+            }) + "\n")
+    return str(manifest_path)
+
+
+@pytest.mark.parametrize("image_server", [{"error_rate": 0.5, "error_codes": (429, 503)}], indirect=True)
+def test_retries_rate_limited_and_unavailable_answers(tmp_path, image_server):
+    fetcher = make_fetcher(tmp_path / "store", max_retries=10)
+    for path, body in IMAGES.items():
+        record = fetcher.fetch(image_server.base_url + path)
+        assert record["status"] == "ok"
+        with open(record["path"], "rb") as f:
+            assert f.read() == body
+    assert image_server.error_count > 0
+    assert fetcher.stats()["retries"] == image_server.error_count
+    assert fetcher.stats()["failed"] == 0
+
+
+@pytest.mark.parametrize(
+    "image_server", [{"error_rate": 0.5, "error_codes": (429,), "retry_after_sec": 3}], indirect=True
+)
+def test_waits_for_retry_after(tmp_path, image_server, monkeypatch):
+    delays = []
+    monkeypatch.setattr("storyteller.image_fetcher.time.sleep", delays.append)
+    fetcher = make_fetcher(tmp_path / "store", workers=1, max_retries=10)
+    for path in IMAGES:
+        assert fetcher.fetch(image_server.base_url + path)["status"] == "ok"
+    # The backoff is far below the header, every retry waits as long as the host asked
+    assert len(delays) == image_server.error_count > 0
+    assert all(delay == 3 for delay in delays)
+
+
+def test_missing_image_is_not_retried(tmp_path, image_server):
+    fetcher = make_fetcher(tmp_path / "store")
+    url = image_server.base_url + "/photos/missing.jpg"
+    assert fetcher.fetch(url) == {"url": url, "status": "failed", "error": "HTTP 404", "attempts": 1}
+    assert image_server.requests_by_path["/photos/missing.jpg"] == 1
+
+
+def test_resumes_from_the_fetch_log(tmp_path, image_server):
+    paths = list(IMAGES)
+    manifest_path = write_manifest(tmp_path, image_server.base_url, paths)
+    missing_path = paths[4]
+    del image_server.images[missing_path]
+
+    fetcher = make_fetcher(tmp_path / "store")
+    summary = fetcher.fetch_manifest(manifest_path, str(tmp_path / "images"), show_progress=False)
+    assert summary["ok"] == len(paths) - 1
+    assert [failure["image"] for failure in summary["failed"]] == [missing_path.lstrip("/")]
+
+    # The image is back, a new run only downloads it and reuses the logged ones
+    image_server.images[missing_path] = IMAGES[missing_path]
+    fetcher = make_fetcher(tmp_path / "store")
+    summary = fetcher.fetch_manifest(manifest_path, str(tmp_path / "images"), show_progress=False)
+    assert summary == {"images": len(paths), "ok": len(paths), "failed": []}
+    assert fetcher.stats()["downloaded"] == 1
+    assert fetcher.stats()["reused"] == len(paths) - 1
+    assert all(image_server.requests_by_path[path] == 1 for path in paths if path != missing_path)
+    for path, body in IMAGES.items():
+        with open(os.path.join(tmp_path, "images", path.lstrip("/")), "rb") as f:
+            assert f.read() == body
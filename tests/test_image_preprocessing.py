@@ -0,0 +1,107 @@
+import io
+
+import pytest
+from PIL import Image
+
+from storyteller.image_preprocessing import (
+    DecodedImage,
+    ImageBudget,
+    budgeted_size,
+    estimate_image_tokens,
+    preprocess_image,
+    preprocess_images,
+)
+
+GEMINI = "gemini-2.0-flash"
+GEMMA = "gemma-3-27b-it"
+
+
+def encoded(size=(1600, 1200), mode="RGB", color=(20, 140, 90), image_format="PNG", exif=None) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.new(mode, size, color)
+    if exif is not None:
+        image.save(buffer, format=image_format, exif=exif)
+    else:
+        image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def sent_image(part) -> Image.Image:
+    return Image.open(io.BytesIO(part.inline_data.data))
+
+
+@pytest.mark.parametrize(
+    "model_id, size, tokens",
+    [(GEMMA, (4000, 3000), 256), (GEMINI, (300, 200), 258), (GEMINI, (768, 768), 258), (GEMINI, (1600, 700), 3 * 258)],
+)
+def test_image_tokens(model_id, size, tokens):
+    assert estimate_image_tokens(model_id, *size) == tokens
+
+
+def test_images_are_downscaled_to_the_model_budget():
+    part, stats = preprocess_image(encoded(), GEMINI)
+    assert part.inline_data.mime_type == "image/jpeg"
+    assert sent_image(part).size == (768, 576)
+    assert (stats["tokens_before"], stats["tokens_after"]) == (258 * 3 * 2, 258)
+    assert stats["processed_bytes"] < stats["original_bytes"]
+
+    part, _ = preprocess_image(encoded(), GEMMA)
+    assert sent_image(part).size == (896, 672)
+    part, _ = preprocess_image(encoded(), GEMINI, ImageBudget(max_side=200, quality=60))
+    assert sent_image(part).size == (200, 150)
+
+
+def test_small_images_are_not_upscaled():
+    part, _ = preprocess_image(encoded(size=(120, 80)), GEMINI)
+    assert sent_image(part).size == (120, 80)
+
+
+def test_budgeted_size_matches_the_sent_image():
+    assert budgeted_size((1600, 1200), GEMINI) == (768, 576)
+    assert budgeted_size((120, 80), GEMINI) == (120, 80)
+    assert budgeted_size((1600, 1200), GEMINI, ImageBudget(max_side=200)) == (200, 150)
+
+
+def test_metadata_is_stripped_after_applying_the_orientation():
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Rotated 90 degrees clockwise
+    exif[0x010F] = "Camera maker"
+    part, _ = preprocess_image(encoded(size=(400, 200), image_format="JPEG", exif=exif), GEMINI)
+    image = sent_image(part)
+    assert image.size == (200, 400)
+    assert not image.getexif()
+
+
+def test_transparency_is_put_over_white():
+    part, _ = preprocess_image(encoded(size=(50, 50), mode="RGBA", color=(0, 0, 0, 0)), GEMINI)
+    image = sent_image(part)
+    assert image.mode == "RGB"
+    assert all(channel > 245 for channel in image.getpixel((25, 25)))
+
+
+def test_decoded_images_keep_the_upload_size_for_the_report():
+    upload = encoded()
+    source = Image.open(io.BytesIO(upload))
+    source.load()
+    source.thumbnail((896, 896))
+    _, stats = preprocess_image(DecodedImage(source, len(upload), (1600, 1200)), GEMINI)
+    assert stats["original_bytes"] == len(upload)
+    assert stats["tokens_before"] == 258 * 3 * 2
+
+
+def test_request_report_and_order():
+    uploads = [encoded(color=(index * 50, 0, 0)) for index in range(4)]
+    parts, report = preprocess_images(uploads, GEMINI)
+    assert [sent_image(part).getpixel((0, 0))[0] // 50 for part in parts] == [0, 1, 2, 3]
+    assert report["images"] == 4
+    assert report["estimated_image_tokens"] == 4 * 258
+    assert report["estimated_tokens_saved"] == 4 * (258 * 6 - 258)
+    assert report["original_bytes"] == sum(len(upload) for upload in uploads)
+    assert report["bytes_saved"] == report["original_bytes"] - report["processed_bytes"]
+
+
+def test_report_without_the_upload_sizes():
+    image = Image.new("RGB", (100, 100))
+    _, report = preprocess_images([image, encoded()], GEMINI)
+    assert "original_bytes" not in report
+    assert "bytes_saved" not in report
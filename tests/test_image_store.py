@@ -0,0 +1,95 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+from storyteller.image_store import ImageStore
+
+
+def upload(size=(100, 50), color=(10, 120, 200), image_format="PNG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_same_upload_is_decoded_once():
+    store = ImageStore()
+    data = upload()
+    key = store.put(data)
+    assert store.put(bytes(data)) == key
+    assert store.put(upload(color=(0, 0, 0))) != key
+    assert store.stats()["decodes"] == 2
+    assert store.stats()["hits"] == 1
+    assert store.stats()["sources"] == 2
+
+
+def test_concurrent_puts_of_one_upload_decode_it_once():
+    store = ImageStore()
+    data = upload(size=(800, 600))
+    barrier = threading.Barrier(8)
+
+    def put():
+        barrier.wait()
+        store.put(data)
+
+    threads = [threading.Thread(target=put) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.stats()["decodes"] == 1
+    assert store.stats()["entries"] == 1
+
+
+def test_source_is_downscaled_with_the_upload_size_kept():
+    store = ImageStore(source_max_side=64)
+    key = store.put(upload(size=(200, 100), image_format="JPEG"))
+    decoded = store.decoded(key)
+    assert decoded.image.size == (64, 32)
+    assert decoded.original_size == (200, 100)
+    assert decoded.image.mode == "RGB"
+
+
+def test_renditions_are_made_once_and_never_upscaled():
+    store = ImageStore()
+    key = store.put(upload(size=(300, 150)))
+    rendition = store.rendition(key, 100)
+    assert rendition.size == (100, 50)
+    assert store.rendition(key, 100) is rendition
+    assert store.rendition(key, 400) is store.source(key)
+    assert store.stats()["renditions"] == 1
+    assert store.stats()["entries"] == 2
+
+
+def test_memory_cap_evicts_least_recently_used():
+    # Each 100x50 RGB source holds 15000 bytes, three fit under the cap
+    store = ImageStore(max_bytes=3 * 15000 + 100)
+    keys = [store.put(upload(color=(index, 0, 0))) for index in range(3)]
+    store.source(keys[0]) # Now the most recently used
+    new_key = store.put(upload(color=(3, 0, 0)))
+    assert keys[1] not in store
+    assert keys[0] in store and keys[2] in store and new_key in store
+    assert store.stats()["bytes"] <= store.max_bytes
+    assert store.stats()["evictions"] == 1
+    with pytest.raises(KeyError):
+        store.decoded(keys[1])
+
+
+def test_renditions_count_under_the_cap():
+    store = ImageStore(max_bytes=15000 + 100)
+    key = store.put(upload())
+    store.rendition(key, 50)
+    # The 50x25 rendition pushed the source out, the rendition alone remains
+    assert key not in store
+    assert store.stats()["entries"] == 1
+    with pytest.raises(KeyError):
+        store.rendition(key, 60)
+
+
+def test_oversized_image_is_kept_alone():
+    store = ImageStore(max_bytes=1000)
+    first = store.put(upload(color=(1, 1, 1)))
+    second = store.put(upload(color=(2, 2, 2)))
+    assert first not in store and second in store
+    assert store.stats()["entries"] == 1
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from storyteller.core import GenAIAgent, build_regenerate_part_content
+from storyteller.fakes import FakeGenAIClient
+from storyteller.language_packs import PACK_REQUIRED_KEYS, available_languages, get_language_pack
+
+
+def write_pack(packs_dir, language: str, **overrides) -> None:
+    pack_dir = packs_dir / language.lower().replace(" ", "_")
+    pack_dir.mkdir(parents=True)
+    pack = {key: f"{language} {key}" for key in PACK_REQUIRED_KEYS}
+    pack.update(language=language, images=["00.png", "01.png"], regenerate_part_labels={"previous": "Before"})
+    pack.update(overrides)
+    (pack_dir / "pack.json").write_text(json.dumps(pack), encoding="utf-8")
+
+
+def test_languages_are_listed_from_the_pack_directories(tmp_path):
+    write_pack(tmp_path, "Old Norse")
+    write_pack(tmp_path, "English")
+    (tmp_path / "no_pack_here").mkdir()
+    assert available_languages(str(tmp_path)) == ["English", "Old Norse"]
+
+
+def test_languages_are_scanned_once(tmp_path):
+    write_pack(tmp_path, "Spanish")
+    languages = available_languages(str(tmp_path))
+    languages.append("Changed by a caller")
+    write_pack(tmp_path, "Welsh")
+    assert available_languages(str(tmp_path)) == ["Spanish"]
+
+
+def test_pack_is_loaded_once(tmp_path):
+    write_pack(tmp_path, "Old Norse")
+    pack = get_language_pack("Old Norse", str(tmp_path))
+    assert pack.language == "Old Norse"
+    assert pack.image_paths == (
+        str(tmp_path / "old_norse" / "00.png"), str(tmp_path / "old_norse" / "01.png")
+    )
+    assert get_language_pack("Old Norse", str(tmp_path)) is pack
+
+
+def test_incomplete_and_missing_packs(tmp_path):
+    write_pack(tmp_path, "Welsh")
+    pack_path = tmp_path / "welsh" / "pack.json"
+    pack = json.loads(pack_path.read_text(encoding="utf-8"))
+    del pack["image_label"]
+    pack_path.write_text(json.dumps(pack), encoding="utf-8")
+    with pytest.raises(ValueError, match="image_label"):
+        get_language_pack("Welsh", str(tmp_path))
+    with pytest.raises(ValueError, match="No language pack"):
+        get_language_pack("Klingon", str(tmp_path))
+
+
+def test_shipped_packs():
+    assert available_languages() == ["English", "Spanish"]
+    for language in available_languages():
+        pack = get_language_pack(language)
+        assert pack.language == language
+        assert len(pack.image_paths) == 5
+
+
+@pytest.mark.parametrize("language", ["English", "Spanish"])
+def test_system_prompt_is_sent_verbatim(language):
+    # The schema braces of the system prompt were doubled in the original prompt, they are kept as they are
+    pack = get_language_pack(language)
+    assert '{{\n    "story": [' in pack.system_prompt
+    agent = GenAIAgent("gemini-2.0-flash", language, genai_client=FakeGenAIClient())
+    assert agent.active_system_prompt == pack.system_prompt
+
+
+def test_regenerate_prompt_is_formatted_with_the_part_number():
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=FakeGenAIClient())
+    content = build_regenerate_part_content(agent, ["One.", "Two."], 1, "image")
+    assert "Part 2 of the following story" in content[0]
+    assert "{part_number}" not in content[0]
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+from google.genai import errors
+from PIL import Image
+
+from benchmarks.load_test import LoadTest, load_images
+from storyteller.core import GenAIAgent, generate_story_with_llm, get_shared_client, stream_story_with_llm
+from storyteller.latency_profiles import LatencyProfile, load_latency_profiles
+from storyteller.mock_server import MockGenAIServer
+
+GEMINI = "gemini-2.0-flash"
+GEMMA = "gemma-3-27b-it"
+RECORDED = {"gemini": LatencyProfile([(1234, 0.5)]), "gemma": LatencyProfile([(2345, 0.5)])}
+
+
+def small_images(count: int = 5) -> list:
+    # The shipped example photos take seconds to decode, the requests only need some image
+    images = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 48), (index * 50, 100, 20)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+@pytest.fixture
+def server():
+    # Replays 0.05 s per answer
+    server = MockGenAIServer(profiles=RECORDED, time_scale=0.1, seed=0).start()
+    yield server
+    server.stop()
+
+
+def mock_agent(server, model_id: str) -> GenAIAgent:
+    return GenAIAgent(model_id, "English", genai_client=get_shared_client("mock", base_url=server.base_url))
+
+
+def test_recorded_profiles_are_loaded():
+    profiles = load_latency_profiles()
+    assert set(profiles) == {"gemini", "gemma"}
+    input_tokens, elapsed_sec = profiles["gemma"].samples[0]
+    assert input_tokens > 0 and elapsed_sec > 0
+    with pytest.raises(ValueError):
+        LatencyProfile([])
+    assert len(load_images("English")) == 5
+
+
+@pytest.mark.parametrize("model_id, input_tokens", [(GEMINI, 1234), (GEMMA, 2345)])
+def test_pipeline_against_the_mock_server(server, model_id, input_tokens):
+    segments, log = generate_story_with_llm(
+        small_images(3), model_id, "English", include_metrics_log=True,
+        ai_handler=mock_agent(server, model_id), bypass_cache=True,
+    )
+    assert segments == [f"This is the fake story part number {i}." for i in (1, 2, 3)]
+    assert log["input_tokens"] == input_tokens
+    assert log.get("output_tokens_estimated", False) == (model_id == GEMMA)
+    assert server.request_count == 1
+
+
+def test_stream_against_the_mock_server(server):
+    parts = list(stream_story_with_llm(
+        small_images(2), GEMMA, "English", ai_handler=mock_agent(server, GEMMA), bypass_cache=True
+    ))
+    assert parts == ["This is the fake story part number 1.", "This is the fake story part number 2."]
+
+
+def test_injected_errors():
+    server = MockGenAIServer(profiles=RECORDED, time_scale=0.1, error_rate=1.0, error_codes=(503,), seed=0).start()
+    try:
+        with pytest.raises(errors.ServerError) as error:
+            generate_story_with_llm(
+                small_images(2), GEMINI, "English", ai_handler=mock_agent(server, GEMINI), bypass_cache=True
+            )
+        assert error.value.code == 503
+        assert (server.request_count, server.error_count) == (1, 1)
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("mode", ["pipeline", "stream", "agent"])
+def test_load_test_report(server, mode):
+    load_test = LoadTest(
+        mode=mode,
+        model_id=GEMINI,
+        language="English",
+        client=get_shared_client("mock", base_url=server.base_url),
+        images=small_images(),
+        images_per_request=2,
+        seed=0,
+    )
+    report = load_test.run(concurrency=4, request_count=8)
+    assert (report["mode"], report["requests"], report["succeeded"]) == (mode, 8, 8)
+    assert report["error_rate"] == 0
+    # Every request waits at least the 0.05 s replayed latency
+    assert 0.05 <= report["latency_p50_sec"] <= report["latency_p95_sec"] <= report["latency_p99_sec"]
+    assert report["throughput_rps"] > 0
+    assert report["rss_peak_mb"] >= report["rss_before_mb"]
+    assert server.request_count == 8
@@ -0,0 +1,123 @@
+import io
+import json
+import re
+
+import pytest
+from PIL import Image
+
+from storyteller.core import GenAIAgent, generate_story_with_llm, stream_story_with_llm
+from storyteller.fakes import FakeGenAIClient
+from storyteller.metrics import LATENCY_BUCKETS, MetricsRegistry, StageTimer, estimate_text_tokens, percentile
+
+GEMMA = "gemma-3-27b-it"
+
+
+def album_images(count: int = 3) -> list:
+    images = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 48), (index * 80, 10, 10)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def test_text_token_estimate():
+    assert estimate_text_tokens("") == 0
+    assert estimate_text_tokens(None) == 0
+    assert estimate_text_tokens("abcd") == 1
+    assert estimate_text_tokens("abcde") == 2
+
+
+def test_stage_timer_adds_up_the_spans():
+    timer = StageTimer()
+    with timer.span("parsing"):
+        pass
+    timer.record("parsing", 0.5)
+    timer.record("model", 1.25)
+    timer.record("model_request", None)
+    stages = timer.as_dict()
+    assert set(stages) == {"parsing", "model"}
+    assert 0.5 <= stages["parsing"] < 0.6
+    assert stages["model"] == 1.25
+
+
+@pytest.mark.parametrize(
+    "values, percent, expected",
+    [([], 50, None), ([3.0], 99, 3.0), ([1, 2, 3, 4], 50, 2.5), ([1, 2, 3, 4], 90, 3.7), ([1, 2, 3, 4], 100, 4)],
+)
+def test_percentile_interpolates(values, percent, expected):
+    assert percentile(values, percent) == pytest.approx(expected)
+
+
+def test_requests_are_recorded_per_model_and_language(tmp_path):
+    registry = MetricsRegistry(jsonl_path=str(tmp_path / "requests.jsonl"))
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        registry.record_request(
+            {"model_used": GEMMA, "input_tokens": 100, "output_tokens": 50, "elapsed_time_sec": seconds,
+             "stages": {"model": seconds - 0.5, "parsing": 0.01}},
+            "English",
+        )
+    registry.record_request({"model_used": GEMMA, "elapsed_time_sec": 0.02, "cache_hit": True}, "Spanish")
+
+    assert registry.stage_percentile("total", GEMMA, "English", 50) == (2.5, 4)
+    assert registry.stage_percentile("model", GEMMA, "English", 50) == (2.0, 4)
+    assert registry.stage_percentile("model", GEMMA, "Spanish", 50) == (None, 0)
+    summary = registry.percentiles()
+    assert summary[GEMMA]["English"]["total"]["p90"] == pytest.approx(3.7)
+    assert summary[GEMMA]["Spanish"]["total"]["count"] == 1
+
+    lines = (tmp_path / "requests.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[-1])["language"] == "Spanish"
+    assert registry.export_jsonl(str(tmp_path / "export.jsonl")) == 5
+
+
+def test_prometheus_export():
+    registry = MetricsRegistry()
+    for seconds in (0.03, 0.3, 3.0):
+        registry.record_request({"model_used": GEMMA, "elapsed_time_sec": seconds, "input_tokens": 10}, "English")
+    registry.record_error(GEMMA, "English")
+    text = registry.to_prometheus()
+    labels = f'stage="total",model="{GEMMA}",language="English"'
+
+    def value(name, extra=""):
+        match = re.search(rf"^{re.escape(name)}{{{re.escape(labels + extra)}}} (\S+)$", text, re.MULTILINE)
+        return float(match[1])
+
+    # Cumulative buckets
+    assert value("story_stage_duration_seconds_bucket", ',le="0.05"') == 1
+    assert value("story_stage_duration_seconds_bucket", ',le="0.5"') == 2
+    assert value("story_stage_duration_seconds_bucket", f',le="{LATENCY_BUCKETS[-1]}"') == 3
+    assert value("story_stage_duration_seconds_bucket", ',le="+Inf"') == 3
+    assert value("story_stage_duration_seconds_sum") == pytest.approx(3.33)
+    assert value("story_stage_duration_seconds_count") == 3
+    assert value("story_stage_duration_quantile_seconds", ',quantile="0.5"') == pytest.approx(0.3)
+    assert f'story_requests_total{{model="{GEMMA}",language="English"}} 3' in text
+    assert f'story_errors_total{{model="{GEMMA}",language="English"}} 1' in text
+    assert f'story_input_tokens_total{{model="{GEMMA}",language="English"}} 30' in text
+    assert "# TYPE story_stage_duration_seconds histogram" in text
+
+
+def test_story_log_has_the_stages_and_estimated_output_tokens():
+    agent = GenAIAgent(GEMMA, "English", genai_client=FakeGenAIClient())
+    segments, log = generate_story_with_llm(
+        album_images(), GEMMA, "English", include_metrics_log=True, ai_handler=agent, bypass_cache=True
+    )
+    assert len(segments) == 3
+    assert {"image_decode", "preprocessing", "request_build", "model", "model_request", "parsing", "total"} <= set(
+        log["stages"]
+    )
+    # Gemma answers carry no output token count
+    assert log["output_tokens_estimated"] is True
+    assert log["output_tokens"] > 0
+
+
+def test_stream_log_has_the_time_to_first_token():
+    agent = GenAIAgent(GEMMA, "English", genai_client=FakeGenAIClient(stream_chunks=5))
+    log = {}
+    parts = list(stream_story_with_llm(
+        album_images(), GEMMA, "English", performance_log=log, ai_handler=agent, bypass_cache=True
+    ))
+    assert len(parts) == 3
+    assert {"time_to_first_token", "parsing", "rendering", "model", "total"} <= set(log["stages"])
+    assert log["time_to_first_part_sec"] <= log["elapsed_time_sec"]
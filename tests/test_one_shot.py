@@ -0,0 +1,77 @@
+import io
+import threading
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from storyteller import one_shot
+from storyteller.language_packs import get_language_pack
+from storyteller.one_shot import build_few_shot_content, load_one_shot_image_parts
+
+
+@pytest.fixture
+def encodes(monkeypatch):
+    # Counts the example images encoded, from an empty cache
+    calls = []
+    preprocess_image = one_shot.preprocess_image
+
+    def counting_preprocess_image(*args, **kwargs):
+        calls.append(args[0])
+        return preprocess_image(*args, **kwargs)
+
+    monkeypatch.setattr(one_shot, "preprocess_image", counting_preprocess_image)
+    one_shot._load_one_shot_image_parts.cache_clear()
+    yield calls
+    one_shot._load_one_shot_image_parts.cache_clear()
+
+
+def test_images_are_encoded_once_per_process(encodes):
+    parts = load_one_shot_image_parts("English")
+    assert len(encodes) == 5
+    assert load_one_shot_image_parts("English") is parts
+    build_few_shot_content("English")
+    assert len(encodes) == 5
+    load_one_shot_image_parts("Spanish")
+    assert len(encodes) == 10
+
+
+def test_concurrent_first_use_encodes_once(encodes):
+    barrier = threading.Barrier(6)
+
+    def load():
+        barrier.wait()
+        load_one_shot_image_parts("Spanish")
+
+    threads = [threading.Thread(target=load) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(encodes) == 5
+
+
+def test_parts_are_the_example_images_within_budget():
+    parts = load_one_shot_image_parts("English")
+    paths = get_language_pack("English").image_paths
+    for part, path in zip(parts, paths):
+        assert isinstance(part, types.Part)
+        assert part.inline_data.mime_type == "image/jpeg"
+        image = Image.open(io.BytesIO(part.inline_data.data))
+        assert max(image.size) <= one_shot.ONE_SHOT_IMAGE_BUDGET.max_side
+        with Image.open(path) as source:
+            # The aspect ratio of the example is kept
+            assert image.width / image.height == pytest.approx(source.width / source.height, rel=0.02)
+
+
+@pytest.mark.parametrize("language", ["English", "Spanish"])
+def test_few_shot_content(language):
+    pack = get_language_pack(language)
+    content = build_few_shot_content(language)
+    assert content[0] == pack.user_prompt
+    assert content[-1] == pack.example_output
+    labels = content[1:-1:2]
+    assert labels == [f"{pack.image_label} {i}:" for i in range(1, 6)]
+    assert list(content[2:-1:2]) == list(load_one_shot_image_parts(language))
+    # The pixels are sent, not the repr of an image object
+    assert not any("<PIL." in item for item in content if isinstance(item, str))
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from storyteller.core import GenAIAgent, build_regenerate_part_content, regenerate_story_part
+from storyteller.fakes import FakeGenAIClient, build_fake_story_text
+from storyteller.image_preprocessing import ImageBudget
+from storyteller.metrics import get_metrics_registry
+from storyteller.response_parsing import StoryParseError
+
+MODEL = "gemini-2.0-flash"
+STORY_PARTS = ["The first part.", "The second part.", "The third part."]
+
+
+class FirstImageClient(FakeGenAIClient):
+    # Answers about image 1 whichever image it was asked about
+    async def _arespond(self, model, contents, config):
+        text = build_fake_story_text(1)
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        )
+
+
+def image_bytes(size=(16, 16)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 80, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def regenerate(client, part_index=1, **kwargs):
+    agent = GenAIAgent(MODEL, "English", genai_client=client)
+    return agent, regenerate_story_part(
+        image_bytes(), STORY_PARTS, part_index, MODEL, "English", ai_handler=agent, **kwargs
+    )
+
+
+def test_only_the_part_and_its_neighbours_are_sent():
+    agent = GenAIAgent(MODEL, "English", genai_client=FakeGenAIClient())
+    content = build_regenerate_part_content(agent, STORY_PARTS, 2, "image")
+    texts = [item for item in content if isinstance(item, str)]
+    assert any("The second part." in text for text in texts)
+    assert any("The third part." in text for text in texts)
+    assert not any("The first part." in text for text in texts)
+    assert content[-2:] == ["Image 3:", "image"]
+
+
+@pytest.mark.parametrize("part_index", [0, 1, 2])
+def test_new_part_is_the_one_of_its_image(part_index):
+    client = FakeGenAIClient()
+    _, new_part = regenerate(client, part_index)
+    assert new_part == f"This is the fake story part number {part_index + 1}."
+    assert client.request_count == 1
+
+
+def test_part_of_another_image_is_not_spliced_in():
+    counters = get_metrics_registry()._counters
+    errors_before = counters[("errors_total", MODEL, "English")]
+    with pytest.raises(StoryParseError) as error:
+        regenerate(FirstImageClient(), part_index=1)
+    assert "image 2" in str(error.value)
+    assert '"image": 1' in error.value.raw_text
+    assert counters[("errors_total", MODEL, "English")] == errors_before + 1
+
+
+def test_missing_part_index():
+    with pytest.raises(IndexError):
+        regenerate(FakeGenAIClient(), part_index=3)
+
+
+def test_savings_log_counts_the_real_image_sizes():
+    sizes = [(2000, 1500), (300, 200), (1000, 1000)]
+    agent, (new_part, log) = regenerate(
+        FakeGenAIClient(), include_metrics_log=True, album_image_sizes=sizes,
+        image_budget=ImageBudget(max_side=2000),
+    )
+    regeneration = log["regeneration"]
+    # 3x2 tiles, one small image and 2x2 tiles of 258 tokens
+    album_image_tokens = 258 * (6 + 1 + 4)
+    labels = ["Image 1:", "Image 2:", "Image 3:"]
+    full_text_tokens = agent.estimate_input_tokens(agent.build_few_shot_content() + labels)
+    assert regeneration["full_story_input_tokens_estimate"] == full_text_tokens + album_image_tokens
+
+    # The 16 px image of the part is one small image
+    part_content = build_regenerate_part_content(agent, STORY_PARTS, 1, None)[:-1]
+    assert regeneration["input_tokens_estimate"] == agent.estimate_input_tokens(part_content) + 258
+    assert regeneration["input_tokens_saved_estimate"] == (
+        regeneration["full_story_input_tokens_estimate"] - regeneration["input_tokens_estimate"]
+    )
+    assert regeneration["output_tokens_saved_estimate"] > 0
+    assert (regeneration["part"], regeneration["parts"]) == (2, 3)
+
+
+def test_savings_log_without_the_image_sizes():
+    _, (_, log) = regenerate(FakeGenAIClient(), include_metrics_log=True)
+    assert log["regeneration"]["full_story_input_tokens_estimate"] is None
+    assert log["regeneration"]["input_tokens_saved_estimate"] is None
+    assert log["regeneration"]["input_tokens_estimate"] > 0
+
+
+def test_image_sizes_must_match_the_story():
+    with pytest.raises(ValueError):
+        regenerate(FakeGenAIClient(), album_image_sizes=[(100, 100)])
@@ -0,0 +1,150 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from storyteller import response_cache as response_cache_module
+from storyteller.core import GenAIAgent, Story
+from storyteller.fakes import FakeGenAIClient
+from storyteller.response_cache import ResponseCache, make_cache_key
+
+
+class UnreadableClient(FakeGenAIClient):
+    # Answers with text that is not a story
+    async def _arespond(self, model, contents, config):
+        self._maybe_fail()
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="Sorry, no story.")]))],
+        )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(response_cache_module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def story_content() -> list:
+    return ["Image 1:", Image.new("RGB", (8, 8)), "Image 2:", Image.new("RGB", (8, 8), "red")]
+
+
+def test_key_changes_with_what_changes_the_answer():
+    content = story_content()
+    key = make_cache_key(content, "gemini-2.0-flash", "English")
+    assert key == make_cache_key(story_content(), "gemini-2.0-flash", "English")
+    assert key != make_cache_key(content, "gemma-3-27b-it", "English")
+    assert key != make_cache_key(content, "gemini-2.0-flash", "Spanish")
+    assert key != make_cache_key(content[:2] + ["Image 2:", Image.new("RGB", (8, 8), "blue")], "gemini-2.0-flash", "English")
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+    cache = ResponseCache(cache_dir=None, memory_max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_is_shared_and_evicts_the_least_recently_used(tmp_path):
+    entry_bytes = len('{"stored_at": 1000.0, "value": ""}') + 100
+    max_bytes = int(3.5 * entry_bytes)
+    cache = ResponseCache(cache_dir=str(tmp_path), memory_max_entries=1, disk_max_bytes=max_bytes)
+    for index, key in enumerate(["aa", "bb", "cc"]):
+        cache.put(key, "x" * 100)
+        os.utime(cache._entry_path(key), (index, index))
+    # Read from disk, which marks it as recently used
+    assert cache.get("aa") == "x" * 100
+    cache.put("dd", "x" * 100)
+
+    assert cache.stats()["evictions"] == 1
+    assert not os.path.exists(cache._entry_path("bb"))
+    assert cache.stats()["disk_bytes"] <= max_bytes
+    other_process = ResponseCache(cache_dir=str(tmp_path))
+    assert [other_process.get(key) is not None for key in ["aa", "bb", "cc", "dd"]] == [True, False, True, True]
+    assert other_process.stats()["disk_hits"] == 3
+
+
+def test_overwritten_entry_is_counted_once(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put("aa", "first")
+    cache.put("aa", "second, longer")
+    assert cache.stats()["disk_bytes"] == os.path.getsize(cache._entry_path("aa"))
+
+
+def test_expired_entries_are_not_served(tmp_path, clock):
+    cache = ResponseCache(cache_dir=str(tmp_path), ttl_sec=60)
+    cache.put("aa", "value")
+    clock.now += 30
+    assert cache.get("aa") == "value"
+    clock.now += 31
+    assert ResponseCache(cache_dir=str(tmp_path), ttl_sec=60).get("aa") is None
+    assert cache.get("aa") is None
+    assert not os.path.exists(cache._entry_path("aa"))
+
+
+def test_malformed_disk_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    path = cache._entry_path("aa")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"value": "no stored_at"}')
+    assert cache.get("aa") is None
+    assert not os.path.exists(path)
+
+
+def test_memory_hits_do_not_wait_for_a_disk_write(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put("aa", "value")
+    write_started, release_write = threading.Event(), threading.Event()
+    write_disk = cache._write_disk
+
+    def slow_write_disk(*args):
+        write_started.set()
+        release_write.wait(5)
+        write_disk(*args)
+
+    cache._write_disk = slow_write_disk
+    writer = threading.Thread(target=cache.put, args=("bb", "other"))
+    writer.start()
+    assert write_started.wait(5)
+    hit = []
+    reader = threading.Thread(target=lambda: hit.append(cache.get("aa")))
+    reader.start()
+    reader.join(1)
+    assert hit == ["value"]
+    release_write.set()
+    writer.join(5)
+
+
+def test_agent_answers_repeated_requests_from_the_cache(tmp_path):
+    client = FakeGenAIClient()
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=client, response_cache=cache)
+    text, log = agent.generate_single_response(story_content(), Story, include_metrics_log=True)
+    assert log["cache_hit"] is False
+    cached_text, cached_log = agent.generate_single_response(story_content(), Story, include_metrics_log=True)
+    assert (cached_text, cached_log["cache_hit"]) == (text, True)
+    assert client.request_count == 1
+
+    # A fresh sample is asked for, and replaces the cached one
+    agent.generate_single_response(story_content(), Story, bypass_cache=True)
+    assert client.request_count == 2
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_unreadable_answers_are_not_cached(tmp_path):
+    client = UnreadableClient()
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    agent = GenAIAgent("gemini-2.0-flash", "English", genai_client=client, response_cache=cache)
+    for _ in range(2):
+        assert agent.generate_single_response(story_content(), Story) == "Sorry, no story."
+    assert client.request_count == 2
+    assert cache.stats()["memory_entries"] == 0
+    assert cache.stats()["disk_bytes"] is None
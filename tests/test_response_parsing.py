@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from storyteller.response_parsing import (
+    StoryParseError,
+    parse_story_response,
+    parse_story_response_detailed,
+    repair_truncated_json,
+    validate_story,
+)
+
+TWO_PARTS = {"story": [{"image": 1, "story_part": "A cat wakes up."}, {"image": 2, "story_part": "It eats."}]}
+STRICT = json.dumps(TWO_PARTS, indent=2)
+FIRST_PART = '{"story": [{"image": 1, "story_part": "A cat wakes up."}'
+
+
+@pytest.mark.parametrize(
+    "text, method",
+    [
+        (STRICT, "json"),
+        # Gemma 3 wraps its answers in markdown fences
+        (f"```json\n{STRICT}\n```", "json"),
+        (f"Here is your story:\n{STRICT}\nI hope you like it!", "extracted"),
+        ('Notes {not json} then ' + json.dumps(TWO_PARTS), "extracted"),
+        # Trailing commas, single quotes and unquoted keys
+        (
+            "{story: [{'image': 1, 'story_part': 'A cat wakes up.',}, {'image': 2, 'story_part': 'It eats.',},],}",
+            "json5",
+        ),
+        (json.dumps(TWO_PARTS["story"]), "json"),
+    ],
+)
+def test_recovered_answers(text, method):
+    assert parse_story_response_detailed(text) == (TWO_PARTS, method)
+
+
+@pytest.mark.parametrize(
+    "text, parts",
+    [
+        # Cut inside the text of the last part, the partial text is kept
+        (FIRST_PART + ', {"image": 2, "story_part": "It ea', ["A cat wakes up.", "It ea"]),
+        # Cut before the last part has any text, the part is dropped
+        (FIRST_PART + ', {"image": 2, "story_part":', ["A cat wakes up."]),
+        (FIRST_PART + ', {"ima', ["A cat wakes up."]),
+        ("```json\n" + FIRST_PART + ",", ["A cat wakes up."]),
+    ],
+)
+def test_truncated_answers_are_repaired(text, parts):
+    story, method = parse_story_response_detailed(text)
+    assert method == "repaired"
+    assert [part["story_part"] for part in story["story"]] == parts
+    assert [part["image"] for part in story["story"]] == list(range(1, len(parts) + 1))
+
+
+def test_repair_candidates_most_complete_first():
+    text = '{"story": [{"image": 1, "story_part": "a"}, {"image": 2, "story_part": "b'
+    assert repair_truncated_json(text) == [
+        '{"story": [{"image": 1, "story_part": "a"}, {"image": 2, "story_part": "b"}]}',
+        '{"story": [{"image": 1, "story_part": "a"}]}',
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "   ",
+        "I cannot write a story about these images.",
+        '{"title": "No story key"}',
+        '{"story": "not a list"}',
+        '{"story": []}',
+        '{"story": [{"image": 1, "text": "wrong key"}, {"image": 2, "story_part": "ok"}]}',
+        '{"story": [{"image": 1, "story_part": 42}, {"image": 2, "story_part": "ok"}]}',
+    ],
+)
+def test_wrong_shapes_raise(text):
+    with pytest.raises(StoryParseError) as raised:
+        parse_story_response(text)
+    assert raised.value.raw_text == text
+
+
+def test_validate_story_normalizes_the_image_numbers():
+    data = {"story": [{"image": "1", "story_part": "a"}, {"story_part": "b"}, {"image": "three", "story_part": "c"}]}
+    assert validate_story(data) == {
+        "story": [{"image": 1, "story_part": "a"}, {"image": 2, "story_part": "b"}, {"image": 3, "story_part": "c"}]
+    }
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import threading
+
+import pytest
+from google.genai import errors
+
+from storyteller import scheduler as scheduler_module
+from storyteller.scheduler import (
+    DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT,
+    ModelLimits,
+    RequestScheduler,
+    SchedulerBusyError,
+    TokenBucket,
+    _ModelQueue,
+    _Ticket,
+    request_context,
+)
+
+MODEL = "gemini-2.0-flash"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Replaces the scheduler's time module only, the event loops and condition waits keep the real clock
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, "time", clock)
+    return clock
+
+
+def api_error(code: int) -> errors.APIError:
+    error_class = errors.ClientError if code < 500 else errors.ServerError
+    return error_class(code, {"error": {"code": code, "message": "Injected error", "status": "UNAVAILABLE"}})
+
+
+def generous_limits(**overrides) -> ModelLimits:
+    return ModelLimits(**dict({"requests_per_minute": 6000, "tokens_per_minute": 10**9}, **overrides))
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate_per_sec=2, capacity=10)
+    assert bucket.try_acquire(10) == 0
+    assert bucket.try_acquire(4) == pytest.approx(2.0)
+    clock.now += 1
+    assert bucket.try_acquire(2) == 0
+    clock.now += 100
+    assert bucket.wait_time(10) == 0
+    # Larger requests than the bucket wait for a full bucket instead of forever
+    assert bucket.wait_time(50) == 0
+
+
+def test_token_bucket_adjust_and_drain(clock):
+    bucket = TokenBucket(rate_per_sec=1, capacity=10)
+    bucket.adjust(15)
+    assert bucket.wait_time(1) == pytest.approx(6.0)
+    bucket.adjust(-20)
+    assert bucket.wait_time(10) == 0
+    bucket.drain()
+    assert bucket.wait_time(3) == pytest.approx(3.0)
+    bucket.acquire(3)
+    assert clock.sleeps == [pytest.approx(3.0)]
+
+
+def test_request_bucket_limits_the_rate(clock):
+    queue = _ModelQueue(ModelLimits(requests_per_minute=60, tokens_per_minute=10**9), burst_fraction=0.01)
+    first, second = _Ticket("a", 1), _Ticket("a", 1)
+    queue.push(first)
+    queue.push(second)
+    assert queue.try_admit(first) == 0
+    assert queue.try_admit(second) == pytest.approx(1.0)
+    clock.now += 1
+    assert queue.try_admit(second) == 0
+
+
+def test_sessions_are_served_round_robin(clock):
+    queue = _ModelQueue(generous_limits(), burst_fraction=0.25)
+    tickets = [_Ticket("a", 1), _Ticket("a", 1), _Ticket("a", 1), _Ticket("b", 1), _Ticket("c", 1)]
+    for ticket in tickets:
+        queue.push(ticket)
+    assert [queue.position(ticket) for ticket in tickets] == [1, 4, 5, 2, 3]
+
+    served = []
+    while queue.size:
+        ticket = queue.head()
+        assert queue.try_admit(ticket) == 0
+        served.append(ticket)
+    assert [ticket.session_id for ticket in served] == ["a", "b", "c", "a", "a"]
+
+
+def test_only_the_head_is_admitted(clock):
+    queue = _ModelQueue(generous_limits(), burst_fraction=0.25)
+    first, second = _Ticket("a", 1), _Ticket("b", 1)
+    queue.push(first)
+    queue.push(second)
+    assert queue.try_admit(second) > 0
+    assert queue.try_admit(first) == 0
+    assert queue.try_admit(second) == 0
+
+
+def test_concurrent_input_tokens_are_capped(clock):
+    queue = _ModelQueue(generous_limits(), burst_fraction=0.25)
+    assert generous_limits().concurrent_input_tokens == DEFAULT_CONCURRENT_INPUT_TOKENS_LIMIT == 8192
+    running, waiting = _Ticket("a", 8000), _Ticket("b", 500)
+    queue.push(running)
+    queue.push(waiting)
+    assert queue.try_admit(running) == 0
+    assert queue.try_admit(waiting) > 0
+    queue.in_flight -= 1
+    queue.in_flight_tokens -= running.tokens
+    assert queue.try_admit(waiting) == 0
+
+
+def test_oversized_request_runs_alone(clock):
+    queue = _ModelQueue(generous_limits(), burst_fraction=0.25)
+    large = _Ticket("a", 20000)
+    queue.push(large)
+    assert queue.try_admit(large) == 0
+    small = _Ticket("b", 1)
+    queue.push(small)
+    assert queue.try_admit(small) > 0
+
+
+def test_full_queue_is_busy(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits(concurrent_input_tokens=1)}, max_queue_size=1)
+    admission = scheduler.acquire(MODEL, 1)
+    scheduler._enqueue(MODEL, 1)
+    with pytest.raises(SchedulerBusyError):
+        scheduler._enqueue(MODEL, 1)
+    scheduler.release(admission)
+
+
+def test_long_wait_is_busy(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits(concurrent_input_tokens=1)}, max_wait_sec=10)
+    admission = scheduler.acquire(MODEL, 1)
+    outcome = []
+
+    def wait_for_slot():
+        try:
+            scheduler.acquire(MODEL, 1)
+        except SchedulerBusyError as e:
+            outcome.append(e)
+
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    clock.now += 11
+    waiter.join(timeout=5)
+    assert len(outcome) == 1
+    # The request gave up its place in the queue
+    assert scheduler.stats()["models"][MODEL] == {"queued": 0, "in_flight": 1, "in_flight_tokens": 1}
+    scheduler.release(admission)
+
+
+def test_waiting_request_reports_its_position(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits(concurrent_input_tokens=1)})
+    admission = scheduler.acquire(MODEL, 1)
+    statuses = []
+
+    def on_queue_update(status):
+        statuses.append(status)
+        scheduler.release(admission)
+
+    with request_context("waiting session", on_queue_update):
+        second = scheduler.acquire(MODEL, 1)
+    assert statuses[0] == {"position": 1, "queue_depth": 1, "waited_sec": 0.0}
+    scheduler.release(second)
+    assert scheduler.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_retries_with_jittered_backoff(clock, caplog):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits()}, base_backoff_sec=1, max_backoff_sec=3)
+    failures = [api_error(503), api_error(500), api_error(503)]
+
+    def call():
+        if failures:
+            raise failures.pop(0)
+        return "story"
+
+    with caplog.at_level(logging.WARNING, logger="storyteller.scheduler"):
+        assert scheduler.run(MODEL, 10, call) == "story"
+    assert scheduler.retries == 3
+    assert len(clock.sleeps) == 3
+    assert all(0 <= delay <= cap for delay, cap in zip(clock.sleeps, [1, 2, 3]))
+    assert len(caplog.records) == 3
+    assert scheduler.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_rate_limit_drains_the_request_bucket(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits()})
+    bucket = scheduler._queue(MODEL).request_bucket
+    scheduler._before_retry(MODEL, api_error(503), 0)
+    assert bucket.wait_time(1) == 0
+    # A 429 slows every session of the model down, not only the one retrying
+    scheduler._before_retry(MODEL, api_error(429), 0)
+    assert bucket.wait_time(1) == pytest.approx(0.01)
+
+
+def test_errors_that_are_not_retried(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits()}, max_retries=2)
+    with pytest.raises(errors.ClientError):
+        scheduler.run(MODEL, 10, lambda: (_ for _ in ()).throw(api_error(400)))
+    assert scheduler.retries == 0
+
+    with pytest.raises(errors.ServerError):
+        scheduler.run(MODEL, 10, lambda: (_ for _ in ()).throw(api_error(503)))
+    assert scheduler.retries == 2
+    assert scheduler.stats()["models"][MODEL]["in_flight"] == 0
+
+
+def test_cancelled_async_request_releases_its_admission(clock):
+    scheduler = RequestScheduler(limits={MODEL: generous_limits()})
+
+    async def cancelled_run():
+        task = asyncio.ensure_future(scheduler.arun(MODEL, 10, lambda: asyncio.sleep(60)))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_run())
+    assert scheduler.stats()["models"][MODEL] == {"queued": 0, "in_flight": 0, "in_flight_tokens": 0}
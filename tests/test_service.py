@@ -0,0 +1,135 @@
+import asyncio
+import io
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from storyteller import scheduler as scheduler_module
+from storyteller.fakes import FakeGenAIClient
+from storyteller.scheduler import RequestScheduler
+from storyteller.service import RETRY_AFTER_SEC, create_app
+
+
+@pytest.fixture(autouse=True)
+def no_retries(monkeypatch):
+    # Failing requests answer at once instead of after the scheduler's backoff
+    monkeypatch.setattr(scheduler_module, "_default_scheduler", RequestScheduler(max_retries=0))
+
+
+def image_files(count: int = 3) -> list:
+    files = []
+    for index in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 32), (index * 60, 90, 150)).save(buffer, format="PNG")
+        files.append(("images", (f"image{index}.png", buffer.getvalue(), "image/png")))
+    return files
+
+
+def post_story(client, path="/v1/stories", files=None, **form):
+    data = {"model": "gemini-2.0-flash", "language": "English", "fresh": "true", **form}
+    return client.post(path, files=files or image_files(), data=data)
+
+
+def test_story_is_generated():
+    client = TestClient(create_app(FakeGenAIClient()))
+    response = post_story(client)
+    assert response.status_code == 200
+    body = response.json()
+    assert [part["image"] for part in body["story"]] == [1, 2, 3]
+    assert body["story"][0]["story_part"] == "This is the fake story part number 1."
+    assert "elapsed_time_sec" in body["log"]
+    assert client.app.state.pool.stats()["admitted"] == 0
+
+
+@pytest.mark.parametrize(
+    "files, form",
+    [
+        (image_files(1), {}),
+        (image_files(6), {}),
+        (None, {"model": "gpt-4"}),
+        (None, {"language": "Klingon"}),
+    ],
+)
+def test_invalid_requests_are_422(files, form):
+    client = TestClient(create_app(FakeGenAIClient()))
+    assert post_story(client, files=files, **form).status_code == 422
+
+
+def test_unreadable_upload_is_400():
+    client = TestClient(create_app(FakeGenAIClient()))
+    files = image_files(2) + [("images", ("notes.txt", b"not an image", "text/plain"))]
+    response = post_story(client, files=files)
+    assert response.status_code == 400
+    assert client.app.state.pool.stats()["admitted"] == 0
+
+
+def test_full_pool_answers_503():
+    app = create_app(FakeGenAIClient(), workers=1, max_backlog=0)
+    app.state.pool.admit() # Another request holds the only worker
+    response = post_story(TestClient(app))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(RETRY_AFTER_SEC)
+    assert app.state.pool.stats()["rejected"] == 1
+
+
+@pytest.mark.parametrize("error_code, status_code", [(429, 503), (500, 502), (400, 502)])
+def test_model_backend_errors(error_code, status_code):
+    client = TestClient(create_app(FakeGenAIClient(error_rate=1.0, error_code=error_code)))
+    response = post_story(client)
+    assert response.status_code == status_code
+    assert ("Retry-After" in response.headers) == (status_code == 503)
+    assert client.app.state.pool.stats()["admitted"] == 0
+
+
+def test_stream_answers_ndjson():
+    client = TestClient(create_app(FakeGenAIClient(stream_chunks=7)))
+    response = post_story(client, path="/v1/stories/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[:-1] == [
+        {"image": i, "story_part": f"This is the fake story part number {i}."} for i in (1, 2, 3)
+    ]
+    assert lines[-1]["done"] is True
+    assert "log" in lines[-1]
+    assert client.app.state.pool.stats()["admitted"] == 0
+
+
+def test_stream_errors_before_the_first_part_get_a_status():
+    client = TestClient(create_app(FakeGenAIClient(error_rate=1.0, error_code=429)))
+    response = post_story(client, path="/v1/stories/stream")
+    assert response.status_code == 503
+    for _ in range(50):
+        if client.app.state.pool.stats()["admitted"] == 0:
+            break
+        time.sleep(0.02)
+    assert client.app.state.pool.stats()["admitted"] == 0
+
+
+def test_client_gone_keeps_the_admission_until_the_worker_is_done():
+    app = create_app(FakeGenAIClient(latency_sec=1.0), workers=1, max_backlog=0)
+    pool = app.state.pool
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            request = asyncio.create_task(
+                client.post("/v1/stories", files=image_files(), data={"fresh": "true"})
+            )
+            await asyncio.sleep(0.3)
+            request.cancel() # The client disconnects while the worker generates
+            with pytest.raises(asyncio.CancelledError):
+                await request
+            # The worker still runs, a new request would find no free worker
+            assert pool.stats()["admitted"] == 1
+            for _ in range(100):
+                if pool.stats()["admitted"] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            assert pool.stats()["admitted"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from storyteller.stream_parser import IncrementalStoryParser
+
+STORY = {
+    "story": [
+        {"image": 1, "story_part": 'She said "hi" {to} [everyone].'},
+        {"image": 2, "story_part": "A backslash \\ and a brace }"},
+        {"image": 3, "story_part": "The end."},
+    ]
+}
+TEXT = json.dumps(STORY, indent=2)
+
+
+def feed_all(parser, chunks) -> list:
+    parts = []
+    for chunk in chunks:
+        parts.extend(parser.feed(chunk))
+    return parts
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, len(TEXT)])
+def test_parts_split_across_chunks(chunk_size):
+    parser = IncrementalStoryParser()
+    chunks = [TEXT[i:i + chunk_size] for i in range(0, len(TEXT), chunk_size)]
+    assert feed_all(parser, chunks) == STORY["story"]
+    assert parser.parts_emitted == 3
+    assert parser.text == TEXT
+
+
+def test_part_is_emitted_once_closed():
+    parser = IncrementalStoryParser()
+    first_end = TEXT.index("}", TEXT.index("[everyone]")) + 1
+    assert parser.feed(TEXT[:first_end - 1]) == []
+    assert parser.feed(TEXT[first_end - 1:first_end]) == [STORY["story"][0]]
+    assert parser.feed(TEXT[first_end:]) == STORY["story"][1:]
+
+
+def test_fences_and_prose_are_ignored():
+    parser = IncrementalStoryParser()
+    text = 'Here is "your" story {draft}:\n```json\n' + TEXT + "\n```\nEnjoy!"
+    assert feed_all(parser, [text[:30], text[30:]]) == STORY["story"]
+
+
+def test_partial_answer_emits_the_complete_parts_only():
+    parser = IncrementalStoryParser()
+    cut = TEXT.index('"The end')
+    assert parser.feed(TEXT[:cut]) == STORY["story"][:2]
+
+
+@pytest.mark.parametrize(
+    "part",
+    [
+        {"image": 1, "story_part": 42},
+        {"image": 1, "story_part": None},
+        {"image": 1, "text": "wrong key"},
+        {"image": "1", "story_part": "A string image number"},
+        {"image": True, "story_part": "A boolean image number"},
+        {"story_part": "No image number"},
+    ],
+)
+def test_malformed_parts_are_not_emitted(part):
+    parser = IncrementalStoryParser()
+    text = json.dumps({"story": [part, {"image": 2, "story_part": "Fine."}]})
+    assert parser.feed(text) == [{"image": 2, "story_part": "Fine."}]
+
+
+def test_unparseable_objects_are_skipped_and_json5_is_read():
+    parser = IncrementalStoryParser()
+    text = '{"story": [{"image": 1, "story_part": "a" "b"}, {image: 2, story_part: \'json5\',}]}'
+    assert parser.feed(text) == [{"image": 2, "story_part": "json5"}]
+
+
+def test_objects_that_are_not_array_elements_are_not_parts():
+    parser = IncrementalStoryParser()
+    assert parser.feed('{"meta": {"image": 1, "story_part": "not a part"}, "story": []}') == []
+
+
+def test_kept_text_stays_bounded():
+    parser = IncrementalStoryParser()
+    parser.feed('{"story": [')
+    for image in range(1, 501):
+        parser.feed(json.dumps({"image": image, "story_part": "word " * 50}) + ", ")
+        # Only the text after the last complete part is kept
+        assert len(parser._buffer) < 10
+    assert parser.parts_emitted == 500